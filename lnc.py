@@ -4,6 +4,7 @@ from __future__ import print_function, unicode_literals
 import sys
 import os.path
 import gettext
+import argparse
 
 program_path = os.path.dirname(__file__)
 
@@ -12,17 +13,91 @@ gettext.install("lnc",
                 unicode=True)
 
 from lnc.main import NotesCompiler
+from lnc.batch import BatchCompiler, read_project_list
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.pages import (FULL_MODE, SHARD_MODE, MERGE_MODE, PREVIEW_MODE,
+                           parse_page_range)
 from lnc.ui.cli import ConsoleUi
 
-_USAGE = _("Usage: {scriptname} <project_dir> <output_name>\n"
-    "<output_name> should not contain any extension "
-    "(will be added automatically).")
-
-if len(sys.argv) != 3:
-    print(_USAGE.format(scriptname=sys.argv[0]), file=sys.stderr)
-    exit(2)
+parser = argparse.ArgumentParser(
+    description=_("Compiles scanned lecture notes to DjVu and PDF."))
+parser.add_argument("project_dir", nargs="?",
+                    help=_("base directory of the project"))
+parser.add_argument("output_name", nargs="?",
+                    help=_("output file name that should not contain "
+                           "any extension (will be added automatically)"))
+parser.add_argument("--batch", metavar="FILE",
+                    help=_("build all the projects listed in FILE "
+                           "('-' for standard input) on the shared worker "
+                           "pool; each line should contain "
+                           "<project_dir> <output_name>"))
+parser.add_argument("-k", "--keep-going", action="store_true",
+                    help=_("process all the pages that can be processed "
+                           "and report all the errors at the end"))
+parser.add_argument("--trace", metavar="FILE",
+                    help=_("write timing of all the tasks and commands "
+                           "to FILE in the Chrome trace event format"))
+parser.add_argument("--draft", action="store_true",
+                    help=_("build small low-resolution documents for "
+                           "proofreading (with separate cache)"))
+parser.add_argument("--watch", action="store_true",
+                    help=_("keep running and rebuild the documents whenever "
+                           "input images, transform files or TOC change"))
+shard_group = parser.add_mutually_exclusive_group()
+shard_group.add_argument("--shard", metavar="FIRST-LAST",
+                         help=_("build only the pages from FIRST to LAST "
+                                "into shard bundles to be merged later"))
+shard_group.add_argument("--pages", metavar="FIRST-LAST",
+                         help=_("quickly build separate preview documents "
+                                "of the pages from FIRST to LAST"))
+shard_group.add_argument("--merge", action="store_true",
+                         help=_("assemble the documents from all the shard "
+                                "bundles and add TOC"))
+args = parser.parse_args()
 
 ui = ConsoleUi()
-main = NotesCompiler(ui, program_path, sys.argv[1], sys.argv[2])
+if args.batch is not None:
+    if args.project_dir is not None:
+        parser.error(_("project_dir and output_name should not be given "
+                       "together with --batch"))
+    if args.trace is not None:
+        parser.error(_("--trace is not supported in batch mode"))
+    if (args.shard is not None or args.merge or args.pages is not None or
+            args.draft or args.watch):
+        parser.error(_("--shard, --merge, --pages, --draft and --watch "
+                       "are not supported in batch mode"))
+    try:
+        if args.batch == "-":
+            projects = read_project_list(sys.stdin)
+        else:
+            with open(args.batch, "rt") as project_list:
+                projects = read_project_list(project_list)
+    except (IOError, ProgramError) as err:
+        ui.error(err)
+    main = BatchCompiler(ui, program_path, projects,
+                         keep_going=args.keep_going)
+else:
+    if args.output_name is None:
+        parser.error(_("project_dir and output_name are required"))
+    mode = FULL_MODE
+    page_range = None
+    if args.shard is not None or args.pages is not None:
+        mode = SHARD_MODE if args.shard is not None else PREVIEW_MODE
+        try:
+            page_range = parse_page_range(args.shard or args.pages)
+        except ProgramError as err:
+            parser.error(err)
+    elif args.merge:
+        if args.watch:
+            parser.error(_("--watch cannot be used with --merge"))
+        mode = MERGE_MODE
+    main = NotesCompiler(ui, program_path, args.project_dir,
+                         args.output_name,
+                         keep_going=args.keep_going, trace_file=args.trace,
+                         mode=mode, page_range=page_range,
+                         draft=args.draft)
 
-main.run()
+if args.watch:
+    main.watch()
+else:
+    main.run()
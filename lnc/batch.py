@@ -0,0 +1,129 @@
+from __future__ import unicode_literals
+
+import os.path
+import threading
+import traceback
+import ConfigParser
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.jobs import parse_jobs, parse_memory_budget
+from lnc.lib.jobserver import JobServerClient
+from lnc.main import NotesCompiler, WorkerPool
+from lnc.ui.cli import ProjectUi
+
+
+_PROJECT_LIST_ERROR_MSG = _(
+    "Line {linenum} of project list: should be "
+    "<project_dir> <output_name>.")
+
+
+def read_project_list(f):
+    """Returns list of (project_dir, output_name) read from file object 'f'.
+    Each non-empty line that does not start with '#' should contain
+    project directory and output name separated by whitespace.
+    """
+    projects = []
+    for linenum, line in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.rsplit(None, 1)
+        if len(parts) != 2:
+            raise ProgramError(_PROJECT_LIST_ERROR_MSG.format(
+                linenum=linenum))
+        projects.append((parts[0], parts[1]))
+    return projects
+
+
+class BatchCompiler:
+    """Builds several projects at once on the shared WorkerPool.
+
+    Every project goes through its targets in its own thread as usual,
+    while the tasks of all the projects are interleaved on the pool.
+    Pool size and memory budget are taken from the [global] section
+    of the main config.ini; 'jobs' option of every target limits the
+    number of its tasks running at once.
+    """
+    def __init__(self, ui, program_dir, projects, keep_going=False):
+        """
+        'projects' is a list of (project_dir, output_name)
+        """
+        self.ui = ui
+        self.program_dir = program_dir
+        self.projects = projects
+        self.keep_going = keep_going
+        self.failed = []
+        self.lock = threading.Lock()
+
+    def load_global_config(self):
+        filename = os.path.join(self.program_dir, "config.ini")
+        conf = ConfigParser.SafeConfigParser()
+        try:
+            with open(filename, "rt") as conffile:
+                conf.readfp(conffile)
+            jobs = parse_jobs(conf.get("global", "jobs"),
+                              conf.getint("global", "job-memory"))
+            budget = parse_memory_budget(conf.get("global", "memory-budget"))
+        except (IOError, ConfigParser.Error, ValueError, ProgramError) as err:
+            self.ui.error(_(
+                "Error on reading config file {file}:\n{error}")
+                .format(file=filename, error=err))
+        return jobs, budget
+
+    def _run_project(self, compiler, slots):
+        with slots:
+            try:
+                compiler.run()
+                return
+            except SystemExit as err:
+                # UI reports errors by exit()
+                if not err.code:
+                    return
+            except BaseException:
+                compiler.ui.error(traceback.format_exc(), code=None)
+            with self.lock:
+                self.failed.append(compiler.project_dir)
+
+    def run(self):
+        jobs, budget = self.load_global_config()
+        pool = WorkerPool(jobs, budget, JobServerClient.from_environment())
+        ui_lock = threading.Lock()
+        # Do not start serial steps of all the projects at once
+        slots = threading.Semaphore(jobs)
+
+        compilers = []
+        threads = []
+        for project_dir, output_name in self.projects:
+            compiler = NotesCompiler(ProjectUi(project_dir, ui_lock),
+                                     self.program_dir,
+                                     project_dir, output_name,
+                                     keep_going=self.keep_going,
+                                     pool=pool)
+            thread = threading.Thread(target=self._run_project,
+                                      args=(compiler, slots))
+            thread.daemon = True
+            compilers.append(compiler)
+            threads.append(thread)
+
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                # join() without timeout cannot be interrupted by Ctrl-C
+                while thread.is_alive():
+                    thread.join(0.1)
+        except KeyboardInterrupt as err:
+            pool.cancel(err)
+            for compiler in compilers:
+                context = compiler.context
+                if context is not None:
+                    context.cancel()
+            exit(1)
+        pool.close()
+
+        if self.failed:
+            self.ui.error(_("{count} of {total} projects failed:\n{list}")
+                          .format(count=len(self.failed),
+                                  total=len(self.projects),
+                                  list="\n".join(self.failed)),
+                          title=_("Batch build failures"))
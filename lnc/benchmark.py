@@ -0,0 +1,141 @@
+from __future__ import unicode_literals
+
+import os.path
+import time
+import shutil
+
+try:
+    from PIL import Image, ImageChops, ImageStat
+except ImportError:
+    Image = None
+
+from lnc.main import NotesCompiler
+from lnc.lib.plugin import get_plugin
+from lnc.lib.options import get_option
+from lnc.lib.pagestore import PageStore
+from lnc.lib.exceptions import ProgramError
+
+
+# Plugins whose pixel work is done by the image backend
+_BENCHMARKED_PLUGINS = ("prepare", "pdf")
+
+
+def _page_difference(first, second):
+    """Returns (sizes, difference) of two page images where 'difference'
+    is the mean absolute difference of their pixels in percent (None
+    if the sizes differ).
+    """
+    try:
+        first_image = Image.open(first).convert("RGB")
+        second_image = Image.open(second).convert("RGB")
+    except IOError as err:
+        raise ProgramError(_("Cannot compare pages: {error}")
+                           .format(error=err))
+    sizes = (first_image.size, second_image.size)
+    if first_image.size != second_image.size:
+        return sizes, None
+    stat = ImageStat.Stat(ImageChops.difference(first_image, second_image))
+    return sizes, sum(stat.mean) / len(stat.mean) * 100 / 255
+
+
+def compare_pages(first_dir, second_dir):
+    """Compares the prepared pages of two page directories.
+
+    Returns list of (num, first size, second size, difference) sorted
+    by page numbers, where the sizes are (width, height) (None for the
+    pages missing in one of the directories) and 'difference' is
+    the mean absolute difference of the pixels in percent (None if
+    the sizes differ).
+    """
+    if Image is None:
+        raise ProgramError(_("Pillow is required to compare the pages."))
+    first_pages = PageStore(first_dir).pages()
+    second_pages = PageStore(second_dir).pages()
+    result = []
+    for num in sorted(set(first_pages) | set(second_pages)):
+        if num not in first_pages or num not in second_pages:
+            size = Image.open(first_pages.get(num) or
+                              second_pages[num]).size
+            result.append((num,
+                           size if num in first_pages else None,
+                           size if num in second_pages else None,
+                           None))
+            continue
+        sizes, difference = _page_difference(first_pages[num],
+                                             second_pages[num])
+        result.append((num, sizes[0], sizes[1], difference))
+    return result
+
+
+class BackendBenchmark:
+    """Builds the prepare and pdf targets of a project with every
+    image backend in a separate directory, so that their speed
+    and results can be compared.
+    """
+    def __init__(self, ui, program_dir, project_dir, work_dir):
+        """
+        'program_dir' is a base directory of the program that contains
+                      the main configuration file
+        'project_dir' is a base directory of the project
+        'work_dir'    is a directory to build the project in (a
+                      subdirectory is created for every backend; the
+                      project cache and output are not touched)
+        """
+        self.ui = ui
+        self.program_dir = program_dir
+        self.project_dir = project_dir
+        self.work_dir = work_dir
+
+    def backend_dir(self, backend):
+        return os.path.join(self.work_dir, backend)
+
+    def pages_dir(self, compiler):
+        for plugin in compiler.targets:
+            if get_plugin(compiler.conf, plugin.target) == "prepare":
+                return get_option(compiler.conf, plugin.target, "pages-dir")
+        return None
+
+    def _setup(self, backend):
+        compiler = NotesCompiler(self.ui, self.program_dir,
+                                 self.project_dir, "benchmark")
+        compiler.load_global_config()
+        compiler.load_plugins()
+        compiler.load_project_config()
+        compiler.drop_failed_plugins()
+
+        conf = compiler.conf
+        backend_dir = self.backend_dir(backend)
+        conf.set("DEFAULT", "_CACHE", backend_dir)
+        targets = [name for name in conf.get("global", "targets").split()
+                   if get_plugin(conf, name) in _BENCHMARKED_PLUGINS]
+        if not targets:
+            self.ui.error(_("The project has no prepare or pdf targets."))
+        conf.set("global", "targets", " ".join(targets))
+        # Every page is processed by the backend itself
+        for option in ["shared-cache-dir", "remote-cache-url",
+                       "remote-workers"]:
+            conf.set("global", option, "")
+        for name in targets:
+            if not conf.has_section(name):
+                conf.add_section(name)
+                conf.set(name, "__plugin__", name)
+            conf.set(name, "image-backend", backend)
+            if get_plugin(conf, name) == "pdf":
+                conf.set(name, "pdf-file",
+                         os.path.join(backend_dir, name + ".pdf"))
+        compiler.create_targets()
+        compiler.do_plugins_pretest()
+        return compiler
+
+    def run_backend(self, backend):
+        """Builds the project from scratch with 'backend'.
+        Returns (list of (target, seconds), directory of the pages).
+        """
+        shutil.rmtree(self.backend_dir(backend), ignore_errors=True)
+        compiler = self._setup(backend)
+        timings = []
+        for index, plugin in enumerate(compiler.targets):
+            start = time.time()
+            compiler.process_target(index)
+            timings.append((plugin.target, time.time() - start))
+        return timings, self.pages_dir(compiler)
@@ -0,0 +1,106 @@
+from __future__ import unicode_literals
+
+import os
+import re
+import shutil
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from lnc.lib.cache import SharedCache
+
+
+_KEY_RE = re.compile(r"^/([0-9a-f]{64})$")
+
+
+class CacheRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves 'GET /<key>' and 'PUT /<key>' requests of HttpCache."""
+
+    def _key(self):
+        match = _KEY_RE.match(self.path)
+        if not match:
+            self.send_error(400, "Bad cache key")
+            return None
+        return match.group(1)
+
+    def do_GET(self):
+        key = self._key()
+        if key is None:
+            return
+        try:
+            f = open(self.server.cache._path(key), "rb")
+        except IOError:
+            self.send_error(404)
+            return
+        with f:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length",
+                             str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+        # Keep the least recently used order for eviction
+        self.server.cache.touch(key)
+
+    def do_PUT(self):
+        key = self._key()
+        if key is None:
+            return
+        try:
+            length = int(self.headers.get("Content-Length"))
+        except (TypeError, ValueError):
+            self.send_error(411)
+            return
+        tmp = os.path.join(self.server.cache.directory,
+                           "%s.%d.tmp" % (key,
+                                          threading.current_thread().ident))
+        with open(tmp, "wb") as f:
+            while length > 0:
+                data = self.rfile.read(min(length, 1024 * 1024))
+                if not data:
+                    break
+                f.write(data)
+                length -= len(data)
+        if length > 0:
+            os.remove(tmp)
+            self.send_error(400, "Incomplete body")
+            return
+        try:
+            self.server.cache.store(key, tmp)
+        finally:
+            os.remove(tmp)
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+
+class CacheServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Reference server for the remote cache (see HttpCache) keeping
+    the results in SharedCache in 'directory'.
+
+    It is meant for local networks and tests: there is neither
+    authentication nor verification of the uploaded results.
+    """
+    daemon_threads = True
+
+    def __init__(self, directory, address=("127.0.0.1", 0), max_size=0,
+                 verbose=False):
+        """
+        'address'  is (host, port) to listen on (port 0 picks a free one)
+        'max_size' is the maximum size of the cache in megabytes
+                   (0 means no limit)
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, address, CacheRequestHandler)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.cache = SharedCache(directory, max_size)
+        self.verbose = verbose
+
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%d" % (host, port)
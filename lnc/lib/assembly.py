@@ -0,0 +1,150 @@
+from __future__ import unicode_literals
+
+import os
+import threading
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.cache import link_or_copy
+from lnc.lib.process import set_context
+
+
+class StreamingAssembler:
+    """Bundles the pages of a document in page order while the later
+    pages are still being encoded: as soon as all the pages of the next
+    run of 'chunk' pages are ready, they are bundled into a part in
+    a background thread. After the last page is encoded only the parts
+    and the pages of the last run are left to be joined: the number of
+    the inputs of the final run of the bundler is small, but it still
+    copies all the parts into the document, so the time of the final
+    step grows with the size of the document.
+    """
+    def __init__(self, pages, pending, links, bundle, part_name, chunk,
+                 context=None):
+        """
+        'pages'     is the list of the files of all the pages in order
+        'pending'   is the set of the pages being produced by the tasks
+        'links'     is dict mapping the pages to the pending pages
+                    they are links to (see _link_duplicate_pages())
+        'bundle'    is function making the part from the list of pages
+                    (bundle(part, pages))
+        'part_name' is function returning the file name of the part
+                    by its index
+        'context'   is CommandContext of the target (the parts are
+                    bundled with its limits and no more of them are
+                    started after it is cancelled)
+        """
+        self.pages = list(pages)
+        self.pending = set(pending)
+        self.links = {}
+        for link, target in links.items():
+            if target in self.pending:
+                self.links[link] = target
+                self.pending.add(link)
+            elif os.path.exists(target):
+                link_or_copy(target, link)
+        self.bundle = bundle
+        self.part_name = part_name
+        self.chunk = chunk
+        # First page of the part -> (part, its pages)
+        self.parts = {}
+        self.next_chunk = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.error = None
+        self.cancelled = False
+        self.context = context
+        if context is not None:
+            context.add_cancel_callback(self.cancel)
+
+    def cancel(self):
+        """Stops bundling of the parts that are not started yet."""
+        with self.lock:
+            self.cancelled = True
+
+    def page_done(self, page):
+        """Marks 'page' ready. Called by the worker threads."""
+        for link, target in self.links.items():
+            if target == page:
+                try:
+                    link_or_copy(page, link)
+                except EnvironmentError:
+                    # Left for the final assembly
+                    continue
+                self._ready(link)
+        self._ready(page)
+
+    def _ready(self, page):
+        with self.lock:
+            self.pending.discard(page)
+            if self.thread is None and self._next_pages() is not None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def _next_pages(self):
+        """Returns pages of the next part if all of them are ready.
+        The last run of pages is left for the final assembly.
+        Should be called with 'lock' held.
+        """
+        start = self.next_chunk * self.chunk
+        pages = self.pages[start:start + self.chunk]
+        if (self.error is not None or self.cancelled or
+                start + self.chunk >= len(self.pages)
+                or any(page in self.pending for page in pages)):
+            return None
+        return pages
+
+    def _run(self):
+        set_context(self.context)
+        while True:
+            with self.lock:
+                pages = self._next_pages()
+                if pages is None:
+                    self.thread = None
+                    return
+                part = self.part_name(self.next_chunk)
+            try:
+                self.bundle(part, pages)
+            except ProgramError as err:
+                # The pages are joined by the final assembly
+                with self.lock:
+                    self.error = err
+                    self.thread = None
+                return
+            with self.lock:
+                self.parts[pages[0]] = (part, pages)
+                self.next_chunk += 1
+
+    def finish(self, input_files):
+        """Waits for the part being bundled and returns 'input_files'
+        with the runs of the pages that are bundled replaced by their
+        parts.
+        """
+        while True:
+            with self.lock:
+                thread = self.thread
+            if thread is None:
+                break
+            thread.join(0.1)
+        result = []
+        index = 0
+        while index < len(input_files):
+            part, pages = self.parts.get(input_files[index], (None, None))
+            if pages is not None and \
+                    input_files[index:index + len(pages)] == pages:
+                result.append(part)
+                index += len(pages)
+            else:
+                result.append(input_files[index])
+                index += 1
+        return result
+
+    def remove_parts(self):
+        if self.context is not None:
+            self.context.remove_cancel_callback(self.cancel)
+        for part, pages in self.parts.values():
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+        self.parts = {}
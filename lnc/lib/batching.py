@@ -0,0 +1,118 @@
+from __future__ import unicode_literals
+
+import os
+import errno
+
+from lnc.lib.exceptions import ProgramError, CommandCancelledError
+from lnc.lib.process import set_timeout_scale
+
+
+# Estimated memory (in megabytes, see estimate_memory()) of all the
+# pages of a batch. It stands for the work done by a batch: small pages
+# are grouped by many, large ones take long enough to amortize the start
+# of the tool by themselves
+BATCH_COST = 512
+
+
+def make_batches(tasks, key, max_size, max_cost=BATCH_COST):
+    """Splits 'tasks' into lists of consecutive tasks with equal
+    'key(task)' (tasks with None key are never batched), so that every
+    list has at most 'max_size' tasks and their total '__memory__'
+    is at most 'max_cost' (or the list holds a single task).
+    """
+    batches = []
+    batch = []
+    batch_key = None
+    cost = 0
+    for task in tasks:
+        task_key = key(task)
+        task_cost = task.get("__memory__", 0)
+        if (not batch or task_key is None or task_key != batch_key or
+                len(batch) >= max_size or cost + task_cost > max_cost):
+            batch = []
+            batches.append(batch)
+            batch_key = task_key
+            cost = 0
+        batch.append(task)
+        cost += task_cost
+        if task_key is None:
+            # Nothing may join it
+            batch_key = object()
+    return batches
+
+
+def convert_script(pages):
+    """Returns ImageMagick command line processing all the pages
+    in a single run. 'pages' is list of (arguments, output) where
+    'arguments' read and process one image. They should set all
+    the settings they rely on, as settings are kept for the following
+    images.
+    """
+    cmd = ["convert"]
+    for args, output in pages[:-1]:
+        cmd += args + ["-write", output, "+delete"]
+    args, output = pages[-1]
+    return cmd + args + [output]
+
+
+def make_batch_task(tasks, func):
+    """Returns task running 'tasks' at once with 'func(tasks)'.
+    If it fails, the tasks are run one by one with their handlers,
+    so the errors are reported for the pages they belong to.
+    """
+    return {
+        "__handler__": handler,
+        "num": tasks[0].get("num"),
+        "batch": tasks,
+        "batch-handler": func,
+        # Pages are processed one after another
+        "__memory__": max(task.get("__memory__", 0) for task in tasks),
+        # Run where the pages are
+        "__local__": True}
+
+
+def _remove_outputs(tasks):
+    for task in tasks:
+        try:
+            # Outputs may be hard links to other files
+            os.remove(task["output"])
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+
+def handler(info):
+    tasks = info["batch"]
+    _remove_outputs(tasks)
+    # 'timeout' is meant for a single page
+    set_timeout_scale(len(tasks))
+    try:
+        info["batch-handler"](tasks)
+        return
+    except ProgramError as err:
+        # Remove the pages written before the failure
+        _remove_outputs(tasks)
+        if isinstance(err, CommandCancelledError):
+            raise
+    except BaseException:
+        _remove_outputs(tasks)
+        raise
+    finally:
+        set_timeout_scale(1)
+    # Find the failed pages
+    errors = []
+    for index, task in enumerate(tasks):
+        try:
+            task["__handler__"](task)
+        except ProgramError as err:
+            _remove_outputs([task])
+            if isinstance(err, CommandCancelledError):
+                _remove_outputs(tasks[index:])
+                raise
+            errors.append(_("Page {num}: {error}")
+                          .format(num=task.get("num"), error=err))
+        except BaseException:
+            _remove_outputs(tasks[index:])
+            raise
+    if errors:
+        raise ProgramError("\n".join(errors))
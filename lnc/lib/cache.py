@@ -0,0 +1,325 @@
+from __future__ import unicode_literals
+
+import os
+import json
+import errno
+import shutil
+import hashlib
+import threading
+from subprocess import Popen, PIPE, STDOUT
+
+from lnc.lib.io import mkdir_p, needs_update
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.http_cache import HttpCache
+
+
+_MEGABYTE = 1024 * 1024
+
+# Part of the maximum size left after eviction, so it does not
+# happen again on every store
+_EVICT_RATIO = 0.9
+
+# Suffix of the files keeping the last access time of the entries
+_ACCESS_SUFFIX = ".access"
+
+
+def _file_hash(filename):
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+
+
+def link_or_copy(source, dest):
+    """Makes 'dest' a hard link to 'source' or its copy if linking
+    is not possible (e.g. they are on different file systems).
+    'dest' is replaced atomically.
+    """
+    tmp = "%s.%d.%d.tmp" % (dest, os.getpid(), threading.current_thread().ident)
+    _remove(tmp)
+    try:
+        os.link(source, tmp)
+    except OSError as err:
+        if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                             errno.ENOTSUP):
+            raise
+        shutil.copyfile(source, tmp)
+    try:
+        os.rename(tmp, dest)
+    finally:
+        # rename() does nothing if 'dest' is already a link to 'source'
+        _remove(tmp)
+
+
+def _unshare(filename):
+    """Replaces 'filename' (a link to a cache entry) with its own copy,
+    which is newer than the entry.
+    """
+    tmp = "%s.%d.%d.tmp" % (filename, os.getpid(),
+                            threading.current_thread().ident)
+    try:
+        shutil.copyfile(filename, tmp)
+        os.rename(tmp, filename)
+    finally:
+        _remove(tmp)
+
+
+def make_key(inputs, params):
+    """Returns the cache key for the result produced from the files
+    listed in 'inputs' with JSON-serializable 'params'.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(params, sort_keys=True).encode("utf8"))
+    for filename in inputs:
+        h.update(_file_hash(filename).encode("ascii"))
+    return h.hexdigest()
+
+
+def tool_version(command_line_list):
+    """Returns the output of the command printing the version of
+    a tool (ignoring its exit status) or empty string if it cannot
+    be run.
+    """
+    try:
+        proc = Popen(command_line_list, stdout=PIPE, stderr=STDOUT)
+    except OSError:
+        return ""
+    output = proc.communicate()[0]
+    return output.decode("utf8", "replace")
+
+
+class SharedCache:
+    """Content-addressed store of the task results shared by all
+    the projects.
+
+    Entries are keyed by the hashes of the task inputs and by
+    the parameters affecting the result (including the version
+    of the tool that produces it). Results are hard-linked to the
+    output files, so identical pages of different projects take
+    the space only once. When the total size of the entries exceeds
+    the limit the least recently used ones are removed.
+
+    The store can be used by several processes at once: entries
+    are written atomically and a missing entry is just a miss.
+    """
+    def __init__(self, directory, max_size=0):
+        """
+        'directory' is the directory of the store
+        'max_size'  is the maximum total size of the entries
+                    in megabytes (0 means no limit)
+        """
+        self.directory = directory
+        self.max_size = max_size * _MEGABYTE
+        self.size = None
+        self.lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def touch(self, key):
+        """Marks the entry for 'key' as used now.
+
+        The time is kept in a separate file: the entry itself is
+        hard-linked to the outputs of the projects, so changing its
+        modification time would change theirs too.
+        """
+        try:
+            open(self._path(key) + _ACCESS_SUFFIX, "wb").close()
+        except IOError as err:
+            # The entry is removed by another process
+            if err.errno != errno.ENOENT:
+                raise
+
+    def fetch(self, key, dest):
+        """Puts the entry for 'key' to 'dest' and returns True
+        or returns False if there is no such entry.
+        """
+        path = self._path(key)
+        try:
+            _remove(dest)
+            link_or_copy(path, dest)
+        except (OSError, IOError) as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return False
+        self.touch(key)
+        return True
+
+    def store(self, key, source):
+        """Adds 'source' file as the entry for 'key'."""
+        path = self._path(key)
+        mkdir_p(os.path.dirname(path))
+        link_or_copy(source, path)
+        self.touch(key)
+        if not self.max_size:
+            return
+        with self.lock:
+            if self.size is None:
+                self.size = self._total_size()
+            else:
+                self.size += os.path.getsize(source)
+            if self.size > self.max_size:
+                self.evict(int(self.max_size * _EVICT_RATIO))
+
+    def _entries(self):
+        """Returns list of (access time, size, path) for all
+        the entries.
+        """
+        entries = []
+        try:
+            subdirs = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for subdir in subdirs:
+            subdir = os.path.join(self.directory, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if name.endswith((".tmp", _ACCESS_SUFFIX)):
+                    continue
+                path = os.path.join(subdir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # Removed by another process
+                    continue
+                try:
+                    access = os.path.getmtime(path + _ACCESS_SUFFIX)
+                except OSError:
+                    access = st.st_mtime
+                entries.append((access, st.st_size, path))
+        return entries
+
+    def _total_size(self):
+        return sum(size for access, size, path in self._entries())
+
+    def evict(self, limit):
+        """Removes the least recently used entries until their total
+        size is not greater than 'limit' bytes.
+        """
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+        for access, entry_size, path in entries:
+            if size <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            _remove(path + _ACCESS_SUFFIX)
+            size -= entry_size
+        self.size = size
+
+
+class LayeredCache:
+    """Local cache (SharedCache or None) backed by a remote one
+    (HttpCache). Results got from the remote cache are added
+    to the local one.
+    """
+    def __init__(self, local, remote):
+        self.local = local
+        self.remote = remote
+
+    def fetch(self, key, dest):
+        if self.local is not None and self.local.fetch(key, dest):
+            return True
+        if not self.remote.fetch(key, dest):
+            return False
+        if self.local is not None:
+            self.local.store(key, dest)
+        return True
+
+    def store(self, key, source):
+        if self.local is not None:
+            self.local.store(key, source)
+        self.remote.store(key, source)
+
+
+# HttpCache objects by URL, so all the targets share their uploaders
+_remote_caches = {}
+_remote_caches_lock = threading.Lock()
+
+
+def _get_option(conf, option, default):
+    if not conf.has_option("global", option):
+        return default
+    return conf.get("global", option).strip()
+
+
+def _open_remote_cache(conf):
+    url = _get_option(conf, "remote-cache-url", "")
+    if not url:
+        return None
+    upload = True
+    if conf.has_option("global", "remote-cache-upload"):
+        upload = conf.getboolean("global", "remote-cache-upload")
+    with _remote_caches_lock:
+        if url not in _remote_caches:
+            try:
+                _remote_caches[url] = HttpCache(url, upload)
+            except ValueError as err:
+                raise ProgramError(_(
+                    "Incorrect 'remote-cache-url' value:\n{error}")
+                    .format(error=err))
+        return _remote_caches[url]
+
+
+def open_cache(conf):
+    """Returns the cache configured in the [global] section of
+    'conf' or None if it is disabled.
+    """
+    local = None
+    directory = _get_option(conf, "shared-cache-dir", "")
+    if directory:
+        max_size = 0
+        if conf.has_option("global", "shared-cache-size"):
+            max_size = conf.getint("global", "shared-cache-size")
+        local = SharedCache(os.path.expanduser(directory), max_size)
+    remote = _open_remote_cache(conf)
+    if remote is None:
+        return local
+    return LayeredCache(local, remote)
+
+
+def flush_uploads():
+    """Waits for the uploads to all the remote caches to finish."""
+    with _remote_caches_lock:
+        caches = list(_remote_caches.values())
+    for cache in caches:
+        cache.flush()
+
+
+def run_cached(info, inputs, params, func):
+    """Produces info["output"] by calling 'func()' unless the result
+    is found in info["cache"] (as returned by open_cache() or None)
+    under the key made from 'inputs' and 'params'. The new result
+    is added to the cache.
+    """
+    cache = info.get("cache")
+    output = info["output"]
+    if cache is None:
+        func()
+        return
+    params = dict(params, extension=os.path.splitext(output)[1])
+    key = make_key(inputs, params)
+    if cache.fetch(key, output):
+        if any(needs_update(source, output) for source in inputs):
+            # The entry is older than the inputs (e.g. it is stored by
+            # another project): the output would be built again on every
+            # run, and touching the entry would change the outputs
+            # of the other projects
+            _unshare(output)
+        return
+    # The old output may be a link to the cache entry
+    _remove(output)
+    func()
+    cache.store(key, output)
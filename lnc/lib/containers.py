@@ -0,0 +1,124 @@
+from __future__ import unicode_literals
+
+import re
+import struct
+import hashlib
+
+from lnc.lib.exceptions import ProgramError
+
+
+# Multi-page files of scanners holding all the pages of an input
+# subdirectory
+CONTAINER_RE = r"^[^.].*[.](tif|tiff|pdf)$"
+
+# Integer TIFF field types: BYTE, SHORT and LONG
+_TIFF_TYPES = {1: b"B", 3: b"H", 4: b"I"}
+_WIDTH = 256
+_HEIGHT = 257
+_STRIP_OFFSETS = 273
+_STRIP_BYTE_COUNTS = 279
+_TILE_OFFSETS = 324
+_TILE_BYTE_COUNTS = 325
+
+
+def is_container(filename):
+    return re.match(CONTAINER_RE, filename) is not None
+
+
+def is_pdf(filename):
+    return filename.endswith(".pdf")
+
+
+def frame_source(filename, frame, density=300):
+    """Returns ImageMagick arguments reading frame 'frame' (counting
+    from 0) of the container 'filename'. PDF pages are rasterized
+    with 'density' dpi.
+    """
+    source = ["%s[%d]" % (filename, frame)]
+    if is_pdf(filename):
+        return ["-density", str(density)] + source
+    return source
+
+
+def _read(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Unexpected end of file")
+    return data
+
+
+def _read_ifd(f, order, offset):
+    """Returns (tags, offset of the next IFD) for the TIFF image file
+    directory at 'offset'. Only integer tags are read, their values
+    are lists.
+    """
+    f.seek(offset)
+    count = struct.unpack(order + b"H", _read(f, 2))[0]
+    entries = [struct.unpack(order + b"HHI4s", _read(f, 12))
+               for i in xrange(count)]
+    next_offset = struct.unpack(order + b"I", _read(f, 4))[0]
+    tags = {}
+    for tag, kind, values, value in entries:
+        fmt = _TIFF_TYPES.get(kind)
+        if fmt is None:
+            continue
+        size = struct.calcsize(fmt) * values
+        if size > 4:
+            f.seek(struct.unpack(order + b"I", value)[0])
+            data = _read(f, size)
+        else:
+            data = value[:size]
+        tags[tag] = list(struct.unpack(order + fmt * values, data))
+    return tags, next_offset
+
+
+def _tiff_frames(f):
+    """Returns list of tags of all the frames of TIFF file 'f'
+    or None if it is not a TIFF file.
+    """
+    magic = f.read(8)
+    if magic[0:4] == b"II*\0":
+        order = b"<"
+    elif magic[0:4] == b"MM\0*":
+        order = b">"
+    else:
+        return None
+    offset = struct.unpack(order + b"I", magic[4:8])[0]
+    frames = []
+    seen = set()
+    while offset and offset not in seen:
+        seen.add(offset)
+        tags, offset = _read_ifd(f, order, offset)
+        frames.append(tags)
+    return frames
+
+
+def _frame_digest(f, tags):
+    """Returns digest of the size and the image data of the frame."""
+    h = hashlib.sha256()
+    h.update(struct.pack(b"<II", tags[_WIDTH][0], tags[_HEIGHT][0]))
+    offsets = tags.get(_STRIP_OFFSETS) or tags[_TILE_OFFSETS]
+    counts = tags.get(_STRIP_BYTE_COUNTS) or tags[_TILE_BYTE_COUNTS]
+    for offset, count in zip(offsets, counts):
+        f.seek(offset)
+        h.update(_read(f, count))
+    return h.hexdigest()
+
+
+def frame_digests(filename):
+    """Returns list of digests of the image data of all the frames
+    of the container 'filename' or None if they cannot be found
+    without rasterizing it (PDF). Frames of TIFF files are read
+    directly, so a frame is known to be changed without extracting it.
+    """
+    if is_pdf(filename):
+        return None
+    try:
+        with open(filename, "rb") as f:
+            frames = _tiff_frames(f)
+            if frames is None:
+                raise ValueError("Not a TIFF file")
+            return [_frame_digest(f, tags) for tags in frames]
+    except (IOError, ValueError, KeyError, IndexError, struct.error) as err:
+        raise ProgramError(_("Cannot read pages of '{file}': {error}")
+                           .format(file=filename, error=err))
@@ -0,0 +1,314 @@
+from __future__ import unicode_literals
+
+import os
+import sys
+import json
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import traceback
+import SocketServer
+
+from lnc.lib.exceptions import (ProgramError, CommandCancelledError,
+                                WorkerConnectionError)
+from lnc.lib.process import CommandContext, set_context
+
+
+_PROTOCOL_VERSION = 1
+_LENGTH = struct.Struct(b"!I")
+_BLOCK_SIZE = 1024 * 1024
+_CONNECT_TIMEOUT = 10
+
+# Task keys set by the handlers that are sent back with the output
+_RESULT_KEYS = ("page-digests",)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        data = sock.recv(min(size, _BLOCK_SIZE))
+        if not data:
+            raise WorkerConnectionError(_("Connection closed."))
+        chunks.append(data)
+        size -= len(data)
+    return b"".join(chunks)
+
+
+def send_message(sock, header, blobs=()):
+    """Sends JSON-serializable dict 'header' followed by the binary
+    strings from 'blobs'.
+    """
+    header = dict(header, sizes=[len(blob) for blob in blobs])
+    data = json.dumps(header).encode("utf8")
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+    for blob in blobs:
+        sock.sendall(blob)
+
+
+def recv_message(sock):
+    """Returns (header, blobs) sent by send_message()."""
+    size = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))[0]
+    header = json.loads(_recv_exactly(sock, size).decode("utf8"))
+    blobs = [_recv_exactly(sock, blob_size)
+             for blob_size in header.get("sizes", [])]
+    return header, blobs
+
+
+def _read_file(filename):
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+def _write_file(filename, data):
+    """Writes 'data' to 'filename' replacing it atomically."""
+    tmp = "%s.%d.tmp" % (filename, threading.current_thread().ident)
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.rename(tmp, filename)
+
+
+def _is_plain_value(value):
+    return isinstance(value, (basestring, int, long, float, bool,
+                              type(None)))
+
+
+def _input_keys(task):
+    """Returns the keys of 'task' naming its input files."""
+    return task.get("__inputs__", ["input"])
+
+
+def is_shippable(task):
+    """Returns True if 'task' can be run by a remote worker: its
+    handler is a module-level function, its input and output
+    files are known and it is not marked with '__local__'.
+    """
+    handler = task["__handler__"]
+    module = sys.modules.get(getattr(handler, "__module__", None))
+    return (not task.get("__local__") and "output" in task and
+            all(key in task for key in _input_keys(task)) and
+            getattr(module, getattr(handler, "__name__", ""), None)
+            is handler)
+
+
+class RemoteWorker:
+    """Connection to a worker process (see WorkerServer) running
+    tasks one at a time. It is (re)connected on demand.
+    """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.jobs = 1
+        self.broken = False
+        self.lock = threading.Lock()
+
+    def name(self):
+        return "%s:%d" % (self.host, self.port)
+
+    def connect(self):
+        """Connects to the worker and returns the number of tasks
+        it is ready to run at once.
+        """
+        try:
+            sock = socket.create_connection((self.host, self.port),
+                                            _CONNECT_TIMEOUT)
+            sock.settimeout(None)
+            hello = recv_message(sock)[0]
+        except (socket.error, WorkerConnectionError, ValueError) as err:
+            self.broken = True
+            raise WorkerConnectionError(_(
+                "Cannot connect to worker {worker}: {error}")
+                .format(worker=self.name(), error=err))
+        if hello.get("version") != _PROTOCOL_VERSION:
+            sock.close()
+            self.broken = True
+            raise WorkerConnectionError(_(
+                "Worker {worker} uses incompatible protocol version.")
+                .format(worker=self.name()))
+        with self.lock:
+            self.sock = sock
+        self.jobs = max(int(hello.get("jobs", 1)), 1)
+        return self.jobs
+
+    def close(self):
+        with self.lock:
+            sock, self.sock = self.sock, None
+        if sock is not None:
+            sock.close()
+
+    def abort(self):
+        """Interrupts the task being run (called from other threads)."""
+        with self.lock:
+            if self.sock is not None:
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+    def run_task(self, task, context):
+        """Runs 'task' on the worker and puts its result to
+        task["output"]. Raises WorkerConnectionError if the worker
+        cannot be used and ProgramError if the task has failed.
+        """
+        if self.sock is None:
+            self.connect()
+        inputs = _input_keys(task)
+        blobs = [_read_file(task[key]) for key in inputs]
+        request = {
+            "handler": "%s:%s" % (task["__handler__"].__module__,
+                                  task["__handler__"].__name__),
+            "task": dict((key, value) for key, value in task.items()
+                         if not key.startswith("_") and
+                         _is_plain_value(value)),
+            "inputs": inputs,
+            "timeout": context.timeout,
+            "max-memory": context.max_memory}
+        context.add_cancel_callback(self.abort)
+        try:
+            send_message(self.sock, request, blobs)
+            response, blobs = recv_message(self.sock)
+        except (socket.error, WorkerConnectionError, ValueError) as err:
+            self.close()
+            if context.cancelled:
+                raise CommandCancelledError(_(
+                    "Task on worker {worker} was cancelled.")
+                    .format(worker=self.name()))
+            raise WorkerConnectionError(_(
+                "Connection to worker {worker} is lost: {error}")
+                .format(worker=self.name(), error=err))
+        finally:
+            context.remove_cancel_callback(self.abort)
+        if response.get("status") != "ok":
+            raise ProgramError(_("[worker {worker}] {error}").format(
+                worker=self.name(), error=response.get("error")))
+        _write_file(task["output"], blobs[0])
+        results = response.get("results", {})
+        if "page-digests" in results:
+            # The digests should describe the output written here
+            st = os.stat(task["output"])
+            results["page-digests"].update(mtime=st.st_mtime,
+                                           size=st.st_size)
+        task.update(results)
+
+
+def parse_worker_list(value):
+    """Returns list of RemoteWorker for the workers given as
+    space-separated 'host:port' list.
+    """
+    workers = []
+    for address in value.split():
+        host, sep, port = address.rpartition(":")
+        if not sep or not host or not port.isdigit():
+            raise ProgramError(_(
+                "Incorrect worker address '{address}'. "
+                "Should be <host>:<port>.").format(address=address))
+        workers.append(RemoteWorker(host, int(port)))
+    return workers
+
+
+def connect_workers(workers):
+    """Connects to all the 'workers' (list of RemoteWorker) and
+    returns (connections, errors) where 'connections' has as many
+    RemoteWorker objects for each worker as the number of tasks
+    it is ready to run at once.
+    """
+    connections = []
+    errors = []
+    for worker in workers:
+        try:
+            jobs = worker.connect()
+        except WorkerConnectionError as err:
+            errors.append(unicode(err))
+            continue
+        connections.append(worker)
+        for i in xrange(jobs - 1):
+            connections.append(RemoteWorker(worker.host, worker.port))
+    return connections, errors
+
+
+class _WorkerRequestHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        send_message(self.request, {"version": _PROTOCOL_VERSION,
+                                    "jobs": self.server.jobs})
+        while True:
+            try:
+                request, blobs = recv_message(self.request)
+            except (socket.error, WorkerConnectionError, ValueError):
+                return
+            response, blobs = self.server.run_task(request, blobs)
+            try:
+                send_message(self.request, response, blobs)
+            except socket.error:
+                return
+
+
+class WorkerServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """Runs the tasks sent by RemoteWorker objects of coordinators.
+
+    Input files come with the task and are written to a temporary
+    directory together with the output that is sent back.
+    Only the handlers from the modules starting with one of
+    'modules' prefixes are run. There is no authentication,
+    so the server should be reachable only from trusted hosts.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, jobs=1, modules=("lnc.",)):
+        """
+        'address' is (host, port) to listen on (port 0 picks a free one)
+        'jobs'    is the number of tasks to run at once
+        """
+        SocketServer.TCPServer.__init__(self, address, _WorkerRequestHandler)
+        self.jobs = jobs
+        self.modules = tuple(modules)
+        self.slots = threading.Semaphore(jobs)
+        self.tasks_done = 0
+        self.lock = threading.Lock()
+
+    def _get_handler(self, name):
+        module_name, sep, func_name = name.partition(":")
+        if not module_name.startswith(self.modules):
+            raise ProgramError(_("Handler '{name}' is not allowed.")
+                               .format(name=name))
+        try:
+            module = __import__(module_name, fromlist=[str(func_name)])
+            return getattr(module, func_name)
+        except (ImportError, AttributeError) as err:
+            raise ProgramError(_("Cannot load handler '{name}': {error}")
+                               .format(name=name, error=err))
+
+    def run_task(self, request, blobs):
+        """Returns (response, blobs) for the task 'request'."""
+        tmpdir = tempfile.mkdtemp(prefix="lnc-worker-")
+        try:
+            task = dict(request["task"])
+            task["__handler__"] = self._get_handler(request["handler"])
+            for index, (key, blob) in enumerate(zip(request["inputs"],
+                                                    blobs)):
+                path = os.path.join(tmpdir, "in%d" % index,
+                                    os.path.basename(task[key]))
+                os.mkdir(os.path.dirname(path))
+                _write_file(path, blob)
+                task[key] = path
+            task["output"] = os.path.join(tmpdir,
+                                          os.path.basename(task["output"]))
+            set_context(CommandContext(request.get("timeout", 0),
+                                       request.get("max-memory", 0)))
+            with self.slots:
+                task["__handler__"](task)
+            data = _read_file(task["output"])
+        except ProgramError as err:
+            return {"status": "error", "error": unicode(err)}, []
+        except Exception:
+            return {"status": "error", "error": traceback.format_exc()}, []
+        finally:
+            set_context(None)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        with self.lock:
+            self.tasks_done += 1
+        results = dict((key, task[key]) for key in _RESULT_KEYS
+                       if key in task)
+        return {"status": "ok", "results": results}, [data]
@@ -0,0 +1,162 @@
+from __future__ import unicode_literals
+
+import os
+import json
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.raster import RasterView
+from lnc.lib.cache import _file_hash
+
+
+# Digests of the pages (in the directory of the pages)
+_INDEX_FILE = ".index.json"
+# The page is split into _GRID x _GRID cells for the perceptual hash
+_GRID = 8
+# Rows read from every cell
+_SAMPLE_ROWS = 8
+
+
+def perceptual_hash(view):
+    """Returns 64-bit average hash of the page from RasterView 'view':
+    a bit is set for every cell of 8x8 grid that is lighter than
+    the page on average. Only a few rows of every cell are read.
+    """
+    pixel_size = view.channels * view.sample_size
+    # The most significant byte of 16-bit samples is enough
+    step = view.sample_size
+    bounds = [(view.width * cx // _GRID * pixel_size,
+               view.width * (cx + 1) // _GRID * pixel_size)
+              for cx in xrange(_GRID)]
+    means = []
+    for cy in xrange(_GRID):
+        sums = [0] * _GRID
+        counts = [0] * _GRID
+        for k in xrange(_SAMPLE_ROWS):
+            y = (view.height * (cy * 2 * _SAMPLE_ROWS + 2 * k + 1) //
+                 (2 * _SAMPLE_ROWS * _GRID))
+            row = view.samples(min(y, view.height - 1))
+            for cx, (start, end) in enumerate(bounds):
+                cell = row[start:end:step]
+                sums[cx] += sum(cell)
+                counts[cx] += len(cell)
+        means += [float(s) / max(c, 1) for s, c in zip(sums, counts)]
+    average = sum(means) / len(means)
+    result = 0
+    for mean in means:
+        result = (result << 1) | (mean > average)
+    return result
+
+
+def hash_distance(a, b):
+    """Returns the number of different bits of two perceptual hashes."""
+    return bin(a ^ b).count("1")
+
+
+def page_digests(filename):
+    """Returns index entry for the page 'filename': its modification
+    time, size, SHA-256 and perceptual hash (None unless it is
+    a binary PNM).
+    """
+    st = os.stat(filename)
+    try:
+        with RasterView(filename) as view:
+            phash = perceptual_hash(view)
+    except ProgramError:
+        phash = None
+    return {"mtime": st.st_mtime,
+            "size": st.st_size,
+            "sha256": _file_hash(filename),
+            "phash": phash}
+
+
+def _is_current(entry, filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return False
+    return (entry is not None and entry["mtime"] == st.st_mtime and
+            entry["size"] == st.st_size)
+
+
+def read_page_index(store):
+    """Returns dict mapping numbers of the pages of PageStore 'store'
+    to their index entries (see page_digests()) skipping outdated ones.
+    """
+    try:
+        with open(os.path.join(store.directory, _INDEX_FILE), "rt") as f:
+            index = dict((int(num), entry)
+                         for num, entry in json.load(f).items())
+    except (IOError, ValueError):
+        return {}
+    pages = store.pages()
+    return dict((num, entry) for num, entry in index.items()
+                if num in pages and _is_current(entry, pages[num]))
+
+
+def update_page_index(store, known=None):
+    """Brings the index of the pages of PageStore 'store' up to date
+    and returns (index, numbers of the pages hashed now).
+    'known' is dict of the index entries found meanwhile (by the tasks).
+    """
+    index = read_page_index(store)
+    updated = set()
+    for num, filename in store.pages().items():
+        if num in index:
+            continue
+        entry = (known or {}).get(num)
+        if not _is_current(entry, filename):
+            entry = page_digests(filename)
+        index[num] = entry
+        updated.add(num)
+    filename = os.path.join(store.directory, _INDEX_FILE)
+    with open(filename, "wt") as f:
+        json.dump(index, f)
+    return index, updated
+
+
+def find_duplicates(index):
+    """Returns dict mapping numbers of the pages of 'index' that are
+    byte-identical to pages with lower numbers to the lowest of them.
+    """
+    first = {}
+    duplicates = {}
+    for num in sorted(index):
+        digest = index[num]["sha256"]
+        if digest in first:
+            duplicates[num] = first[digest]
+        else:
+            first[digest] = num
+    return duplicates
+
+
+def find_similar(index, nums, max_distance):
+    """Returns sorted list of groups (sorted lists of page numbers)
+    of the pages of 'index' that are byte-identical or similar (up to
+    'max_distance' bits of their perceptual hashes differ) to
+    another page of the group. Only the groups having pages from
+    'nums' are returned.
+    """
+    groups = dict((num, set([num])) for num in index)
+
+    def join(a, b):
+        if groups[a] is groups[b]:
+            return
+        group = groups[a] | groups[b]
+        for num in group:
+            groups[num] = group
+
+    for num in nums:
+        entry = index[num]
+        for other, other_entry in index.items():
+            if other == num:
+                continue
+            if entry["sha256"] == other_entry["sha256"]:
+                join(num, other)
+            elif (entry["phash"] is not None and
+                  other_entry["phash"] is not None and
+                  hash_distance(entry["phash"],
+                                other_entry["phash"]) <= max_distance):
+                join(num, other)
+    result = set(tuple(sorted(groups[num])) for num in nums
+                 if len(groups[num]) > 1)
+    return sorted(list(group) for group in result)
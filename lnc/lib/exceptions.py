@@ -13,3 +13,11 @@ class NoOptionError(ProgramError):
 
 class ExtCommandError(ProgramError):
     pass
+
+
+class CommandCancelledError(ExtCommandError):
+    pass
+
+
+class WorkerConnectionError(ProgramError):
+    pass
@@ -0,0 +1,108 @@
+from __future__ import unicode_literals
+
+import os
+import time
+import socket
+import httplib
+import threading
+import urlparse
+import Queue
+
+
+class HttpCache:
+    """Remote cache of the task results accessed over HTTP.
+
+    The result for a key is got by 'GET <url>/<key>' (404 means
+    there is no such result) and put by 'PUT <url>/<key>'.
+    Uploads are done by a background thread, so workers do not
+    wait for them (see flush()). Network errors are treated as
+    cache misses; after the first one the cache is not used anymore,
+    so an unreachable server does not slow every task down.
+    """
+    def __init__(self, url, upload=True, timeout=10):
+        """
+        'url'     is the base URL of the cache ('http://host:port/path')
+        'upload'  is whether to put new results to the cache
+        'timeout' is a timeout in seconds for network operations
+        """
+        parts = urlparse.urlsplit(url)
+        if parts.scheme != "http" or not parts.hostname:
+            raise ValueError("Unsupported cache URL: '%s'" % url)
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path.rstrip("/")
+        self.upload = upload
+        self.timeout = timeout
+        self.available = True
+        self.uploads = Queue.Queue()
+        self.uploader = None
+        self.lock = threading.Lock()
+
+    def _request(self, method, key, body=None):
+        """Returns (status, response body)."""
+        conn = httplib.HTTPConnection(self.host, self.port,
+                                      timeout=self.timeout)
+        try:
+            # Unicode URL would make httplib decode the body
+            conn.request(method.encode("ascii"),
+                         ("%s/%s" % (self.path, key)).encode("utf8"), body)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def _failed(self):
+        self.available = False
+
+    def fetch(self, key, dest):
+        """Writes the result for 'key' to 'dest' and returns True
+        or returns False if there is no such result.
+        """
+        if not self.available:
+            return False
+        try:
+            status, data = self._request("GET", key)
+        except (socket.error, httplib.HTTPException):
+            self._failed()
+            return False
+        if status != httplib.OK:
+            return False
+        tmp = "%s.%d.%d.tmp" % (dest, os.getpid(),
+                                threading.current_thread().ident)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.rename(tmp, dest)
+        return True
+
+    def store(self, key, source):
+        """Schedules upload of 'source' file as the result for 'key'."""
+        if not self.upload or not self.available:
+            return
+        with self.lock:
+            if self.uploader is None:
+                self.uploader = threading.Thread(target=self._upload_loop)
+                self.uploader.daemon = True
+                self.uploader.start()
+        self.uploads.put((key, source))
+
+    def _upload_loop(self):
+        while True:
+            key, source = self.uploads.get()
+            try:
+                if self.available:
+                    with open(source, "rb") as f:
+                        self._request("PUT", key, f.read())
+            except (socket.error, httplib.HTTPException):
+                self._failed()
+            except IOError:
+                # The output is removed already: nothing to upload
+                pass
+            finally:
+                self.uploads.task_done()
+
+    def flush(self):
+        """Waits for all the scheduled uploads to finish."""
+        # Queue.join() cannot be interrupted by Ctrl-C
+        while self.uploads.unfinished_tasks:
+            time.sleep(0.05)
@@ -0,0 +1,163 @@
+from __future__ import unicode_literals
+
+import struct
+
+
+# ImageMagick (Q16) keeps 4 channels of 16 bits for every pixel
+_BYTES_PER_PIXEL = 8
+
+
+class ImageInfo:
+    def __init__(self, width, height, channels, depth):
+        """
+        'channels' is a number of color channels (1 for grayscale)
+        'depth'    is a number of bits per channel
+        """
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.depth = depth
+
+
+def _pnm_tokens(f, count):
+    """Returns 'count' whitespace-separated header tokens of PNM file."""
+    tokens = []
+    token = b""
+    while len(tokens) < count:
+        ch = f.read(1)
+        if not ch:
+            raise ValueError("Unexpected end of file")
+        if ch == b"#":
+            while ch not in (b"\n", b""):
+                ch = f.read(1)
+        if ch.isspace():
+            if token:
+                tokens.append(token)
+                token = b""
+        else:
+            token += ch
+    return tokens
+
+
+def _read_pnm(f, magic):
+    kind = magic[1:2]
+    if kind == b"7":
+        # PAM: header consists of named fields terminated by ENDHDR
+        fields = {}
+        f.readline()
+        for line in iter(f.readline, b""):
+            parts = line.split()
+            if not parts or parts[0].startswith(b"#"):
+                continue
+            if parts[0] == b"ENDHDR":
+                break
+            fields[parts[0]] = parts[1]
+        maxval = int(fields[b"MAXVAL"])
+        return ImageInfo(int(fields[b"WIDTH"]), int(fields[b"HEIGHT"]),
+                         int(fields[b"DEPTH"]),
+                         16 if maxval > 255 else 8)
+    f.seek(2)
+    if kind in (b"1", b"4"):
+        width, height = [int(x) for x in _pnm_tokens(f, 2)]
+        return ImageInfo(width, height, 1, 1)
+    width, height, maxval = [int(x) for x in _pnm_tokens(f, 3)]
+    channels = 3 if kind in (b"3", b"6") else 1
+    return ImageInfo(width, height, channels, 16 if maxval > 255 else 8)
+
+
+def _read_bmp(f):
+    f.seek(14)
+    header_size = struct.unpack(b"<I", f.read(4))[0]
+    if header_size == 12:
+        width, height, planes, bpp = struct.unpack(b"<HHHH", f.read(8))
+    else:
+        width, height, planes, bpp = struct.unpack(b"<iiHH", f.read(12))
+    channels = 1 if bpp <= 8 else 3
+    return ImageInfo(width, abs(height), channels, min(bpp, 8))
+
+
+def _read_png(f):
+    f.seek(16)
+    width, height, depth, color_type = struct.unpack(b">IIBB", f.read(10))
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}.get(color_type, 3)
+    return ImageInfo(width, height, channels, depth)
+
+
+def _read_jpeg(f):
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0:1] != b"\xff":
+            raise ValueError("Broken JPEG marker")
+        code = ord(marker[1:2])
+        if code == 0xff:
+            # Padding
+            f.seek(-1, 1)
+            continue
+        if 0xd0 <= code <= 0xd9 or code == 0x01:
+            continue
+        length = struct.unpack(b">H", f.read(2))[0]
+        # SOFn markers except DHT (c4), JPG (c8) and DAC (cc)
+        if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            depth, height, width, channels = struct.unpack(b">BHHB",
+                                                           f.read(6))
+            return ImageInfo(width, height, channels, depth)
+        f.seek(length - 2, 1)
+
+
+def _read_tiff(f, magic):
+    """Reads the size of the first image of TIFF file."""
+    order = b"<" if magic[0:2] == b"II" else b">"
+    offset = struct.unpack(order + b"I", magic[4:8])[0]
+    f.seek(offset)
+    count = struct.unpack(order + b"H", f.read(2))[0]
+    tags = {}
+    for i in xrange(count):
+        tag, kind, values, value = struct.unpack(order + b"HHI4s",
+                                                 f.read(12))
+        if kind == 3:
+            # SHORT
+            tags[tag] = struct.unpack(order + b"H", value[:2])[0]
+        elif kind == 4:
+            # LONG
+            tags[tag] = struct.unpack(order + b"I", value)[0]
+    # BitsPerSample of several samples is stored elsewhere: assume 8
+    depth = tags.get(258, 1) if tags.get(277, 1) == 1 else 8
+    # ImageWidth, ImageLength, SamplesPerPixel
+    return ImageInfo(tags[256], tags[257], tags.get(277, 1), depth)
+
+
+def read_image_info(filename):
+    """Returns ImageInfo of the image in 'filename' reading only its
+    header (PNM, PAM, BMP, PNG, JPEG and TIFF are supported)
+    or None if the format is unknown or the file is broken.
+    """
+    try:
+        with open(filename, "rb") as f:
+            magic = f.read(8)
+            f.seek(0)
+            if magic[0:1] == b"P" and magic[1:2] in b"1234567":
+                return _read_pnm(f, magic)
+            if magic[0:2] == b"BM":
+                return _read_bmp(f)
+            if magic == b"\x89PNG\r\n\x1a\n":
+                return _read_png(f)
+            if magic[0:2] == b"\xff\xd8":
+                return _read_jpeg(f)
+            if magic[0:4] in (b"II*\0", b"MM\0*"):
+                return _read_tiff(f, magic)
+    except (IOError, ValueError, KeyError, IndexError, struct.error):
+        pass
+    return None
+
+
+def estimate_memory(filename, copies=1):
+    """Returns the estimated amount of memory (in megabytes) needed by
+    ImageMagick to hold 'copies' copies of the image in 'filename'
+    (0 if the image size cannot be determined).
+    """
+    info = read_image_info(filename)
+    if info is None:
+        return 0
+    return (info.width * info.height * _BYTES_PER_PIXEL * copies +
+            (1024 * 1024 - 1)) // (1024 * 1024)
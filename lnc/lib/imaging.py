@@ -0,0 +1,438 @@
+from __future__ import unicode_literals
+
+import math
+import zlib
+from cStringIO import StringIO
+from contextlib import contextmanager
+
+try:
+    from PIL import Image, ImageChops, ImageColor, ImageFilter, ImageOps
+except ImportError:
+    Image = None
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.process import cmd_run, _COMMAND_NOT_FOUND_MSG
+from lnc.lib.pagestore import PAGE_FORMATS
+from lnc.lib.batching import convert_script
+from lnc.lib.containers import frame_source, is_pdf
+
+
+# Margin added around the page before trimming it
+_BORDER_SIZE = 10
+
+# Memory (in megabytes) ImageMagick may use for a large page
+# (see 'large-page-pixels'), the rest of its pixels is kept on disk
+LARGE_PAGE_MEMORY = 256
+
+
+def is_large_page(info):
+    """Returns True if the page is processed with bounded memory
+    (see 'large-page-pixels').
+    """
+    limit = info.get("large-page-pixels")
+    return bool(limit) and info.get("pixels", 0) > limit
+
+
+def sample_factor(info):
+    """Returns how many times large pages are scaled down to find
+    their borders (1 for the other pages).
+    """
+    if not is_large_page(info):
+        return 1
+    return int(math.ceil(math.sqrt(float(info["pixels"]) /
+                                   info["large-page-pixels"])))
+
+
+class ImageBackend:
+    """Pixel work of the plugins.
+
+    The operations get the task of the page ('info'): the source
+    is 'input' (with 'frame' and 'density' for the pages of multi-page
+    containers), the result is written to 'output' scaled by 'scale'
+    percent (if set) in 'page-format'. PDF pages are encoded with JPEG
+    of 'quality' if it is set and losslessly otherwise.
+    """
+    name = None
+    # Whether processing several pages at once is faster
+    supports_batches = False
+
+    def tool_version(self):
+        """Checks that the backend is available and returns
+        its version (a part of the shared cache keys).
+        """
+        raise NotImplementedError
+
+    def identify(self, filename):
+        """Returns (width, height) of the image."""
+        raise NotImplementedError
+
+    def crop_detect(self, info, transform):
+        """Returns (x, y, width, height) of the contents of the page
+        sampled down sample_factor(info) times. The strips of the edges
+        from transform["chop-edge"] that are transform["chop-size"]
+        wide are filled with transform["chop-background"] first, then
+        the page is blurred by transform["blur"] and its borders of the
+        background color (within transform["fuzz"] percent) are found.
+        """
+        raise NotImplementedError
+
+    def prepare_page(self, info, crop, angle):
+        """Writes the page cropped to 'crop' (x, y, width, height)
+        if it is not None and rotated clockwise by 'angle' degrees.
+        """
+        raise NotImplementedError
+
+    def encode_pdf(self, info):
+        """Writes the page as a single-page PDF file."""
+        raise NotImplementedError
+
+    def to_pnm(self, filename, output):
+        """Writes the image 'filename' as PNM file 'output'."""
+        raise NotImplementedError
+
+    def crop_detect_pages(self, tasks, transform):
+        return [self.crop_detect(info, transform) for info in tasks]
+
+    def prepare_pages(self, tasks, crops, angles):
+        for info, crop, angle in zip(tasks, crops, angles):
+            self.prepare_page(info, crop, angle)
+
+    def encode_pdf_pages(self, tasks):
+        for info in tasks:
+            self.encode_pdf(info)
+
+
+class ImageMagickBackend(ImageBackend):
+    """Runs ImageMagick's convert. Pages of a batch are processed
+    by a single run of it (see convert_script()).
+    """
+    name = "imagemagick"
+    supports_batches = True
+
+    def tool_version(self):
+        return cmd_run(
+            ["convert", "-version"],
+            fail_msg=_COMMAND_NOT_FOUND_MSG.format(command="convert",
+                                                   package="ImageMagick"))
+
+    def identify(self, filename):
+        output = cmd_run(["convert", filename + "[0]",
+                          "-format", "%w %h", "info:-"])
+        width, height = [int(x) for x in output.split()]
+        return width, height
+
+    def _source(self, info):
+        """Returns arguments reading the source image."""
+        if is_large_page(info):
+            # Bounded memory: the pixel cache is paged to disk by tiles
+            limits = ["-limit", "memory", "%dMiB" % LARGE_PAGE_MEMORY,
+                      "-limit", "map", "%dMiB" % (2 * LARGE_PAGE_MEMORY)]
+        else:
+            limits = []
+        if info.get("frame") is None:
+            return limits + [info["input"]]
+        return limits + frame_source(info["input"], info["frame"],
+                                     info.get("density"))
+
+    def _crop_detect_args(self, info, transform):
+        chop_background = transform["chop-background"]
+        factor = sample_factor(info)
+        chop_size = transform["chop-size"] // factor
+
+        args = self._source(info)
+        if factor > 1:
+            # The borders are found on a smaller copy
+            args += ["-sample", "%.4f%%" % (100.0 / factor)]
+        args += ["-background", chop_background]
+        for edge in transform["chop-edge"]:
+            if edge in ["north", "south"]:
+                sizestr = "0x" + str(chop_size)
+            else:
+                sizestr = str(chop_size) + "x0"
+            args += ["-gravity", edge, "-chop", sizestr, "-splice", sizestr]
+
+        args += ["-bordercolor", chop_background,
+                 "-border", "%sx%s" % (_BORDER_SIZE, _BORDER_SIZE),
+                 "-virtual-pixel", "edge",
+                 "-blur", "0x%d" % max(transform["blur"] // factor, 1),
+                 "-fuzz", "%d%%" % transform["fuzz"],
+                 "-trim",
+                 "-format", "%X %Y %w %h\n"]
+        return args
+
+    def crop_detect(self, info, transform):
+        return self.crop_detect_pages([info], transform)[0]
+
+    def crop_detect_pages(self, tasks, transform):
+        output = cmd_run(convert_script(
+            [(self._crop_detect_args(info, transform), "info:-")
+             for info in tasks]))
+        lines = output.splitlines()
+        if len(lines) != len(tasks):
+            raise ProgramError(_(
+                "Unexpected output of ImageMagick:\n{output}")
+                .format(output=output.decode("utf8", "replace")))
+        crops = []
+        for line in lines:
+            off_x, off_y, width, height = [int(x) for x in line.split()]
+            crops.append((off_x - _BORDER_SIZE, off_y - _BORDER_SIZE,
+                          width, height))
+        return crops
+
+    def _prepare_args(self, info, crop, angle):
+        args = self._source(info)
+        if crop is not None:
+            args += ["-crop", "%dx%d%+d%+d" % (crop[2], crop[3],
+                                               crop[0], crop[1]),
+                     "+repage"]
+        if angle:
+            args += ["-rotate", str(angle)]
+        if info.get("scale"):
+            # Low-resolution draft
+            args += ["-resize", "%d%%" % info["scale"]]
+        # Compression of the page format
+        return args + PAGE_FORMATS[info.get("page-format", "pnm")][1]
+
+    def prepare_page(self, info, crop, angle):
+        self.prepare_pages([info], [crop], [angle])
+
+    def prepare_pages(self, tasks, crops, angles):
+        cmd_run(convert_script(
+            [(self._prepare_args(info, crop, angle), info["output"])
+             for info, crop, angle in zip(tasks, crops, angles)]))
+
+    def _pdf_args(self, info):
+        args = [info["input"]]
+        if info.get("quality"):
+            # Low-quality draft
+            args += ["-compress", "JPEG", "-quality", str(info["quality"])]
+        return args
+
+    def pdf_command(self, info):
+        """Returns command line encoding the PDF page."""
+        return ["convert"] + self._pdf_args(info) + [info["output"]]
+
+    def encode_pdf(self, info):
+        cmd_run(self.pdf_command(info))
+
+    def encode_pdf_pages(self, tasks):
+        cmd_run(convert_script([(self._pdf_args(info), info["output"])
+                                for info in tasks]))
+
+    def to_pnm(self, filename, output):
+        cmd_run(["convert", filename, output])
+
+
+# Pillow formats and options of the page formats
+_PILLOW_FORMATS = {
+    "pnm": ("PPM", {}),
+    "png": ("PNG", {}),
+    "tiff": ("TIFF", {"compression": "tiff_lzw"}),
+}
+
+# Rotations by multiples of 90 degrees clockwise done without resampling
+_TRANSPOSITIONS = {
+    90: "ROTATE_270",
+    180: "ROTATE_180",
+    270: "ROTATE_90",
+}
+
+
+@contextmanager
+def _pillow_errors(filename):
+    try:
+        yield
+    except (IOError, ValueError, EOFError, MemoryError) as err:
+        raise ProgramError(_("Cannot process image '{file}': {error}")
+                           .format(file=filename, error=err))
+
+
+def _normalize_mode(image):
+    """Returns grayscale or RGB copy of 'image' (as written to PNM)."""
+    if image.mode in ("L", "RGB"):
+        return image
+    if image.mode == "I" or image.mode.startswith("I;16"):
+        # 16-bit samples (scanner TIFFs, PNGs): convert() would clip
+        # them instead of scaling
+        return image.convert("I").point(
+            lambda value: value * (1.0 / 257) + 0.5).convert("L")
+    if image.mode == "F":
+        # Samples are either in [0, 1] or 16-bit values
+        scale = 255.0 if image.getextrema()[1] <= 1.0 else 1.0 / 257
+        return image.point(
+            lambda value: value * scale + 0.5).convert("L")
+    if image.mode in ("1", "LA"):
+        return image.convert("L")
+    return image.convert("RGB")
+
+
+def _pdf_object(number, body, stream=None):
+    data = b"%d 0 obj\n" % number + body
+    if stream is not None:
+        data += b"\nstream\n" + stream + b"\nendstream"
+    return data + b"\nendobj\n"
+
+
+def write_pdf(image, filename, quality=None):
+    """Writes single-page PDF file with 'image' (grayscale or RGB)
+    at 72 dpi as ImageMagick does for images without resolution.
+    The image is compressed with JPEG of 'quality' if it is given
+    and with zlib otherwise.
+    """
+    width, height = image.size
+    if quality:
+        jpeg = StringIO()
+        image.save(jpeg, "JPEG", quality=quality)
+        data = jpeg.getvalue()
+        filter_name = b"/DCTDecode"
+    else:
+        data = zlib.compress(image.tobytes())
+        filter_name = b"/FlateDecode"
+    colorspace = b"/DeviceGray" if image.mode == "L" else b"/DeviceRGB"
+    content = b"q %d 0 0 %d 0 0 cm /Im0 Do Q" % (width, height)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+        b"/Resources << /XObject << /Im0 4 0 R >> >> /Contents 5 0 R >>" %
+        (width, height),
+        (b"<< /Type /XObject /Subtype /Image /Width %d /Height %d "
+         b"/ColorSpace %s /BitsPerComponent 8 /Filter %s /Length %d >>" %
+         (width, height, colorspace, filter_name, len(data)), data),
+        (b"<< /Length %d >>" % len(content), content)]
+    output = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(output))
+        if isinstance(obj, tuple):
+            output += _pdf_object(number, *obj)
+        else:
+            output += _pdf_object(number, obj)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += (b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+               % (len(objects) + 1, xref))
+    with open(filename, "wb") as f:
+        f.write(output)
+
+
+class PillowBackend(ImageBackend):
+    """Processes the pages in the worker threads with Pillow (no
+    external commands are started; Pillow releases the interpreter
+    lock while decoding, filtering and encoding the images).
+
+    The results are close to the ones of ImageMagick but not the same.
+    Pages are not read from PDF files, large pages are not processed
+    with bounded memory, and 'timeout' and 'max-memory' do not apply.
+    """
+    name = "pillow"
+
+    def tool_version(self):
+        if Image is None:
+            raise ProgramError(_(
+                "Pillow is required for the 'pillow' image backend."))
+        return "Pillow " + Image.__version__
+
+    def identify(self, filename):
+        with _pillow_errors(filename):
+            return Image.open(filename).size
+
+    def _open(self, info):
+        filename = info["input"]
+        if info.get("frame") is not None and is_pdf(filename):
+            raise ProgramError(_(
+                "Pages of '{file}' cannot be read by the 'pillow' image "
+                "backend, use 'imagemagick'.").format(file=filename))
+        with _pillow_errors(filename):
+            image = Image.open(filename)
+            if info.get("frame") is not None:
+                image.seek(info["frame"])
+            image.load()
+            return _normalize_mode(image)
+
+    def crop_detect(self, info, transform):
+        image = self._open(info).convert("L")
+        factor = sample_factor(info)
+        width, height = image.size
+        if factor > 1:
+            width = max(width // factor, 1)
+            height = max(height // factor, 1)
+            image = image.resize((width, height), Image.NEAREST)
+        background = ImageColor.getcolor(transform["chop-background"], "L")
+        size = transform["chop-size"] // factor
+        strips = {
+            "north": (0, 0, width, size),
+            "south": (0, height - size, width, height),
+            "west": (0, 0, size, height),
+            "east": (width - size, 0, width, height),
+        }
+        for edge in transform["chop-edge"]:
+            if size > 0:
+                image.paste(background, strips[edge])
+        image = ImageOps.expand(image, _BORDER_SIZE, background)
+        image = image.filter(ImageFilter.GaussianBlur(
+            max(transform["blur"] // factor, 1)))
+        # Trimmed are the pixels of the color of the corner
+        corner = image.getpixel((0, 0))
+        threshold = 255 * transform["fuzz"] // 100
+        mask = ImageChops.difference(
+            image, Image.new("L", image.size, corner)).point(
+            lambda value: 255 if value > threshold else 0)
+        box = mask.getbbox()
+        if box is None:
+            # Blank page
+            return 0, 0, width, height
+        return (box[0] - _BORDER_SIZE, box[1] - _BORDER_SIZE,
+                box[2] - box[0], box[3] - box[1])
+
+    def prepare_page(self, info, crop, angle):
+        image = self._open(info)
+        with _pillow_errors(info["input"]):
+            if crop is not None:
+                x, y, width, height = crop
+                image = image.crop((max(x, 0), max(y, 0),
+                                    min(x + width, image.size[0]),
+                                    min(y + height, image.size[1])))
+            angle %= 360
+            if angle in _TRANSPOSITIONS:
+                image = image.transpose(getattr(Image,
+                                                _TRANSPOSITIONS[angle]))
+            elif angle:
+                # ImageMagick rotates clockwise filling with white
+                image = image.rotate(
+                    -angle, Image.BICUBIC, expand=True,
+                    fillcolor=ImageColor.getcolor("white", image.mode))
+            if info.get("scale"):
+                image = image.resize(
+                    (max(image.size[0] * info["scale"] // 100, 1),
+                     max(image.size[1] * info["scale"] // 100, 1)),
+                    Image.LANCZOS)
+            image_format, options = _PILLOW_FORMATS[
+                info.get("page-format", "pnm")]
+            image.save(info["output"], image_format, **options)
+
+    def encode_pdf(self, info):
+        with _pillow_errors(info["input"]):
+            image = _normalize_mode(Image.open(info["input"]))
+            write_pdf(image, info["output"], info.get("quality"))
+
+    def to_pnm(self, filename, output):
+        with _pillow_errors(filename):
+            _normalize_mode(Image.open(filename)).save(output, "PPM")
+
+
+BACKENDS = {
+    "imagemagick": ImageMagickBackend(),
+    "pillow": PillowBackend(),
+}
+
+
+def get_backend(name):
+    """Returns the image backend called 'name'."""
+    if name not in BACKENDS:
+        raise ProgramError(_(
+            "Unknown image backend '{name}'. Possible values: {values}.")
+            .format(name=name, values=", ".join(sorted(BACKENDS))))
+    return BACKENDS[name]
@@ -44,3 +44,17 @@ def mkdir_p(path):
     except OSError as err:
         if err.errno != errno.EEXIST:
             raise
+
+
+def split_common_dir(filenames):
+    """Returns (directory, names) where 'names' are 'filenames' relative
+    to the absolute 'directory' all of them are in, so command lines
+    listing thousands of them stay short. Returns (None, 'filenames')
+    if the files are in different directories.
+    """
+    directories = set(os.path.dirname(os.path.abspath(filename))
+                      for filename in filenames)
+    if len(directories) != 1:
+        return None, list(filenames)
+    return (directories.pop(),
+            [os.path.basename(filename) for filename in filenames])
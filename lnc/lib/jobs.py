@@ -0,0 +1,234 @@
+from __future__ import unicode_literals
+
+import os
+import re
+import time
+import multiprocessing
+
+from lnc.lib.exceptions import ProgramError
+
+
+_CGROUP_ROOT = "/sys/fs/cgroup"
+_PROC_CGROUP = "/proc/self/cgroup"
+
+
+def _read_file(filename):
+    try:
+        with open(filename, "rt") as f:
+            return f.read().strip()
+    except IOError:
+        return None
+
+
+def _parse_cpu_list(cpu_list):
+    """Returns the number of CPUs in the list like '0-3,8,10-11'."""
+    count = 0
+    for part in cpu_list.split(","):
+        bounds = part.split("-")
+        count += int(bounds[-1]) - int(bounds[0]) + 1
+    return count
+
+
+def cpu_count():
+    """Returns the number of CPUs this process is allowed to run on."""
+    count = multiprocessing.cpu_count()
+    status = _read_file("/proc/self/status")
+    if status is not None:
+        match = re.search(r"^Cpus_allowed_list:\s*(\S+)$", status,
+                          re.MULTILINE)
+        if match:
+            count = min(count, _parse_cpu_list(match.group(1)))
+    return count
+
+
+def _read_cgroup_paths(proc_cgroup):
+    """Returns dict mapping the controllers ('' for cgroup v2)
+    to the paths of the cgroups of this process in their hierarchies.
+    """
+    paths = {}
+    for line in (_read_file(proc_cgroup) or "").splitlines():
+        parts = line.split(":", 2)
+        if len(parts) == 3:
+            for controller in parts[1].split(","):
+                paths[controller] = parts[2]
+    return paths
+
+
+def _cgroup_dirs(base, path):
+    """Returns the directories of cgroup 'path' and all its parents
+    in the hierarchy mounted at 'base' (the limits of all of them
+    apply), the innermost first. Directories that are not visible
+    (e.g. in a container) are skipped, 'base' is always included.
+    """
+    parts = [part for part in path.split("/") if part]
+    dirs = []
+    for count in xrange(len(parts), 0, -1):
+        directory = os.path.join(base, *parts[:count])
+        if os.path.isdir(directory):
+            dirs.append(directory)
+    return dirs + [base]
+
+
+def cgroup_cpu_limit(root=_CGROUP_ROOT, proc_cgroup=_PROC_CGROUP):
+    """Returns the CPU quota of the cgroup of this process (as
+    a possibly fractional number of CPUs) or None if it is not limited.
+    """
+    paths = _read_cgroup_paths(proc_cgroup)
+    limits = []
+    # cgroup v2
+    unified = False
+    for directory in _cgroup_dirs(root, paths.get("", "/")):
+        cpu_max = _read_file(os.path.join(directory, "cpu.max"))
+        if cpu_max is None:
+            continue
+        unified = True
+        quota, period = cpu_max.split()
+        if quota != "max":
+            limits.append(float(quota) / float(period))
+
+    # cgroup v1
+    if not unified:
+        base = os.path.join(root, "cpu")
+        for directory in _cgroup_dirs(base, paths.get("cpu", "/")):
+            quota = _read_file(os.path.join(directory, "cpu.cfs_quota_us"))
+            period = _read_file(os.path.join(directory,
+                                             "cpu.cfs_period_us"))
+            if quota is not None and period is not None and int(quota) > 0:
+                limits.append(float(quota) / float(period))
+
+    if not limits:
+        return None
+    return min(limits)
+
+
+def available_memory(root=_CGROUP_ROOT, meminfo="/proc/meminfo",
+                     proc_cgroup=_PROC_CGROUP):
+    """Returns the amount of memory in megabytes that can be used
+    without swapping (taking the limits of the cgroup of this process
+    into account) or None if unknown.
+    """
+    result = []
+    info = _read_file(meminfo)
+    if info is not None:
+        match = re.search(r"^MemAvailable:\s*(\d+) kB$", info, re.MULTILINE)
+        if match:
+            result.append(int(match.group(1)) // 1024)
+
+    paths = _read_cgroup_paths(proc_cgroup)
+    for base, path, limit_file, usage_file in [
+            (root, paths.get("", "/"), "memory.max", "memory.current"),
+            (os.path.join(root, "memory"), paths.get("memory", "/"),
+             "memory.limit_in_bytes", "memory.usage_in_bytes")]:
+        found = False
+        for directory in _cgroup_dirs(base, path):
+            limit = _read_file(os.path.join(directory, limit_file))
+            usage = _read_file(os.path.join(directory, usage_file))
+            if limit is None or usage is None:
+                continue
+            found = True
+            # cgroup v1 reports huge number instead of 'max'
+            if limit.isdigit() and int(limit) < (1 << 60):
+                result.append((int(limit) - int(usage)) // (1024 * 1024))
+        if found:
+            break
+
+    if not result:
+        return None
+    return max(min(result), 0)
+
+
+def auto_jobs(job_memory):
+    """Returns the number of jobs that fits available CPUs,
+    CPU quota and free memory ('job_memory' megabytes per job).
+    """
+    jobs = cpu_count()
+    quota = cgroup_cpu_limit()
+    if quota is not None:
+        jobs = min(jobs, int(quota + 0.5))
+    memory = available_memory()
+    if memory is not None and job_memory > 0:
+        jobs = min(jobs, memory // job_memory)
+    return max(jobs, 1)
+
+
+def parse_jobs(value, job_memory):
+    """Converts the value of 'jobs' option to a number."""
+    if value.lower() == "auto":
+        return auto_jobs(job_memory)
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        raise ProgramError(_(
+            "Incorrect 'jobs' value: '{value}'. "
+            "Should be a positive integer or 'auto'.")
+            .format(value=value))
+    return jobs
+
+
+def parse_memory_budget(value):
+    """Converts the value of 'memory-budget' option to a number
+    of megabytes (0 means no limit).
+    """
+    if value.lower() == "auto":
+        return available_memory() or 0
+    try:
+        budget = int(value)
+    except ValueError:
+        budget = -1
+    if budget < 0:
+        raise ProgramError(_(
+            "Incorrect 'memory-budget' value: '{value}'. "
+            "Should be a non-negative integer or 'auto'.")
+            .format(value=value))
+    return budget
+
+
+class JobController:
+    """Adjusts the number of worker threads at run time.
+
+    Every 'interval' seconds it measures how much CPU time the
+    commands run by workers take and how loaded the system is
+    (using load average), and suggests as many workers as fit into
+    the CPUs not used by other processes, from 1 to 'max_jobs'.
+    """
+    def __init__(self, max_jobs, cpus=None, interval=2.0):
+        self.max_jobs = max_jobs
+        self.cpus = cpus or cpu_count()
+        self.interval = interval
+        self.last_time = time.time()
+        self.last_cpu = self._children_cpu_time()
+
+    @staticmethod
+    def _children_cpu_time():
+        times = os.times()
+        return times[2] + times[3]
+
+    @staticmethod
+    def _load_average():
+        return os.getloadavg()[0]
+
+    @staticmethod
+    def is_supported():
+        return hasattr(os, "getloadavg")
+
+    def update(self, workers):
+        """Returns the suggested number of workers given 'workers'
+        are running now or None if it is too early to decide.
+        """
+        now = time.time()
+        if now - self.last_time < self.interval:
+            return None
+        cpu = self._children_cpu_time()
+        own_load = (cpu - self.last_cpu) / (now - self.last_time)
+        self.last_time = now
+        self.last_cpu = cpu
+
+        if workers == 0 or own_load == 0:
+            return None
+        per_worker = own_load / workers
+        other_load = max(self._load_average() - own_load, 0)
+        free_cpus = max(self.cpus - other_load, 1)
+        jobs = int(free_cpus / per_worker)
+        return max(1, min(jobs, self.max_jobs))
@@ -0,0 +1,118 @@
+from __future__ import unicode_literals
+
+import os
+import re
+import stat
+import errno
+import select
+import threading
+
+
+# Slot of the process itself that does not need a token
+IMPLICIT_SLOT = object()
+
+
+def _parse_makeflags(makeflags):
+    """Returns ('fds', read_fd, write_fd), ('fifo', path) or None."""
+    result = None
+    # The last option wins as in GNU make
+    for word in makeflags.split():
+        match = re.match(r"^--jobserver-(?:auth|fds)=(\d+),(\d+)$", word)
+        if match:
+            result = ("fds", int(match.group(1)), int(match.group(2)))
+            continue
+        match = re.match(r"^--jobserver-auth=fifo:(.+)$", word)
+        if match:
+            result = ("fifo", match.group(1))
+    return result
+
+
+def _is_pipe(fd):
+    try:
+        return stat.S_ISFIFO(os.fstat(fd).st_mode)
+    except OSError:
+        return False
+
+
+def _open_nonblocking(path):
+    return os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+
+
+class JobServerClient:
+    """Client side of the GNU make jobserver protocol.
+
+    Every running task should hold a job slot: either the implicit slot
+    granted to this process by make itself or a token read from
+    the jobserver pipe. Tokens are written back when tasks finish,
+    so the total number of jobs of all nested builds does not exceed
+    the value of make's -j option.
+    """
+    def __init__(self, read_fd, write_fd):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.implicit_free = True
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls, environ=None):
+        """Returns client for the jobserver given in MAKEFLAGS
+        or None if there is no usable one.
+        """
+        if environ is None:
+            environ = os.environ
+        auth = _parse_makeflags(environ.get("MAKEFLAGS", ""))
+        if auth is None:
+            return None
+        try:
+            if auth[0] == "fifo":
+                return cls(_open_nonblocking(auth[1]),
+                           os.open(auth[1], os.O_WRONLY))
+            read_fd, write_fd = auth[1:]
+            # make does not pass the descriptors to the commands
+            # not marked as recursive ('+' prefix)
+            if not (_is_pipe(read_fd) and _is_pipe(write_fd)):
+                return None
+            try:
+                # Private non-blocking description of the same pipe
+                read_fd = _open_nonblocking("/proc/self/fd/%d" % read_fd)
+            except OSError:
+                pass
+            return cls(read_fd, write_fd)
+        except OSError:
+            return None
+
+    def acquire(self, should_stop):
+        """Waits for a free job slot and returns it. Returns None
+        if 'should_stop()' becomes true while waiting.
+        """
+        while not should_stop():
+            with self.lock:
+                if self.implicit_free:
+                    self.implicit_free = False
+                    return IMPLICIT_SLOT
+            readable = select.select([self.read_fd], [], [], 0.1)[0]
+            if not readable:
+                continue
+            try:
+                token = os.read(self.read_fd, 1)
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                raise
+            if token:
+                return token
+        return None
+
+    def release(self, slot):
+        """Returns the job slot taken by acquire()."""
+        if slot is IMPLICIT_SLOT:
+            with self.lock:
+                self.implicit_free = True
+            return
+        while True:
+            try:
+                os.write(self.write_fd, slot)
+                return
+            except OSError as err:
+                if err.errno != errno.EINTR:
+                    raise
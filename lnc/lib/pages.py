@@ -0,0 +1,114 @@
+from __future__ import unicode_literals
+
+import os
+import re
+
+from lnc.lib.exceptions import ProgramError
+
+
+# Build modes
+FULL_MODE = "full"
+# Build pages of the range and assemble them into a shard bundle
+SHARD_MODE = "shard"
+# Assemble the documents from the shard bundles only
+MERGE_MODE = "merge"
+# Build a small separate document of the pages of the range
+PREVIEW_MODE = "preview"
+
+_MODE_OPTION = "__mode__"
+_PAGES_OPTION = "__pages__"
+
+_SHARD_RE = re.compile(r"^([0-9]+)-([0-9]+)([.].*)$")
+
+
+def parse_page_range(value):
+    """Converts 'A-B' (or just 'A') to a tuple (A, B)."""
+    match = re.match(r"^\s*([0-9]+)\s*(?:-\s*([0-9]+)\s*)?$", value)
+    if match:
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if 1 <= first <= last:
+            return first, last
+    raise ProgramError(_(
+        "Incorrect page range: '{value}'. Should be <first>-<last>.")
+        .format(value=value))
+
+
+def set_build_mode(conf, mode, page_range=None):
+    """Saves the build mode and the page range (tuple or None)
+    to 'conf', so plugins can get them.
+    """
+    conf.set("global", _MODE_OPTION, mode)
+    if page_range is None:
+        conf.remove_option("global", _PAGES_OPTION)
+    else:
+        conf.set("global", _PAGES_OPTION, "%d-%d" % page_range)
+
+
+def get_build_mode(conf):
+    if not conf.has_option("global", _MODE_OPTION):
+        return FULL_MODE
+    return conf.get("global", _MODE_OPTION)
+
+
+def get_page_range(conf):
+    """Returns the range of pages to build as a tuple (first, last)
+    or None if all the pages should be built.
+    """
+    if not conf.has_option("global", _PAGES_OPTION):
+        return None
+    return parse_page_range(conf.get("global", _PAGES_OPTION))
+
+
+def page_number(filename):
+    """Returns the page number of the file named like '0012.pnm'."""
+    name = os.path.basename(filename)
+    return int(name[:name.index(".")])
+
+
+def shard_file_name(page_range, ext):
+    return "%04d-%04d%s" % (page_range[0], page_range[1], ext)
+
+
+def list_shards(shard_dir, ext, pages=None):
+    """Returns sorted list of the shard bundles with extension 'ext'
+    in 'shard_dir' checking that their page ranges are adjacent and
+    cover all the pages: from page 1 (or the first one of 'pages') to
+    the last one of 'pages' (the numbers of all the pages of
+    the document, None if they are not known).
+    """
+    try:
+        names = os.listdir(shard_dir)
+    except OSError as err:
+        raise ProgramError(_("Cannot read shards from '{dir}':\n{error}")
+                           .format(dir=shard_dir, error=err))
+    shards = []
+    for name in names:
+        match = _SHARD_RE.match(name)
+        if match and match.group(3) == ext:
+            shards.append((int(match.group(1)), int(match.group(2)), name))
+    shards.sort()
+    if not shards:
+        raise ProgramError(_("No shards with extension '{ext}' in '{dir}'.")
+                           .format(ext=ext, dir=shard_dir))
+    first = min(pages) if pages else 1
+    if shards[0][0] > first:
+        raise ProgramError(_(
+            "Shard '{shard}' in '{dir}' is the first one: pages "
+            "{first}-{last} are missing. Build them with --shard.")
+            .format(shard=shards[0][2], dir=shard_dir, first=first,
+                    last=shards[0][0] - 1))
+    if pages and shards[-1][1] < max(pages):
+        raise ProgramError(_(
+            "Shard '{shard}' in '{dir}' is the last one: pages "
+            "{first}-{last} are missing. Build them with --shard.")
+            .format(shard=shards[-1][2], dir=shard_dir,
+                    first=shards[-1][1] + 1, last=max(pages)))
+    for prev, cur in zip(shards, shards[1:]):
+        if cur[0] != prev[1] + 1:
+            raise ProgramError(_(
+                "Shards '{prev}' and '{cur}' in '{dir}' are not adjacent: "
+                "some pages are missing or built twice. Remove stale "
+                "shards and rebuild the missing ones.")
+                .format(prev=prev[2], cur=cur[2], dir=shard_dir))
+    return [os.path.join(shard_dir, shard[2]) for shard in shards]
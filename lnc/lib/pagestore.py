@@ -0,0 +1,93 @@
+from __future__ import unicode_literals
+
+import os
+import re
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.raster import RasterView
+
+
+# Formats of the prepared pages: extension and ImageMagick options
+# of the output
+PAGE_FORMATS = {
+    "pnm": (".pnm", []),
+    # Lossless, zlib-compressed
+    "png": (".png", []),
+    "tiff": (".tiff", ["-compress", "LZW"]),
+}
+
+_PAGE_RE = re.compile(r"^([0-9]+)[.](pnm|png|tiff)$")
+
+
+def check_page_format(name):
+    """Returns 'name' if it is a known page format."""
+    if name not in PAGE_FORMATS:
+        raise ProgramError(_(
+            "Unknown page format '{name}'. Possible values: {values}.")
+            .format(name=name, values=", ".join(sorted(PAGE_FORMATS))))
+    return name
+
+
+class PageStore:
+    """Directory of the prepared pages named '<number>.<ext>' where
+    <ext> is the extension of one of the page formats.
+
+    Readers get the list of the existing pages from here instead of
+    listing the directory themselves, so they accept any page format.
+    """
+    def __init__(self, directory, page_format="pnm"):
+        """'page_format' is the format of the pages written to the store"""
+        self.directory = directory
+        self.page_format = check_page_format(page_format)
+
+    def _scan(self):
+        """Returns list of (number, file name) for all the pages."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError as err:
+            raise ProgramError(_("Cannot read pages from '{dir}':\n{error}")
+                               .format(dir=self.directory, error=err))
+        pages = []
+        for name in names:
+            # Temporary files of the pages being written are skipped
+            match = _PAGE_RE.match(name)
+            if match:
+                pages.append((int(match.group(1)),
+                              os.path.join(self.directory, name)))
+        return pages
+
+    def pages(self):
+        """Returns dict mapping the numbers of all the pages
+        to their file names.
+        """
+        pages = {}
+        for num, filename in self._scan():
+            if num in pages:
+                raise ProgramError(_(
+                    "Page {num} is stored twice in '{dir}': {files}. "
+                    "Remove one of them.")
+                    .format(num=num, dir=self.directory,
+                            files=", ".join(sorted([pages[num],
+                                                    filename]))))
+            pages[num] = filename
+        return pages
+
+    def page_file(self, num):
+        """Returns file name of page 'num' in the format of the store."""
+        ext = PAGE_FORMATS[self.page_format][0]
+        return os.path.join(self.directory, "%04d%s" % (num, ext))
+
+    def raster(self, num):
+        """Returns RasterView of page 'num' mapped to memory
+        (the store should be in pnm format).
+        """
+        return RasterView(self.page_file(num))
+
+    def remove_other_formats(self, nums):
+        """Removes the pages with numbers from 'nums' that are stored
+        in formats other than the one of the store (left after
+        the format is changed).
+        """
+        for num, filename in self._scan():
+            if num in nums and filename != self.page_file(num):
+                os.remove(filename)
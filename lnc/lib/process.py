@@ -1,9 +1,20 @@
 from __future__ import unicode_literals
 
-from subprocess import check_output, CalledProcessError, call, STDOUT
+from subprocess import Popen, PIPE, call, STDOUT
 
-from lnc.lib.exceptions import ExtCommandError
+from lnc.lib.exceptions import ExtCommandError, CommandCancelledError
 import os
+import errno
+import select
+import signal
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: memory limits are silently ignored there
+    resource = None
 
 
 _COMMAND_NOT_FOUND_MSG = _(
@@ -17,29 +28,369 @@ _COMMAND_EXECUTION_FAILURE = _(
     "Some problems with '{command}' execution:\n{error}")
 
 
-def cmd_run(command_line_list, fail_msg=None):
+_COMMAND_TIMEOUT_MSG = _(
+    "Command was killed after {timeout} seconds timeout.")
+
+
+_COMMAND_CANCELLED_MSG = _(
+    "Command '{command}' was cancelled.")
+
+
+class CommandContext:
+    """Settings applied to the commands run by cmd_run()
+    from the current thread (see set_context()).
+
+    The context also tracks all the commands started within it,
+    so they can be terminated at once by cancel().
+    """
+    def __init__(self, timeout=0, max_memory=0):
+        """
+        'timeout'    is a wall-clock time limit in seconds for every
+                     single command (0 means no limit)
+        'max_memory' is an address space limit in megabytes for every
+                     single command (0 means no limit)
+        """
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.cancelled = False
+        self._processes = set()
+        self._callbacks = set()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """Kills all the running commands of this context and makes
+        cmd_run() fail immediately for the new ones.
+        """
+        with self._lock:
+            self.cancelled = True
+            for proc in self._processes:
+                _kill_process_group(proc)
+            for callback in self._callbacks:
+                callback()
+
+    def add_cancel_callback(self, callback):
+        """Makes cancel() call 'callback()' (e.g. to abort work that is
+        done not by the commands). Calls it at once if the context
+        is cancelled already.
+        """
+        with self._lock:
+            self._callbacks.add(callback)
+            if self.cancelled:
+                callback()
+
+    def remove_cancel_callback(self, callback):
+        with self._lock:
+            self._callbacks.discard(callback)
+
+    def _register(self, proc):
+        with self._lock:
+            self._processes.add(proc)
+            if self.cancelled:
+                _kill_process_group(proc)
+
+    def _unregister(self, proc):
+        with self._lock:
+            self._processes.discard(proc)
+
+
+_local = threading.local()
+
+
+def set_context(context):
+    """Makes 'context' (CommandContext or None) active for cmd_run()
+    calls from the current thread.
+    """
+    _local.context = context
+
+
+def get_context():
+    """Returns CommandContext active in the current thread or None."""
+    return getattr(_local, "context", None)
+
+
+def set_timeout_scale(scale):
+    """Makes the commands run by cmd_run() from the current thread
+    have 'scale' times the timeout of the active CommandContext
+    (e.g. the commands processing several pages at once).
+    """
+    _local.timeout_scale = scale
+
+
+def _get_timeout(context):
+    return context.timeout * getattr(_local, "timeout_scale", 1)
+
+
+def start_recording():
+    """Starts collecting statistics of the commands run by cmd_run()
+    from the current thread (see stop_recording()).
+    """
+    _local.records = []
+
+
+def stop_recording():
+    """Returns statistics collected since start_recording() call
+    as a list of dicts with the following keys:
+    'argv'     -- command line list
+    'start'    -- start time (as returned by time.time())
+    'end'      -- end time
+    'cpu-time' -- user + system CPU time in seconds (None if unknown)
+    'max-rss'  -- maximum resident set size in kilobytes (None if unknown)
+    """
+    records = getattr(_local, "records", None)
+    _local.records = None
+    return records or []
+
+
+def _make_record(command_line_list, start, end, rusage):
+    return {
+        "argv": list(command_line_list),
+        "start": start,
+        "end": end,
+        "cpu-time": rusage and rusage.ru_utime + rusage.ru_stime,
+        "max-rss": rusage and rusage.ru_maxrss}
+
+
+def _record_command(command_line_list, start, end, rusage):
+    records = getattr(_local, "records", None)
+    if records is None:
+        return
+    records.append(_make_record(command_line_list, start, end, rusage))
+
+
+def _wait(proc):
+    """Waits for 'proc' to finish and returns its resource usage
+    (None if not supported on this platform).
+    """
+    if not hasattr(os, "wait4"):
+        proc.wait()
+        return None
+    while True:
+        try:
+            pid, status, rusage = os.wait4(proc.pid, 0)
+            break
+        except OSError as err:
+            if err.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return rusage
+
+
+def _make_preexec_fn(max_memory):
+    if os.name != "posix":
+        return None
+
+    def preexec_fn():
+        # Own process group lets us kill the command with all its children
+        os.setsid()
+        if max_memory and resource is not None:
+            limit = max_memory * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    return preexec_fn
+
+
+def _kill_process_group(proc):
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except OSError as err:
+        if err.errno != errno.ESRCH:
+            raise
+
+
+def cmd_run(command_line_list, fail_msg=None, cwd=None):
     """Runs the command specified by 'command_line_list' list
-    and shows errors and raises ExtCommandError if not found
-    or on non-zero error code.
+    (in directory 'cwd' if given) and shows errors and raises
+    ExtCommandError if not found, on non-zero error code or if
+    it exceeds limits set by the active CommandContext.
     """
     if not fail_msg:
         fail_msg = _COMMAND_EXECUTION_FAILURE
+    context = get_context() or CommandContext()
+    if context.cancelled:
+        raise CommandCancelledError(_COMMAND_CANCELLED_MSG.format(
+            command=command_line_list))
 
+    start_time = time.time()
     try:
-        output = check_output(command_line_list, stderr=STDOUT)
+        proc = Popen(command_line_list, stdout=PIPE, stderr=STDOUT,
+                     preexec_fn=_make_preexec_fn(context.max_memory),
+                     cwd=cwd)
     except OSError as err:
         raise ExtCommandError(fail_msg.format(command=command_line_list,
                                               error=err))
-    except CalledProcessError as err:
-        raise ExtCommandError(fail_msg.format(command=command_line_list,
-                                              error=err) + "\n" +
-                              "=== Output: ===\n" +
-                              err.output + "\n" +
-                              "===============\n" +
-                              err)
+
+    lock = threading.Lock()
+    state = {"finished": False, "timed_out": False}
+
+    def on_timeout():
+        with lock:
+            if not state["finished"]:
+                state["timed_out"] = True
+                _kill_process_group(proc)
+
+    timer = None
+    timeout = _get_timeout(context)
+    if timeout:
+        timer = threading.Timer(timeout, on_timeout)
+        timer.daemon = True
+        timer.start()
+    context._register(proc)
+    try:
+        output = proc.stdout.read()
+        proc.stdout.close()
+        rusage = _wait(proc)
+    except BaseException:
+        # Most probably KeyboardInterrupt: the command is in its own
+        # process group, so it has not received SIGINT itself.
+        _kill_process_group(proc)
+        proc.wait()
+        raise
+    finally:
+        with lock:
+            state["finished"] = True
+        if timer is not None:
+            timer.cancel()
+        context._unregister(proc)
+    _record_command(command_line_list, start_time, time.time(), rusage)
+
+    error = _command_error(command_line_list, fail_msg, context,
+                           proc.returncode, state["timed_out"], output,
+                           timeout)
+    if error is not None:
+        raise error
     return output
 
 
+def _command_error(command_line_list, fail_msg, context, returncode,
+                   timed_out, output, timeout=None):
+    """Returns the exception to raise for the finished command
+    or None if it has succeeded. 'timeout' is the time limit of
+    the command (the one of 'context' if None).
+    """
+    if context.cancelled and returncode != 0:
+        return CommandCancelledError(_COMMAND_CANCELLED_MSG.format(
+            command=command_line_list))
+    if timed_out:
+        return ExtCommandError(fail_msg.format(
+            command=command_line_list,
+            error=_COMMAND_TIMEOUT_MSG.format(
+                timeout=timeout or context.timeout)))
+    if returncode != 0:
+        return ExtCommandError(fail_msg.format(
+            command=command_line_list,
+            error=_("Command returned non-zero exit status {code}")
+            .format(code=returncode)) + "\n" +
+            "=== Output: ===\n" +
+            output.decode("utf8", "replace") + "\n" +
+            "===============\n")
+    return None
+
+
+class CommandPoller:
+    """Runs external commands without a thread for each of them:
+    the commands are started at once, and their output, completion
+    and time limits are handled by poll() called from a single thread.
+    """
+    @staticmethod
+    def is_supported():
+        # Pipes cannot be polled on Windows
+        return hasattr(select, "poll")
+
+    def __init__(self):
+        self._poll = select.poll()
+        # File descriptor of stdout -> running command
+        self._commands = {}
+
+    def __len__(self):
+        return len(self._commands)
+
+    def start(self, command_line_list, context, callback, fail_msg=None):
+        """Starts the command with the settings of 'context'
+        (CommandContext). When it finishes, poll() calls
+        'callback(output, error, record)' where 'error' is None
+        or the exception cmd_run() would raise and 'record' is the
+        statistics of the command (see stop_recording()) or None
+        if it has not been started.
+        """
+        if not fail_msg:
+            fail_msg = _COMMAND_EXECUTION_FAILURE
+        if context.cancelled:
+            callback(None, CommandCancelledError(
+                _COMMAND_CANCELLED_MSG.format(command=command_line_list)),
+                None)
+            return
+        start_time = time.time()
+        try:
+            proc = Popen(command_line_list, stdout=PIPE, stderr=STDOUT,
+                         preexec_fn=_make_preexec_fn(context.max_memory))
+        except OSError as err:
+            callback(None, ExtCommandError(fail_msg.format(
+                command=command_line_list, error=err)), None)
+            return
+        context._register(proc)
+        fd = proc.stdout.fileno()
+        self._commands[fd] = {
+            "argv": command_line_list,
+            "proc": proc,
+            "context": context,
+            "callback": callback,
+            "fail-msg": fail_msg,
+            "chunks": [],
+            "start": start_time,
+            "deadline": context.timeout and start_time + context.timeout,
+            "timed-out": False}
+        self._poll.register(fd, select.POLLIN | select.POLLPRI |
+                            select.POLLHUP | select.POLLERR)
+
+    def poll(self, timeout):
+        """Waits up to 'timeout' seconds for output of the commands
+        and finishes the ones that have exited.
+        """
+        now = time.time()
+        for command in self._commands.values():
+            deadline = command["deadline"]
+            if deadline and not command["timed-out"]:
+                if now >= deadline:
+                    command["timed-out"] = True
+                    _kill_process_group(command["proc"])
+                else:
+                    timeout = min(timeout, deadline - now)
+        try:
+            events = self._poll.poll(max(timeout, 0) * 1000)
+        except select.error as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            return
+        for fd, event in events:
+            data = os.read(fd, 65536)
+            if data:
+                self._commands[fd]["chunks"].append(data)
+            else:
+                self._finish(fd)
+
+    def _finish(self, fd):
+        command = self._commands.pop(fd)
+        self._poll.unregister(fd)
+        proc = command["proc"]
+        proc.stdout.close()
+        try:
+            rusage = _wait(proc)
+        finally:
+            command["context"]._unregister(proc)
+        output = b"".join(command["chunks"])
+        error = _command_error(command["argv"], command["fail-msg"],
+                               command["context"], proc.returncode,
+                               command["timed-out"], output)
+        command["callback"](output, error,
+                            _make_record(command["argv"], command["start"],
+                                         time.time(), rusage))
+
+
 def cmd_try_run(cmd, fail_msg=None):
     """Runs 'cmd' and shows error if not found.
     Raises ExtCommandError on errors.
@@ -0,0 +1,117 @@
+from __future__ import unicode_literals
+
+import mmap
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.imageinfo import _read_pnm
+
+
+# 8 samples (0 for black, 255 for white) of every byte of bilevel rows
+_BILEVEL_SAMPLES = [
+    b"".join(b"\x00" if byte & (0x80 >> bit) else b"\xff"
+             for bit in xrange(8))
+    for byte in xrange(256)]
+
+
+class RasterView:
+    """Read-only view of the pixels of a binary PNM/PAM page mapped
+    to memory. Pixels are not copied: the pages stay in the OS page
+    cache and are shared by all the processes reading them.
+
+    Samples of a row are interleaved (RGBRGB...), 16-bit samples are
+    big-endian. Rows of bilevel (P4) images are packed 8 pixels
+    per byte with 1 for black ('bilevel' is True); samples() and
+    array() unpack them.
+    """
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            magic = f.read(2)
+            if magic not in (b"P4", b"P5", b"P6", b"P7"):
+                raise ProgramError(_(
+                    "'{file}' is not a binary PNM/PAM image, so it "
+                    "cannot be mapped to memory.").format(file=filename))
+            try:
+                info = _read_pnm(f, magic)
+            except (ValueError, KeyError, IndexError) as err:
+                raise ProgramError(_("Broken image header in '{file}': "
+                                     "{error}")
+                                   .format(file=filename, error=err))
+            self.offset = f.tell()
+            self.width = info.width
+            self.height = info.height
+            self.channels = info.channels
+            self.bilevel = magic == b"P4"
+            if self.bilevel:
+                # Of the unpacked samples
+                self.sample_size = 1
+                self.row_size = (self.width + 7) // 8
+            else:
+                self.sample_size = info.depth // 8
+                self.row_size = (self.width * self.channels *
+                                 self.sample_size)
+            size = self.offset + self.row_size * self.height
+            try:
+                self._map = mmap.mmap(f.fileno(), size,
+                                      access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError) as err:
+                raise ProgramError(_("Cannot map '{file}' to memory: "
+                                     "{error}")
+                                   .format(file=filename, error=err))
+        self.filename = filename
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def pixels(self):
+        """Returns buffer of all the pixels (without copying)."""
+        return buffer(self._map, self.offset, self.row_size * self.height)
+
+    def row(self, y):
+        """Returns buffer of row 'y' (without copying)."""
+        if not 0 <= y < self.height:
+            raise IndexError("row %d is out of image" % y)
+        return buffer(self._map, self.offset + y * self.row_size,
+                      self.row_size)
+
+    def samples(self, y):
+        """Returns bytearray of the samples of row 'y' (a copy). Bilevel
+        rows are unpacked to 0 for black and 255 for white pixels.
+        """
+        row = self.row(y)
+        if not self.bilevel:
+            return bytearray(row)
+        return bytearray(b"".join(_BILEVEL_SAMPLES[byte]
+                                  for byte in bytearray(row))[:self.width])
+
+    def array(self):
+        """Returns read-only NumPy array of shape (height, width,
+        channels) sharing memory with the file (bilevel images are
+        unpacked to a new array of 0 and 255). Requires NumPy.
+        """
+        if numpy is None:
+            raise ProgramError(_("NumPy is required to get pixels "
+                                 "of '{file}' as an array.")
+                               .format(file=self.filename))
+        if self.bilevel:
+            data = numpy.frombuffer(self._map, numpy.uint8,
+                                    self.row_size * self.height, self.offset)
+            bits = numpy.unpackbits(data.reshape(self.height, self.row_size),
+                                    axis=1)[:, :self.width]
+            return ((1 - bits) * 255).astype(numpy.uint8).reshape(
+                self.height, self.width, 1)
+        dtype = numpy.uint8 if self.sample_size == 1 else numpy.dtype(">u2")
+        data = numpy.frombuffer(self._map, dtype,
+                                self.width * self.height * self.channels,
+                                self.offset)
+        return data.reshape(self.height, self.width, self.channels)
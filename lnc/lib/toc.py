@@ -136,10 +136,27 @@ def read_toc(toc_file):
     return result
 
 
+def remap_toc(toc, page_map):
+    """Returns TOC (as returned by read_toc()) with page numbers
+    replaced according to 'page_map' dict. Entries for the pages
+    not in 'page_map' are dropped, their nested entries take their
+    place.
+    """
+    result = []
+    for entry in toc:
+        children = remap_toc(entry[2:], page_map)
+        if entry[0] in page_map:
+            result.append([page_map[entry[0]], entry[1]] + children)
+        else:
+            result += children
+    return result
+
+
 def generate_toc(input_file_name, output_file_name, entry_writer,
-                 header="", footer=""):
+                 header="", footer="", page_map=None):
     """Generates intermediate format-dependent TOC file (output) from
     simple input file (see documentation for syntax description).
+    If 'page_map' is given, TOC is changed by remap_toc().
 
     Output file is written as follows:
     - write 'header'
@@ -154,6 +171,8 @@ def generate_toc(input_file_name, output_file_name, entry_writer,
         raise ProgramError(_TOC_READ_ERROR_MSG.format(
             file=input_file_name,
             error=err))
+    if page_map is not None:
+        toc = remap_toc(toc, page_map)
     mkdir_p(os.path.dirname(output_file_name))
 
     try:
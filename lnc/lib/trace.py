@@ -0,0 +1,118 @@
+from __future__ import unicode_literals
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.process import start_recording, stop_recording
+
+
+_TRACE_WRITE_ERROR_MSG = _(
+    "Error while writing trace file '{file}':\n{error}")
+
+
+def _microseconds(seconds):
+    return int(seconds * 1000000)
+
+
+class Tracer:
+    """Collects timing of tasks and of the commands they run and writes
+    it as a Chrome trace event file (to be opened with chrome://tracing
+    or Perfetto UI).
+
+    Every worker thread is shown as a separate track, the main thread
+    (running before_tasks, get_tasks and after_tasks) has worker id 0.
+    """
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    @contextmanager
+    def span(self, target, name, worker, page=None):
+        """Records execution of the 'with' statement body together
+        with all the commands run by cmd_run() inside it.
+        """
+        start_recording()
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            commands = stop_recording()
+            self.add_span(target, name, worker, page, start, end, commands)
+
+    def add_span(self, target, name, worker, page, start, end, commands):
+        """Records a span measured by the caller, 'commands' is a list
+        of the statistics returned by stop_recording().
+        """
+        args = {"target": target, "page": page}
+        events = [{
+            "name": name if page is None else "%s #%d" % (name, page),
+            "cat": target,
+            "ph": "X",
+            "ts": _microseconds(start),
+            "dur": _microseconds(end - start),
+            "pid": self.pid,
+            "tid": worker,
+            "args": args}]
+        cpu_times = [cmd["cpu-time"] for cmd in commands
+                     if cmd["cpu-time"] is not None]
+        max_rss = [cmd["max-rss"] for cmd in commands
+                   if cmd["max-rss"] is not None]
+        if cpu_times:
+            args["cpu-time"] = sum(cpu_times)
+        if max_rss:
+            args["max-rss"] = max(max_rss)
+
+        for cmd in commands:
+            events.append({
+                "name": os.path.basename(cmd["argv"][0]),
+                "cat": target,
+                "ph": "X",
+                "ts": _microseconds(cmd["start"]),
+                "dur": _microseconds(cmd["end"] - cmd["start"]),
+                "pid": self.pid,
+                "tid": worker,
+                "args": {
+                    "argv": cmd["argv"],
+                    "cpu-time": cmd["cpu-time"],
+                    "max-rss": cmd["max-rss"]}})
+
+        with self.lock:
+            self.events += events
+
+    def write(self, filename):
+        """Writes all the collected events to 'filename'."""
+        with self.lock:
+            events = list(self.events)
+        workers = set(event["tid"] for event in events)
+        for worker in workers:
+            events.append({
+                "name": "thread_name",
+                "ph": "M",
+                "pid": self.pid,
+                "tid": worker,
+                "args": {"name": (_("Worker {id}").format(id=worker)
+                                  if worker else _("Main"))}})
+        try:
+            with open(filename, "wt") as trace_file:
+                json.dump({"traceEvents": events,
+                           "displayTimeUnit": "ms"}, trace_file)
+        except IOError as err:
+            raise ProgramError(_TRACE_WRITE_ERROR_MSG.format(
+                file=filename,
+                error=err))
+
+
+class NullTracer:
+    """Tracer replacement that records nothing."""
+    @contextmanager
+    def span(self, target, name, worker, page=None):
+        yield
+
+    def add_span(self, target, name, worker, page, start, end, commands):
+        pass
@@ -0,0 +1,79 @@
+from __future__ import unicode_literals
+
+import os
+import time
+
+
+def snapshot(paths):
+    """Returns dict mapping the names of all the files under 'paths'
+    (files or directories, missing ones are skipped) to their
+    (modification time, size).
+    """
+    state = {}
+
+    def add(filename):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            # Removed meanwhile
+            return
+        state[filename] = (st.st_mtime, st.st_size)
+
+    for path in paths:
+        if not os.path.isdir(path):
+            if os.path.exists(path):
+                add(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            for name in filenames:
+                add(os.path.join(dirpath, name))
+    return state
+
+
+def changed_files(old, new):
+    """Returns set of the files added, removed or modified between
+    two snapshots.
+    """
+    return set(name for name in set(old) | set(new)
+               if old.get(name) != new.get(name))
+
+
+def is_under(filename, path):
+    """Returns True if 'filename' is 'path' or lies under it."""
+    path = os.path.normpath(path)
+    filename = os.path.normpath(filename)
+    return filename == path or filename.startswith(path.rstrip(os.sep) +
+                                                   os.sep)
+
+
+class Watcher:
+    """Polls files under the given paths for changes.
+
+    inotify is not used as it is not portable and is missed on
+    network file systems; polling the input tree of a project is cheap.
+    """
+    def __init__(self, paths, interval=1.0):
+        """'interval' is the time between polls in seconds"""
+        self.paths = list(paths)
+        self.interval = interval
+        self.state = snapshot(self.paths)
+
+    def poll(self):
+        """Returns set of the files changed since the previous poll."""
+        state = snapshot(self.paths)
+        changed = changed_files(self.state, state)
+        self.state = state
+        return changed
+
+    def wait(self):
+        """Waits for changes and returns set of the changed files.
+        Returns only when the files stop changing for a poll interval,
+        so files that are still being copied are not built.
+        """
+        changed = set()
+        while True:
+            time.sleep(self.interval)
+            new = self.poll()
+            if not new and changed:
+                return changed
+            changed |= new
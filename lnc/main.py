@@ -1,13 +1,25 @@
 from __future__ import unicode_literals
 
 import os.path
+import time
 import threading
 import ConfigParser
 import traceback
 
-from lnc.lib.exceptions import ProgramError
+from lnc.lib.exceptions import (ProgramError, CommandCancelledError,
+                                WorkerConnectionError)
 from lnc.lib.plugin import get_plugin
-from lnc.lib.options import get_option
+from lnc.lib.options import get_option, get_int
+from lnc.lib.process import CommandContext, CommandPoller, set_context
+from lnc.lib.trace import Tracer, NullTracer
+from lnc.lib.jobs import JobController, parse_jobs, parse_memory_budget
+from lnc.lib.jobserver import JobServerClient
+from lnc.lib.cache import flush_uploads
+from lnc.lib.pages import (FULL_MODE, MERGE_MODE, PREVIEW_MODE,
+                           set_build_mode)
+from lnc.lib.distributed import (is_shippable, parse_worker_list,
+                                 connect_workers)
+from lnc.lib.watch import Watcher, is_under
 
 PACK = "lnc"
 
@@ -21,21 +33,65 @@ def _check_plugin_name(name):
 
 
 class NotesCompiler:
-    def __init__(self, ui, program_dir, project_dir, output_name):
+    def __init__(self, ui, program_dir, project_dir, output_name,
+                 keep_going=False, trace_file=None, pool=None,
+                 mode=FULL_MODE, page_range=None, draft=False):
         """
         'program_dir' is a base directory of the program (as string)
                       that contains the main configuration file
         'project_dir' is a base directory of project
         'output_name' is a common output file name to which various
                       extensions will be added
+        'keep_going'  is whether to process all the tasks that do not
+                      depend on failed ones instead of stopping on
+                      the first error
+        'trace_file'  is a file name to write Chrome trace events to
+                      (None to disable tracing)
+        'pool'        is WorkerPool shared with other projects to run
+                      the tasks on (None to use own worker threads)
+        'mode'        is FULL_MODE, SHARD_MODE (build the pages of
+                      'page_range' into shard bundles), MERGE_MODE
+                      (assemble the documents from the shard bundles)
+                      or PREVIEW_MODE (build separate documents of
+                      the pages of 'page_range')
+        'page_range'  is a tuple (first, last) of page numbers to build
+                      (None for all the pages)
+        'draft'       is whether to build low-resolution documents
+                      using separate cache directory
         """
         self.ui = ui
         self.program_dir = program_dir
         self.project_dir = project_dir
         self.output_name = output_name
+        self.keep_going = keep_going
+        self.failures = []
+        self.trace_file = trace_file
+        self.pool = pool
+        self.context = None
+        self.remote_workers = []
+        self.mode = mode
+        self.page_range = page_range
+        self.draft = draft
+        # Errors do not stop the watch mode
+        self.watching = False
+        if pool is None:
+            self.jobserver = JobServerClient.from_environment()
+        if trace_file is None:
+            self.tracer = NullTracer()
+        else:
+            self.tracer = Tracer()
+        if mode == PREVIEW_MODE:
+            # Do not overwrite the full documents
+            output_name = "%s-pages-%d-%d" % ((output_name,) + page_range)
+        cache_dir = os.path.join(self.project_dir, "cache")
+        if draft:
+            output_name += "-draft"
+            # Full-quality cache is not touched
+            cache_dir = os.path.join(cache_dir, "draft")
         defaults = {
-                "_OUTPUT": self.output_name,
+                "_OUTPUT": output_name,
                 "_PROJECT": self.project_dir,
+                "_CACHE": cache_dir,
                 "_SEP": os.sep
         }
         self.conf = ConfigParser.SafeConfigParser(defaults)
@@ -77,6 +133,8 @@ class NotesCompiler:
                 "No PATH parameter in config file {file}")
                 .format(file=filename))
         os.environ["PATH"] = self.conf.get("global", "PATH")
+        set_build_mode(self.conf, self.mode, self.page_range)
+        self.conf.set("global", "__draft__", "yes" if self.draft else "no")
 
     def load_project_config(self):
         filename = os.path.join(self.project_dir, "project.ini")
@@ -107,20 +165,89 @@ class NotesCompiler:
         msg = get_option(
             self.conf, plugin.target, "__msg__",
             _("Running {target}...").format(target=plugin.target))
+        context = CommandContext(
+            timeout=get_int(self.conf, plugin.target, "timeout", 0),
+            max_memory=get_int(self.conf, plugin.target, "max-memory", 0))
         self.ui.progress_before(target_index + 1, len(self.targets), msg)
-        plugin.before_tasks()
-        tasks = plugin.get_tasks()
-        jobs = self.conf.getint("global", "jobs")
-        v = Variables(self.ui, plugin.target, tasks)
-        run_tasks_in_parallel(v, jobs)
-        self.ui.progress_after()
-        plugin.after_tasks()
+        set_context(context)
+        self.context = context
+        try:
+            with self.tracer.span(plugin.target, "before_tasks", 0):
+                plugin.before_tasks()
+            if self.mode == MERGE_MODE:
+                # Only the assembly steps are done
+                tasks = []
+            else:
+                with self.tracer.span(plugin.target, "get_tasks", 0):
+                    tasks = plugin.get_tasks()
+            jobs = parse_jobs(
+                get_option(self.conf, plugin.target, "jobs",
+                           self.conf.get("global", "jobs")),
+                self.conf.getint("global", "job-memory"))
+            if self.pool is not None:
+                # Pool-wide memory budget and jobserver are used
+                v = Variables(self.ui, plugin.target, tasks, context,
+                              self.keep_going, self.tracer)
+                v.on_task_done = plugin.task_done
+                self.pool.run(v, jobs)
+            else:
+                controller = None
+                if (self.conf.getboolean("global", "adaptive-jobs") and
+                        JobController.is_supported()):
+                    controller = JobController(jobs)
+                budget = parse_memory_budget(
+                    self.conf.get("global", "memory-budget"))
+                v = Variables(self.ui, plugin.target, tasks, context,
+                              self.keep_going, self.tracer, budget,
+                              self.jobserver)
+                v.on_task_done = plugin.task_done
+                run_tasks_in_parallel(v, jobs, controller,
+                                      self.remote_workers)
+            if (v.errors):
+                self.ui.progress_finalize(True)
+                exc = [err[1] for
+                       err in v.errors if
+                       isinstance(err[0], Exception)]
+                if not self.keep_going:
+                    # Report at once without waiting for after_tasks()
+                    self.ui.error("[" + plugin.target + "] " +
+                                  "\n===\n\n".join(exc))
+                self.failures.append((plugin.target, exc))
+            if (self.failures and
+                    not self.conf.getboolean("global", "partial-output")):
+                # Do not assemble anything from incomplete set of pages
+                self.ui.progress_finalize()
+                return
+            self.ui.progress_after()
+            with self.tracer.span(plugin.target, "after_tasks", 0):
+                plugin.after_tasks()
+        finally:
+            set_context(None)
+            self.context = None
         self.ui.progress_finalize()
-        if (v.errors):
-            exc = [err[1] for
-                   err in v.errors if
-                   isinstance(err[0], Exception)]
-            self.ui.error("[" + plugin.target + "] " + "\n===\n\n".join(exc))
+        for warning in plugin.warnings:
+            self.ui.warning("[" + plugin.target + "] " + warning)
+        plugin.warnings = []
+
+    def report_failures(self):
+        """Shows all the errors collected in the keep-going mode."""
+        if not self.failures:
+            return
+        count = sum(len(errors) for target, errors in self.failures)
+        report = "\n===\n\n".join(
+            "[" + target + "] " + error
+            for target, errors in self.failures
+            for error in errors)
+        if self.watching:
+            self.ui.warning(_("{count} error(s) occurred. The failed tasks "
+                              "are retried on the next change.\n\n{report}")
+                            .format(count=count, report=report),
+                            title=_("Build failures"))
+            return
+        self.ui.error(_("{count} error(s) occurred. "
+                        "Rerun to retry the failed tasks.\n\n{report}")
+                      .format(count=count, report=report),
+                      title=_("Build failures"))
 
     def do_plugins_pretest(self):
         for plugin in self.targets:
@@ -138,7 +265,36 @@ class NotesCompiler:
             plugin = self.plugins[get_plugin(self.conf, name)]
             self.targets.append(plugin.Plugin(self.conf, name))
 
-    def run(self):
+    def connect_remote_workers(self):
+        """Connects to the workers listed in 'remote-workers' option
+        (not used with the shared pool of batch mode).
+        """
+        if (self.pool is not None or
+                not self.conf.has_option("global", "remote-workers")):
+            return
+        try:
+            workers = parse_worker_list(
+                self.conf.get("global", "remote-workers"))
+        except ProgramError as err:
+            self.ui.error(err)
+        self.remote_workers, errors = connect_workers(workers)
+        for error in errors:
+            self.ui.warning(error)
+
+    def close_remote_workers(self):
+        for worker in self.remote_workers:
+            worker.close()
+        self.remote_workers = []
+
+    def write_trace(self):
+        if self.trace_file is None:
+            return
+        try:
+            self.tracer.write(self.trace_file)
+        except ProgramError as err:
+            self.ui.warning(unicode(err))
+
+    def setup(self):
         self.load_global_config()
         self.load_plugins()
         self.load_project_config()
@@ -146,62 +302,587 @@ class NotesCompiler:
         self.create_targets()
 
         self.do_plugins_pretest()
-        for target_index in range(len(self.targets)):
+
+    def run(self):
+        self.setup()
+        self.connect_remote_workers()
+        try:
+            self.process_targets()
+        finally:
+            self.close_remote_workers()
+            flush_uploads()
+            self.write_trace()
+
+    def watch(self):
+        """Builds the documents and rebuilds them on every change
+        of the files watched by the targets until interrupted.
+
+        The configuration, plugins and worker connections are kept
+        between the builds. Only the first target affected by the change
+        and the following ones are processed, and their tasks are only
+        made for the pages that are not up to date.
+        """
+        self.setup()
+        self.watching = True
+        # Report errors and go on watching
+        self.keep_going = True
+        watched = [plugin.watch_paths() for plugin in self.targets]
+        watcher = Watcher(
+            [path for paths in watched for path in paths],
+            float(self.conf.get("global", "watch-interval")))
+        self.connect_remote_workers()
+        try:
+            self.process_targets()
+            while True:
+                try:
+                    changed = watcher.wait()
+                except KeyboardInterrupt:
+                    # The usual way to stop watching
+                    return
+                first = _first_affected(watched, changed)
+                if first is None:
+                    continue
+                self.failures = []
+                self.process_targets(range(first, len(self.targets)))
+        finally:
+            self.close_remote_workers()
+            flush_uploads()
+            self.write_trace()
+
+    def process_targets(self, target_indices=None):
+        """Processes the targets with 'target_indices' (all by default)."""
+        if target_indices is None:
+            target_indices = range(len(self.targets))
+        for target_index in target_indices:
             try:
                 self.process_target(target_index)
             except ProgramError as err:
                 self.ui.progress_finalize(True)
-                self.ui.error(_("[{target}] {error}'").format(
-                    target=self.targets[target_index].target,
-                    error=err))
+                target = self.targets[target_index].target
+                if not self.keep_going:
+                    self.ui.error(_("[{target}] {error}'").format(
+                        target=target,
+                        error=err))
+                self.failures.append((target, [unicode(err)]))
             except KeyboardInterrupt:
                 self.ui.progress_finalize(True)
                 exit(1)
+        self.report_failures()
+
+
+def _first_affected(watched, changed):
+    """Returns index of the first target having a file from 'changed'
+    under its watched paths (an item of 'watched') or None.
+    """
+    for index, paths in enumerate(watched):
+        if any(is_under(filename, path)
+               for filename in changed for path in paths):
+            return index
+    return None
 
 
 class WorkerThread(threading.Thread):
-    def __init__(self, v):
+    """Worker that runs tasks taken from 'source' which is either
+    Variables of a single target or WorkerPool.
+    """
+    uses_jobserver = True
+
+    def __init__(self, source, worker_id=1):
         threading.Thread.__init__(self)
-        self.v = v
+        self.source = source
+        self.worker_id = worker_id
 
     def run(self):
-        v = self.v
-        while True:
+        while self._run_next_task():
+            pass
+
+    def _run_next_task(self):
+        """Runs a single task. Returns False if the worker should stop."""
+        source = self.source
+        slot = None
+        if self.uses_jobserver and source.jobserver is not None:
+            # A job slot is only held while there is a task to take
+            while slot is None:
+                if not source.wait_for_work():
+                    return False
+                slot = source.jobserver.acquire(source.is_exhausted)
+        try:
+            item = self._next_task(source)
+            if item is None:
+                return False
+            v, task = item
+            set_context(v.context)
+            self._run_task(v, task)
+            return True
+        finally:
+            if slot is not None:
+                source.jobserver.release(slot)
+
+    def _next_task(self, source):
+        return source.next_task()
+
+    def _run_task(self, v, task):
+        try:
+            with v.tracer.span(v.target, "task", self.worker_id,
+                               task.get("num")):
+                self._execute(v, task)
+            if v.on_task_done is not None:
+                v.on_task_done(task)
+        except CommandCancelledError:
+            # Some other task has failed already
+            _discard_output(task)
             with v.lock:
-                if v.errors or not v.tasks:
-                    return
-                task = v.tasks.pop()
+                v.task_finished(task)
+            return
+        except BaseException as err:
+            _discard_output(task)
+            with v.lock:
+                if isinstance(err, ProgramError):
+                    v.errors.append((err, str(err)))
+                else:
+                    v.errors.append((err, traceback.format_exc()))
+                if not v.keep_going:
+                    v.task_finished(task)
+            if not v.keep_going:
+                # Do not wait for the commands of other tasks to finish
+                v.context.cancel()
+                return
+
+        with v.lock:
+            v.task_finished(task)
+            v.done += 1
+            v.report_progress()
 
+    def _execute(self, v, task):
+        task["__handler__"](task)
+
+
+class RemoteWorkerThread(WorkerThread):
+    """Worker that sends tasks to a remote worker process.
+
+    Tasks that cannot be shipped are run locally. If the connection
+    is lost the task is run locally too, and so are all the following
+    ones of this thread.
+    """
+    # Remote tasks do not take local jobserver slots
+    uses_jobserver = False
+
+    def __init__(self, source, worker, worker_id):
+        WorkerThread.__init__(self, source, worker_id)
+        self.worker = worker
+
+    def _next_task(self, source):
+        # Tasks run on the other machine do not use the local memory
+        return source.next_task(remote=self.worker is not None)
+
+    def _execute(self, v, task):
+        if self.worker is not None and is_shippable(task):
             try:
-                task["__handler__"](task)
-            except BaseException as err:
-                with v.lock:
-                    if isinstance(err, ProgramError):
-                        v.errors.append((err, str(err)))
-                    else:
-                        v.errors.append((err, traceback.format_exc()))
+                self.worker.run_task(task, v.context)
                 return
+            except WorkerConnectionError:
+                self.worker = None
+        task["__handler__"](task)
 
-            with v.lock:
-                v.done += 1
-                v.ui.progress_current(float(v.done) / v.total)
+
+def _discard_output(task):
+    """Removes possibly incomplete output of the failed task,
+    so it will not be considered up to date on the next run.
+    """
+    if "output" not in task:
+        return
+    try:
+        os.remove(task["output"])
+    except OSError:
+        pass
+
+
+class MemoryBudget:
+    """Memory shared by the running tasks of one or several targets."""
+    def __init__(self, total=0):
+        """'total' is the amount of memory in megabytes (0 means no limit)"""
+        self.total = total
+        self.used = 0
 
 
 class Variables:
-    def __init__(self, ui, target, tasks):
+    def __init__(self, ui, target, tasks, context=None, keep_going=False,
+                 tracer=None, memory_budget=0, jobserver=None):
+        """
+        'memory_budget' is the amount of memory in megabytes that all
+                        the running tasks may use together according
+                        to their '__memory__' estimates (0 means
+                        no limit)
+        'jobserver'     is JobServerClient to take a job slot from
+                        for every running task (or None)
+        """
         self.ui = ui
+        self.keep_going = keep_going
+        self.tracer = tracer or NullTracer()
+        self.context = context or CommandContext()
         self.done = 0
         self.total = max(len(tasks), 1)
         self.tasks = tasks
         self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
         self.target = target
         self.errors = []
+        self.retiring = 0
+        self.running = 0
+        self.max_running = 0
+        self.memory = MemoryBudget(memory_budget)
+        # Ids of the running tasks taken to be run remotely, their
+        # memory is not reserved
+        self.remote_tasks = set()
+        self.jobserver = jobserver
+        self.shown_percent = None
+        # Function called with every task that has succeeded
+        self.on_task_done = None
 
+    def report_progress(self):
+        """Shows the progress if it has changed by a whole percent
+        since it was last shown: with thousands of short tasks
+        redrawing it after each of them slows the workers down.
+        Should be called with 'lock' held.
+        """
+        percent = 100 * self.done // self.total
+        if percent != self.shown_percent:
+            self.shown_percent = percent
+            self.ui.progress_current(float(self.done) / self.total)
 
-def run_tasks_in_parallel(v, jobs):
-    thrs = [WorkerThread(v) for i in xrange(jobs)]
+    def share(self, cond, memory):
+        """Makes this object use the lock (the one of 'cond' condition)
+        and the memory budget shared with other Variables.
+        Should be called before any task is taken.
+        """
+        self.cond = cond
+        self.lock = cond
+        self.memory = memory
+
+    def is_exhausted(self):
+        """Returns True if no more tasks will be taken."""
+        # Even with keep_going an interrupted target takes no more tasks
+        return (not self.tasks or self.context.cancelled or
+                bool(self.errors and not self.keep_going))
+
+    def is_finished(self):
+        """Returns True if no more tasks will be taken
+        and none of them is running.
+        """
+        return self.running == 0 and self.is_exhausted()
+
+    def wait_for_work(self):
+        """Returns False if the calling worker should stop as no more
+        tasks will be taken.
+        """
+        return not self.is_exhausted()
+
+    def _find_task(self, remote=False):
+        """Returns index of the task to run next or None if none of them
+        fits into the remaining memory budget. If 'remote' is True
+        the tasks that can be run remotely are preferred.
+        """
+        if remote:
+            for index in xrange(len(self.tasks) - 1, -1, -1):
+                if is_shippable(self.tasks[index]):
+                    return index
+        memory = self.memory
+        if not memory.total:
+            return len(self.tasks) - 1
+        available = memory.total - memory.used
+        for index in xrange(len(self.tasks) - 1, -1, -1):
+            if self.tasks[index].get("__memory__", 0) <= available:
+                return index
+        if memory.used == 0:
+            # Too large to ever fit: run it alone
+            return len(self.tasks) - 1
+        return None
+
+    def take_ready_task(self, remote=False):
+        """Returns the task that can be run right now or None.
+        'remote' is True for the workers running the tasks remotely.
+        Should be called with 'lock' held.
+        """
+        if self.is_exhausted():
+            return None
+        if self.max_running and self.running >= self.max_running:
+            return None
+        index = self._find_task(remote)
+        if index is None:
+            return None
+        task = self.tasks.pop(index)
+        if remote and is_shippable(task):
+            self.remote_tasks.add(id(task))
+        else:
+            self.memory.used += task.get("__memory__", 0)
+        self.running += 1
+        return task
+
+    def take_task(self, remote=False):
+        """Returns the next task to run or None if the calling worker
+        should stop. Waits for running tasks to free enough memory
+        if necessary. Should be called with 'lock' held.
+        """
+        while True:
+            if self.is_exhausted():
+                return None
+            if self.retiring > 0:
+                self.retiring -= 1
+                return None
+            task = self.take_ready_task(remote)
+            if task is not None:
+                return task
+            self.cond.wait()
+
+    def next_task(self, remote=False):
+        """Returns (self, task) for the next task to run
+        or None if the calling worker should stop.
+        """
+        with self.lock:
+            task = self.take_task(remote)
+        if task is None:
+            return None
+        return self, task
+
+    def task_finished(self, task):
+        """Releases the memory reserved for 'task'.
+        Should be called with 'lock' held.
+        """
+        if id(task) in self.remote_tasks:
+            self.remote_tasks.discard(id(task))
+        else:
+            self.memory.used -= task.get("__memory__", 0)
+        self.running -= 1
+        self.cond.notify_all()
+
+
+# Remote worker threads are numbered from here (e.g. in traces)
+_REMOTE_WORKER_ID = 1001
+
+
+def _start_worker(v, thrs):
+    used_ids = set(thread.worker_id for thread in thrs)
+    worker_id = min(set(xrange(1, len(thrs) + 2)) - used_ids)
+    thread = WorkerThread(v, worker_id)
+    thread.start()
+    thrs.append(thread)
+
+
+class CommandWorkerThread(threading.Thread):
+    """Worker that runs up to 'slots' tasks of 'v' at once. The tasks
+    should have '__command__': the external command line doing all
+    their work, which is run instead of '__handler__'.
+
+    The commands are multiplexed with CommandPoller from this single
+    thread, so thousands of short commands do not need a thread each.
+    """
+    def __init__(self, v, slots):
+        threading.Thread.__init__(self)
+        self.v = v
+        self.slots = slots
+        self.poller = CommandPoller()
+        self.free_ids = range(slots, 0, -1)
+
+    def run(self):
+        v = self.v
+        while True:
+            tasks = []
+            with v.lock:
+                while len(self.poller) + len(tasks) < self.slots:
+                    task = v.take_ready_task()
+                    if task is None:
+                        break
+                    tasks.append(task)
+            # Callbacks take the lock, and they are called at once
+            # if a command cannot be started
+            for task in tasks:
+                self._start(task)
+            if not tasks and not len(self.poller):
+                # Nothing is running, so nothing is left to take
+                return
+            if len(self.poller):
+                self.poller.poll(0.1)
+
+    def _start(self, task):
+        # Outputs of commands may be hard links to other files
+        _discard_output(task)
+        worker_id = self.free_ids.pop()
+        start = time.time()
+
+        def finished(output, err, record):
+            self.free_ids.append(worker_id)
+            self.v.tracer.add_span(self.v.target, "task", worker_id,
+                                   task.get("num"), start, time.time(),
+                                   [record] if record else [])
+            self._finished(task, err)
+
+        self.poller.start(task["__command__"], self.v.context, finished)
+
+    def _finished(self, task, err):
+        """Does what WorkerThread does after a task."""
+        v = self.v
+        if err is not None:
+            _discard_output(task)
+        elif v.on_task_done is not None:
+            v.on_task_done(task)
+        with v.lock:
+            v.task_finished(task)
+            if isinstance(err, CommandCancelledError):
+                # Some other task has failed already
+                return
+            if err is not None:
+                v.errors.append((err, str(err)))
+            if err is None or v.keep_going:
+                v.done += 1
+                v.report_progress()
+                return
+        # Do not wait for the commands of other tasks to finish
+        v.context.cancel()
+
+
+def _adjust_workers(v, thrs, controller):
+    jobs = controller.update(len(thrs))
+    if jobs is None:
+        return
+    with v.lock:
+        v.retiring = max(len(thrs) - jobs, 0)
+        grow = not v.is_exhausted()
+    if grow:
+        for i in xrange(jobs - len(thrs)):
+            _start_worker(v, thrs)
+
+
+def run_tasks_in_parallel(v, jobs, controller=None, remote_workers=()):
+    """Runs all the tasks from 'v' in 'jobs' worker threads.
+
+    If JobController is given as 'controller', the number of threads
+    is adjusted at run time according to its suggestions.
+    Every RemoteWorker from 'remote_workers' gets a thread of its own
+    in addition to the local ones.
+    """
+    thrs = []
+    remote_thrs = []
     v.ui.progress_current(0)
-    for thread in thrs:
+    if _runs_commands_only(v, controller, remote_workers):
+        thread = CommandWorkerThread(v, jobs)
+        thread.start()
+        thrs.append(thread)
+        controller = None
+    else:
+        for i in xrange(jobs):
+            _start_worker(v, thrs)
+    for worker in remote_workers:
+        if worker.broken:
+            continue
+        thread = RemoteWorkerThread(v, worker,
+                                    _REMOTE_WORKER_ID + len(remote_thrs))
         thread.start()
-    for thread in thrs:
-        thread.join()
+        remote_thrs.append(thread)
+    try:
+        while thrs or remote_thrs:
+            # join() without timeout cannot be interrupted by Ctrl-C
+            (thrs or remote_thrs)[0].join(0.1)
+            thrs[:] = [thread for thread in thrs if thread.is_alive()]
+            remote_thrs[:] = [thread for thread in remote_thrs
+                              if thread.is_alive()]
+            if controller is not None and thrs:
+                _adjust_workers(v, thrs, controller)
+    except KeyboardInterrupt as err:
+        with v.lock:
+            v.errors.append((err, ""))
+            v.cond.notify_all()
+        v.context.cancel()
+        for thread in thrs + remote_thrs:
+            thread.join()
+        raise
+
+
+def _runs_commands_only(v, controller, remote_workers):
+    """Returns True if all the tasks of 'v' may be run by
+    CommandWorkerThread.
+    """
+    return (bool(v.tasks) and
+            all("__command__" in task for task in v.tasks) and
+            CommandPoller.is_supported() and
+            controller is None and v.jobserver is None and
+            not any(not worker.broken for worker in remote_workers))
+
+
+class WorkerPool:
+    """Fixed set of worker threads shared by several targets
+    (usually of different projects) running at the same time.
+
+    Tasks of all the targets passed to run() are interleaved,
+    so serial steps of one project overlap with the tasks of others.
+    """
+    def __init__(self, jobs, memory_budget=0, jobserver=None):
+        self.cond = threading.Condition()
+        self.memory = MemoryBudget(memory_budget)
+        self.jobserver = jobserver
+        self.active = []
+        self.closed = False
+        self.threads = []
+        for i in xrange(jobs):
+            thread = WorkerThread(self, i + 1)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self, v, max_running=0):
+        """Runs all the tasks from 'v' (at most 'max_running' at once,
+        0 means no limit) and returns when they are finished.
+        """
+        v.share(self.cond, self.memory)
+        v.max_running = max_running
+        v.ui.progress_current(0)
+        with self.cond:
+            self.active.append(v)
+            self.cond.notify_all()
+            while not v.is_finished():
+                self.cond.wait()
+            self.active.remove(v)
+
+    def is_exhausted(self):
+        """Returns True if there is nothing to take right now."""
+        return self.closed or all(v.is_exhausted() for v in self.active)
+
+    def wait_for_work(self):
+        """Waits until some target has tasks to take. Returns False
+        if the pool is closed: the workers outlive the targets, so
+        having no targets running is not a reason to stop.
+        """
+        with self.cond:
+            while not self.closed and self.is_exhausted():
+                self.cond.wait()
+            return not self.closed
+
+    def next_task(self):
+        """Returns (Variables, task) for the next task to run
+        or None if the pool is closed.
+        """
+        with self.cond:
+            while not self.closed:
+                for index, v in enumerate(self.active):
+                    task = v.take_ready_task()
+                    if task is not None:
+                        # Round robin between targets
+                        self.active.append(self.active.pop(index))
+                        return v, task
+                self.cond.wait()
+        return None
+
+    def cancel(self, err):
+        """Stops all the running targets reporting 'err' for them."""
+        with self.cond:
+            for v in self.active:
+                v.errors.append((err, ""))
+                v.context.cancel()
+            self.cond.notify_all()
+
+    def close(self):
+        """Stops all the worker threads."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
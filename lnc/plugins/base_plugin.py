@@ -1,10 +1,33 @@
-from lnc.lib.options import get_option, check_target_options
+import os.path
+import glob
+
+from lnc.lib.options import get_option, get_int, check_target_options
+from lnc.lib.io import mkdir_p, filter_regexp
+from lnc.lib.pagestore import PageStore
+from lnc.lib.duplicates import read_page_index, find_duplicates
+from lnc.lib.cache import link_or_copy
+from lnc.lib.jobs import parse_jobs
+from lnc.lib.batching import make_batches, make_batch_task
+from lnc.lib.imaging import get_backend
+from lnc.lib.pages import (SHARD_MODE, MERGE_MODE, get_build_mode,
+                           get_page_range, page_number, shard_file_name,
+                           list_shards)
+
+
+# Options that are accepted by any target
+_COMMON_OPTIONS = ["jobs", "timeout", "max-memory"]
 
 
 class BasePlugin:
+    # Version of the tool producing the results of tasks
+    # (a part of the shared cache keys, see test())
+    tool_version = None
+
     def __init__(self, conf, target):
         self.conf = conf
         self.target = target
+        # Messages for the user (shown after each step)
+        self.warnings = []
 
     def test(self):
         pass
@@ -18,8 +41,133 @@ class BasePlugin:
     def after_tasks(self):
         pass
 
+    def task_done(self, task):
+        """Called by the worker threads after 'task' has succeeded."""
+        pass
+
+    def watch_paths(self):
+        """Returns list of files and directories the target reads
+        directly (not the results of the previous targets).
+        Their changes make the target rebuild in the watch mode.
+        """
+        return []
+
     def _get_option(self, option, default=None):
         return get_option(self.conf, self.target, option, default)
 
+    def _get_image_backend(self):
+        return get_backend(self._get_option("image-backend", "imagemagick"))
+
+    def _build_mode(self):
+        return get_build_mode(self.conf)
+
+    def _get_draft_option(self, option):
+        """Returns the value of integer 'option' of [global] section
+        if low-resolution draft is built or None otherwise.
+        """
+        if not (self.conf.has_option("global", "__draft__") and
+                self.conf.getboolean("global", "__draft__")):
+            return None
+        return self.conf.getint("global", option)
+
+    def _in_page_range(self, num):
+        """Returns True if page 'num' should be built."""
+        page_range = get_page_range(self.conf)
+        return page_range is None or page_range[0] <= num <= page_range[1]
+
+    def _remove_stale_pages(self, directory, nums):
+        """Removes pages of the page range from 'directory' whose
+        numbers are not in 'nums' (their sources are removed),
+        so they are not assembled into the documents.
+        """
+        for name in filter_regexp(directory, r"^[0-9]+[.].*$", r".*"):
+            num = page_number(name)
+            if num not in nums and self._in_page_range(num):
+                os.remove(os.path.join(directory, name))
+
+    def _find_duplicate_pages(self, store):
+        """Returns dict mapping numbers of the pages of the page range
+        from PageStore 'store' to the numbers of the byte-identical
+        pages of the page range that come first.
+        """
+        return dict((num, first) for num, first in
+                    find_duplicates(read_page_index(store)).items()
+                    if self._in_page_range(num) and
+                    self._in_page_range(first))
+
+    def _link_duplicate_pages(self, out_cache_dir, ext):
+        """Makes the results of the pages from 'self.duplicates' list
+        of (page, identical page) links to the results of the identical
+        pages, so they are encoded once.
+        """
+        for num, first in self.duplicates:
+            source = os.path.join(out_cache_dir, "%04d%s" % (first, ext))
+            if os.path.exists(source):
+                link_or_copy(source, os.path.join(out_cache_dir,
+                                                  "%04d%s" % (num, ext)))
+
+    def _batch_tasks(self, tasks, key, func):
+        """Groups tasks with equal 'key(task)' (see make_batches())
+        into tasks processing up to 'batch-size' pages at once with
+        'func(list of tasks)', so the tools are started less often.
+        There are enough batches for all the jobs of the target.
+        """
+        max_size = get_int(self.conf, self.target, "batch-size", 1)
+        if max_size <= 1 or self.conf.get("global", "remote-workers"):
+            # Remote workers get single pages
+            return tasks
+        jobs = parse_jobs(self._get_option("jobs",
+                                           self.conf.get("global", "jobs")),
+                          self.conf.getint("global", "job-memory"))
+        max_size = min(max_size, max(len(tasks) // jobs, 1))
+        return [batch[0] if len(batch) == 1 else
+                make_batch_task(batch, func)
+                for batch in make_batches(tasks, key, max_size)]
+
+    def _get_assembly_files(self, cache_dir, ext, output_file):
+        """Returns (input files, output file) for assembling
+        the document from the pages with extension 'ext' in 'cache_dir'.
+        The pages are restricted to the page range, in the shard mode
+        the output is the shard bundle in 'shard-dir' and in the merge
+        mode the inputs are all the shard bundles.
+        """
+        mode = self._build_mode()
+        if mode == MERGE_MODE:
+            # The pages may be prepared on other machines only
+            pages_dir = self._get_option("in-cache-dir", "")
+            pages = None
+            if os.path.isdir(pages_dir):
+                pages = PageStore(pages_dir).pages()
+            return (list_shards(self._get_option("shard-dir"), ext, pages),
+                    output_file)
+        input_files = [filename for filename in
+                       sorted(glob.glob(os.path.join(cache_dir, "*" + ext)))
+                       if self._in_page_range(page_number(filename))]
+        if mode == SHARD_MODE:
+            shard_dir = self._get_option("shard-dir")
+            mkdir_p(shard_dir)
+            output_file = os.path.join(
+                shard_dir, shard_file_name(get_page_range(self.conf), ext))
+        return input_files, output_file
+
+    def _get_page_map(self):
+        """Returns dict mapping page positions in the full document
+        (as used in TOC) to the ones in the document of the page range
+        or None if all the pages are built. Positions are found from
+        the list of the prepared pages in 'pages-dir'.
+        """
+        page_range = get_page_range(self.conf)
+        if page_range is None:
+            return None
+        pages = PageStore(self._get_option("pages-dir")).pages()
+        page_map = {}
+        for position, num in enumerate(sorted(pages), 1):
+            if page_range[0] <= num <= page_range[1]:
+                page_map[position] = len(page_map) + 1
+        return page_map
+
     def _check_target_options(self, min_opts, max_opts=None):
-        return check_target_options(self.conf, self.target, min_opts, max_opts)
+        if max_opts is None:
+            max_opts = min_opts
+        return check_target_options(self.conf, self.target, min_opts,
+                                    list(max_opts) + _COMMON_OPTIONS)
@@ -5,25 +5,100 @@ import glob
 import errno
 
 from lnc.plugins.base_plugin import BasePlugin
-from lnc.lib.process import cmd_try_run, cmd_run, _COMMAND_NOT_FOUND_MSG
-from lnc.lib.io import mkdir_p, filter_regexp, needs_update
+from lnc.lib.process import (cmd_try_run, cmd_run, get_context,
+                             _COMMAND_NOT_FOUND_MSG)
+from lnc.lib.io import mkdir_p, needs_update, split_common_dir
 from lnc.lib.exceptions import ProgramError
+from lnc.lib.pagestore import PageStore
+from lnc.lib.imageinfo import estimate_memory
+from lnc.lib.cache import open_cache, run_cached, tool_version
+from lnc.lib.assembly import StreamingAssembler
+from lnc.lib.imaging import get_backend
 
 
-def handler(info):
+# Extensions of the files c44 can read
+_C44_FORMATS = (".pnm", ".pbm", ".pgm", ".ppm", ".jpg", ".jpeg")
+
+# Pages bundled by one run of djvm: larger documents are assembled
+# from intermediate bundles, so the command lines stay short
+_DJVM_CHUNK = 1000
+
+# Pages bundled together while the following pages are being encoded
+_STREAM_CHUNK = 100
+
+
+def _c44_options(draft):
+    if draft:
+        # Only the first (coarsest) refinement chunk
+        return ["-slice", "74"]
+    return []
+
+
+def _encode(info):
     try:
         os.remove(info["output"])
     except OSError as err:
         if err.errno != errno.ENOENT:
             raise
-    cmd_run(["c44", info["input"], info["output"]])
+    options = _c44_options(info.get("draft"))
+    source = info["input"]
+    if not source.lower().endswith(_C44_FORMATS):
+        # c44 reads only PNM and JPEG: unpack compressed pages
+        source = info["output"] + ".tmp.pnm"
+        get_backend(info["image-backend"]).to_pnm(info["input"], source)
+    try:
+        cmd_run(["c44"] + options + [source, info["output"]])
+    finally:
+        if source != info["input"]:
+            try:
+                os.remove(source)
+            except OSError:
+                pass
+
+
+def _bundle(djvu_file, input_files):
+    """Creates bundled document 'djvu_file' from 'input_files'
+    (pages or other documents).
+    """
+    directory, names = split_common_dir(input_files)
+    cmd_run(["djvm", "-create", os.path.abspath(djvu_file)] + names,
+            cwd=directory)
+
+
+def _bundle_in_stages(djvu_file, input_files):
+    parts = []
+    try:
+        for index in xrange(0, len(input_files), _DJVM_CHUNK):
+            part = "%s.part%04d.djvu" % (djvu_file, len(parts))
+            parts.append(part)
+            _bundle(part, input_files[index:index + _DJVM_CHUNK])
+        _bundle(djvu_file, parts)
+    finally:
+        for part in parts:
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+
+
+def handler(info):
+    run_cached(info, [info["input"]],
+               {"plugin": "djvu",
+                "tool-version": info.get("tool-version"),
+                "draft": info.get("draft", False)},
+               lambda: _encode(info))
 
 
 class Plugin(BasePlugin):
     def test(self):
         self._check_target_options(["in-cache-dir",
                                     "out-cache-dir",
-                                    "djvu-file"])
+                                    "djvu-file"],
+                                   ["in-cache-dir",
+                                    "out-cache-dir",
+                                    "djvu-file",
+                                    "shard-dir",
+                                    "image-backend"])
 
         cmd_try_run("c44", fail_msg=_COMMAND_NOT_FOUND_MSG.format(
             command="c44",
@@ -31,36 +106,115 @@ class Plugin(BasePlugin):
         cmd_try_run("djvm", fail_msg=_COMMAND_NOT_FOUND_MSG.format(
             command="djvm",
             package="DjVuLibre"))
+        # c44 prints its version with the usage message
+        self.tool_version = tool_version(["c44"])
+        self._check_unpacking()
+
+    def _check_unpacking(self):
+        """Checks that the image backend is available if some of
+        the prepared pages should be unpacked for c44.
+        """
+        in_cache_dir = self._get_option("in-cache-dir")
+        if not os.path.isdir(in_cache_dir):
+            # Not prepared yet, checked again by before_tasks()
+            return
+        pages = PageStore(in_cache_dir).pages()
+        if any(not page_file.lower().endswith(_C44_FORMATS)
+               for page_file in pages.values()):
+            self._get_image_backend().tool_version()
 
     def before_tasks(self):
         out_cache_dir = self._get_option("out-cache-dir")
         djvu_file = self._get_option("djvu-file")
 
+        self._check_unpacking()
+
         mkdir_p(out_cache_dir)
         mkdir_p(os.path.dirname(djvu_file))
+        # (page, identical page to encode) pairs
+        self.duplicates = []
+        self.assembler = None
+        # Parts left by a failed build
+        for part in glob.glob(os.path.join(out_cache_dir, ".part*.djvu")):
+            os.remove(part)
 
     def get_tasks(self):
         in_cache_dir = self._get_option("in-cache-dir")
         out_cache_dir = self._get_option("out-cache-dir")
 
-        imgs = filter_regexp(in_cache_dir, r"^[0-9]+[.].*$")
+        store = PageStore(in_cache_dir)
+        pages = store.pages()
+        duplicates = self._find_duplicate_pages(store)
+        cache = open_cache(self.conf)
+        draft = self._get_draft_option("draft-scale") is not None
+        backend = self._get_image_backend().name
         res = []
-        for img in imgs:
-            num = int(img[:img.index(".")])
+        for num, page_file in sorted(pages.items()):
+            if not self._in_page_range(num):
+                continue
             x = {
                     "__handler__": handler,
-                    "input": os.path.join(in_cache_dir, img),
-                    "output": os.path.join(out_cache_dir, "%04d.djvu" % num)
+                    "num": num,
+                    "input": page_file,
+                    "output": os.path.join(out_cache_dir, "%04d.djvu" % num),
+                    "cache": cache,
+                    "tool-version": self.tool_version,
+                    "image-backend": backend,
+                    "draft": draft
                 }
             if needs_update(x["input"], x["output"]):
+                if num in duplicates:
+                    # Encoded once, see after_tasks()
+                    self.duplicates.append((num, duplicates[num]))
+                    continue
+                x["__memory__"] = estimate_memory(x["input"], 1)
+                if cache is None and page_file.lower().endswith(_C44_FORMATS):
+                    # The whole task is a single command
+                    x["__command__"] = (["c44"] + _c44_options(draft) +
+                                        [x["input"], x["output"]])
                 res.append(x)
+        self._remove_stale_pages(out_cache_dir, pages)
+        self._start_assembly(out_cache_dir, pages, res)
         return res
 
+    def _start_assembly(self, out_cache_dir, pages, tasks):
+        """Makes the pages be bundled as they are encoded."""
+        def page_file(num):
+            return os.path.join(out_cache_dir, "%04d.djvu" % num)
+
+        self.assembler = StreamingAssembler(
+            [page_file(num) for num in sorted(pages)
+             if self._in_page_range(num)],
+            [task["output"] for task in tasks],
+            dict((page_file(num), page_file(first))
+                 for num, first in self.duplicates),
+            _bundle,
+            lambda index: os.path.join(out_cache_dir,
+                                       ".part%04d.djvu" % index),
+            _STREAM_CHUNK,
+            get_context())
+
+    def task_done(self, task):
+        if self.assembler is not None:
+            self.assembler.page_done(task["output"])
+
     def after_tasks(self):
         out_cache_dir = self._get_option("out-cache-dir")
-        djvu_file = self._get_option("djvu-file")
-
-        input_files = sorted(glob.glob(os.path.join(out_cache_dir, "*.djvu")))
+        self._link_duplicate_pages(out_cache_dir, ".djvu")
+        input_files, djvu_file = self._get_assembly_files(
+            out_cache_dir, ".djvu", self._get_option("djvu-file"))
         if len(input_files) == 0:
             raise ProgramError(_("No input files."))
-        cmd_run(["djvm", "-create", djvu_file] + input_files)
+        try:
+            if self.assembler is not None:
+                # Pages bundled meanwhile are joined as parts (djvm
+                # still copies their data into the document)
+                input_files = self.assembler.finish(input_files)
+            if len(input_files) > _DJVM_CHUNK:
+                _bundle_in_stages(djvu_file, input_files)
+            else:
+                _bundle(djvu_file, input_files)
+        finally:
+            if self.assembler is not None:
+                self.assembler.remove_parts()
+                self.assembler = None
@@ -1,6 +1,7 @@
 from __future__ import unicode_literals, print_function
 
 from lnc.plugins.base_plugin import BasePlugin
+from lnc.lib.pages import SHARD_MODE
 from lnc.lib.process import cmd_try_run, cmd_run, _COMMAND_NOT_FOUND_MSG
 from lnc.lib.toc import escape, generate_toc
 
@@ -23,20 +24,31 @@ class Plugin(BasePlugin):
     def test(self):
         self._check_target_options(["toc-file",
                                     "tmp-file",
-                                    "djvu-file"])
+                                    "djvu-file"],
+                                   ["toc-file",
+                                    "tmp-file",
+                                    "djvu-file",
+                                    "pages-dir"])
 
         cmd_try_run("djvused", fail_msg=_COMMAND_NOT_FOUND_MSG.format(
             command="djvused",
             package="DjVuLibre"))
 
-    def before_tasks(self):
+    def watch_paths(self):
+        return [self._get_option("toc-file")]
+
+    def after_tasks(self):
+        if self._build_mode() == SHARD_MODE:
+            # TOC is added to the merged document
+            return
         toc_file = self._get_option("toc-file")
         tmp_file = self._get_option("tmp-file")
         djvu_file = self._get_option("djvu-file")
 
         generate_toc(toc_file, tmp_file, _write_entry,
                      "set-outline\n(bookmarks\n",
-                     ")\n.")
+                     ")\n.",
+                     page_map=self._get_page_map())
 
         cmd = ["djvused", "-s", "-f", tmp_file, djvu_file]
         cmd_run(cmd)
@@ -2,32 +2,62 @@ from __future__ import unicode_literals
 
 import os.path
 import errno
-import glob
 
 from lnc.plugins.base_plugin import BasePlugin
 from lnc.lib.process import cmd_run, _COMMAND_NOT_FOUND_MSG
-from lnc.lib.io import mkdir_p, filter_regexp, needs_update
+from lnc.lib.io import mkdir_p, needs_update, split_common_dir
+from lnc.lib.options import get_int
 from lnc.lib.exceptions import ProgramError
+from lnc.lib.pagestore import PageStore
+from lnc.lib.imageinfo import estimate_memory
+from lnc.lib.cache import open_cache, run_cached
+from lnc.lib.imaging import ImageMagickBackend, get_backend
 
 
-def handler(info):
+def _encode(info):
     try:
         os.remove(info["output"])
     except OSError as err:
         if err.errno != errno.ENOENT:
             raise
-    cmd_run(["convert", info["input"], info["output"]])
+    get_backend(info["image-backend"]).encode_pdf(info)
+
+
+def handler(info):
+    run_cached(info, [info["input"]],
+               {"plugin": "pdf",
+                "tool-version": info.get("tool-version"),
+                "quality": info.get("quality")},
+               lambda: _encode(info))
+
+
+def batch_handler(tasks):
+    """Encodes pages of 'tasks' with a single run of the image backend."""
+    get_backend(tasks[0]["image-backend"]).encode_pdf_pages(tasks)
+
+
+def _batch_key(info):
+    if (info["cache"] is not None or
+            not get_backend(info["image-backend"]).supports_batches):
+        # Every page is looked up in the cache
+        return None
+    return (info.get("quality"),)
 
 
 class Plugin(BasePlugin):
     def test(self):
         self._check_target_options(["in-cache-dir",
                                     "out-cache-dir",
-                                    "pdf-file"])
+                                    "pdf-file"],
+                                   ["in-cache-dir",
+                                    "out-cache-dir",
+                                    "pdf-file",
+                                    "shard-dir",
+                                    "batch-size",
+                                    "image-backend"])
+        get_int(self.conf, self.target, "batch-size", 1)
 
-        cmd_run(["convert", "-version"], fail_msg=_COMMAND_NOT_FOUND_MSG.format(
-            command="convert",
-            package="ImageMagick"))
+        self.tool_version = self._get_image_backend().tool_version()
         cmd_run(["gs", "--version"], fail_msg=_COMMAND_NOT_FOUND_MSG.format(
             command="gs",
             package="GhostScript"))
@@ -38,29 +68,51 @@ class Plugin(BasePlugin):
 
         mkdir_p(out_cache_dir)
         mkdir_p(os.path.dirname(pdf_file))
+        # (page, identical page to encode) pairs
+        self.duplicates = []
 
     def get_tasks(self):
         in_cache_dir = self._get_option("in-cache-dir")
         out_cache_dir = self._get_option("out-cache-dir")
 
-        imgs = filter_regexp(in_cache_dir, r"^[0-9]+[.].*$")
+        store = PageStore(in_cache_dir)
+        pages = store.pages()
+        duplicates = self._find_duplicate_pages(store)
+        cache = open_cache(self.conf)
+        quality = self._get_draft_option("draft-quality")
+        backend = self._get_image_backend()
         res = []
-        for img in imgs:
-            num = int(img[:img.index(".")])
+        for num, page_file in sorted(pages.items()):
+            if not self._in_page_range(num):
+                continue
             x = {
                     "__handler__": handler,
-                    "input": os.path.join(in_cache_dir, img),
-                    "output": os.path.join(out_cache_dir, "%04d.pdf" % num)
+                    "num": num,
+                    "input": page_file,
+                    "output": os.path.join(out_cache_dir, "%04d.pdf" % num),
+                    "cache": cache,
+                    "tool-version": self.tool_version,
+                    "image-backend": backend.name,
+                    "quality": quality
                 }
             if needs_update(x["input"], x["output"]):
+                if num in duplicates:
+                    # Encoded once, see after_tasks()
+                    self.duplicates.append((num, duplicates[num]))
+                    continue
+                x["__memory__"] = estimate_memory(x["input"], 2)
+                if cache is None and isinstance(backend, ImageMagickBackend):
+                    # The whole task is a single command
+                    x["__command__"] = backend.pdf_command(x)
                 res.append(x)
-        return res
+        self._remove_stale_pages(out_cache_dir, pages)
+        return self._batch_tasks(res, _batch_key, batch_handler)
 
     def after_tasks(self):
         out_cache_dir = self._get_option("out-cache-dir")
-        pdf_file = self._get_option("pdf-file")
-
-        input_files = sorted(glob.glob(os.path.join(out_cache_dir, "*.pdf")))
+        self._link_duplicate_pages(out_cache_dir, ".pdf")
+        input_files, pdf_file = self._get_assembly_files(
+            out_cache_dir, ".pdf", self._get_option("pdf-file"))
         if len(input_files) == 0:
             raise ProgramError(_("No input files."))
 
@@ -70,10 +122,23 @@ class Plugin(BasePlugin):
             if err.errno != errno.ENOENT:
                 raise
 
-        cmd_run(["gs",
-                 "-dNOPAUSE",
-                 "-dBATCH",
-                 "-dSAFER",
-                 "-sDEVICE=pdfwrite",
-                 "-sOutputFile=%s" % pdf_file] +
-                input_files)
+        # Input files are passed in a response file, so the command line
+        # does not grow with the number of pages
+        directory, names = split_common_dir(input_files)
+        response_file = pdf_file + ".files"
+        with open(response_file, "wt") as f:
+            for name in names:
+                f.write('"%s"\n' % name)
+        try:
+            cmd_run(["gs",
+                     "-dNOPAUSE",
+                     "-dBATCH",
+                     "-dSAFER",
+                     "-sDEVICE=pdfwrite",
+                     # Identical pages share the image
+                     "-dDetectDuplicateImages=true",
+                     "-sOutputFile=%s" % os.path.abspath(pdf_file),
+                     "@" + os.path.abspath(response_file)],
+                    cwd=directory)
+        finally:
+            os.remove(response_file)
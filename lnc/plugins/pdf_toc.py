@@ -5,6 +5,7 @@ import shutil
 import base64
 
 from lnc.plugins.base_plugin import BasePlugin
+from lnc.lib.pages import SHARD_MODE
 from lnc.lib.process import cmd_run, _COMMAND_NOT_FOUND_MSG
 from lnc.lib.toc import generate_toc
 
@@ -29,19 +30,31 @@ class Plugin(BasePlugin):
         self._check_target_options(["toc-file",
                                     "tmp-file",
                                     "pdf-file",
-                                    "pdf-tmp-file"])
+                                    "pdf-tmp-file"],
+                                   ["toc-file",
+                                    "tmp-file",
+                                    "pdf-file",
+                                    "pdf-tmp-file",
+                                    "pages-dir"])
 
         cmd_run(["gs", "--version"], fail_msg=_COMMAND_NOT_FOUND_MSG.format(
             command="gs",
             package="GhostScript"))
 
-    def before_tasks(self):
+    def watch_paths(self):
+        return [self._get_option("toc-file")]
+
+    def after_tasks(self):
+        if self._build_mode() == SHARD_MODE:
+            # TOC is added to the merged document
+            return
         toc_file = self._get_option("toc-file")
         tmp_file = self._get_option("tmp-file")
         pdf_file = self._get_option("pdf-file")
         pdf_tmp_file = self._get_option("pdf-tmp-file")
 
-        generate_toc(toc_file, tmp_file, _write_entry)
+        generate_toc(toc_file, tmp_file, _write_entry,
+                     page_map=self._get_page_map())
 
         cmd = ["gs",
                "-dNOPAUSE",
@@ -1,12 +1,22 @@
 from __future__ import unicode_literals
 
 import os.path
+import json
 import ConfigParser
 
 from lnc.plugins.base_plugin import BasePlugin
-from lnc.lib.process import cmd_run, _COMMAND_NOT_FOUND_MSG
+from lnc.lib.options import get_int
+from lnc.lib.pages import MERGE_MODE
 from lnc.lib.io import mkdir_p, filter_regexp, needs_update, _IMG_EXT
 from lnc.lib.exceptions import ProgramError
+from lnc.lib.imageinfo import estimate_memory, read_image_info
+from lnc.lib.cache import open_cache, run_cached
+from lnc.lib.pagestore import PageStore
+from lnc.lib.duplicates import (page_digests, update_page_index,
+                                find_similar)
+from lnc.lib.containers import CONTAINER_RE, is_container, frame_digests
+from lnc.lib.imaging import (LARGE_PAGE_MEMORY, get_backend, is_large_page,
+                             sample_factor)
 
 
 _DEFAULT_TRANSFORM_OPTIONS = {
@@ -19,6 +29,11 @@ _DEFAULT_TRANSFORM_OPTIONS = {
     "blur": "10",
     "fuzz": "30"}
 
+# Digests of the frames of multi-page containers the pages
+# were extracted from and (mtime, size) of the containers they
+# were last compared with (in 'pages-dir')
+_FRAME_INDEX = ".frames.json"
+
 _POSSIBLE_TRANSFORM_OPTIONS = set([
     "justconvert",
     "chop-edge",
@@ -58,34 +73,23 @@ def _check_and_normalize_chop(filename, chop, chop_background):
     return chop
 
 
-def _get_crop_area(info, chop, chop_size, chop_background, blur, fuzz):
-    BORDER_SIZE = 10
-
-    cmd = ["convert",
-           info["input"],
-           "-background", chop_background]
-    for edge in chop:
-        if edge in ["north", "south"]:
-            sizestr = "0x" + str(chop_size)
-        else:
-            sizestr = str(chop_size) + "x0"
-        cmd += ["-gravity", edge, "-chop", sizestr, "-splice", sizestr]
-
-    cmd += ["-bordercolor", chop_background,
-            "-border", "%sx%s" % (BORDER_SIZE, BORDER_SIZE),
-            "-virtual-pixel", "edge",
-            "-blur", "0x%d" % blur,
-            "-fuzz", "%d%%" % fuzz,
-            "-trim",
-            "-format", "%X %Y %w %h",
-            "info:-"]
-    output = cmd_run(cmd)
+def _crop_area(crop, info, transform):
+    """Returns area (x, y, width, height) of the page to keep
+    from the contents found by the image backend.
+    """
+    chop = transform["chop-edge"]
+    factor = sample_factor(info)
+    chop_size = transform["chop-size"] // factor * factor
 
-    off_x, off_y, sz_x, sz_y = [int(x) for x in output.split()]
+    off_x, off_y, sz_x, sz_y = crop
 
-    # Adjust border
-    off_x -= BORDER_SIZE
-    off_y -= BORDER_SIZE
+    if factor > 1:
+        # Back to the size of the page: a sampled pixel on the edge
+        # stands for 'factor' pixels
+        off_x *= factor
+        off_y *= factor
+        sz_x = (sz_x + 1) * factor
+        sz_y = (sz_y + 1) * factor
 
     # Adjust chop
     if "north" in chop:
@@ -99,12 +103,12 @@ def _get_crop_area(info, chop, chop_size, chop_background, blur, fuzz):
         off_x -= chop_size
         sz_x += chop_size
 
-    return "%dx%d%+d%+d" % (sz_x, sz_y, off_x, off_y)
+    return off_x, off_y, sz_x, sz_y
 
 
-def handler(info):
+def _read_transform(transform_file):
+    """Returns dict of the options from 'transform_file'."""
     config = ConfigParser.SafeConfigParser(_DEFAULT_TRANSFORM_OPTIONS)
-    transform_file = info["transform-file"]
     try:
         with open(transform_file, "rt") as conffile:
             config.readfp(conffile)
@@ -114,15 +118,19 @@ def handler(info):
             .format(file=transform_file, error=err))
 
     try:
-        justconvert = config.getboolean("transform", "justconvert")
-        if not justconvert:
-            chop = set(config.get("transform", "chop-edge").lower().split())
-            chop_size = config.getint("transform", "chop-size")
-            chop_background = config.get("transform", "chop-background")
-            odd = config.getint("transform", "rotate-odd")
-            even = config.getint("transform", "rotate-even")
-            blur = config.getint("transform", "blur")
-            fuzz = config.getint("transform", "fuzz")
+        transform = {
+            "justconvert": config.getboolean("transform", "justconvert")}
+        if not transform["justconvert"]:
+            transform.update({
+                "chop-edge": set(config.get("transform", "chop-edge")
+                                 .lower().split()),
+                "chop-size": config.getint("transform", "chop-size"),
+                "chop-background": config.get("transform",
+                                              "chop-background"),
+                "rotate-odd": config.getint("transform", "rotate-odd"),
+                "rotate-even": config.getint("transform", "rotate-even"),
+                "blur": config.getint("transform", "blur"),
+                "fuzz": config.getint("transform", "fuzz")})
 
         if not set(config.options("transform")) <= _POSSIBLE_TRANSFORM_OPTIONS:
             raise ProgramError(_(
@@ -135,83 +143,332 @@ def handler(info):
             "Incorrect '{file}' file:\n{error}")
             .format(file=transform_file, error=err))
 
-    if justconvert:
-        cmd_run(["convert", info["input"], info["output"]])
-        return
+    if not transform["justconvert"]:
+        transform["chop-edge"] = _check_and_normalize_chop(
+            transform_file, transform["chop-edge"],
+            transform["chop-background"])
+    return transform
 
-    chop = _check_and_normalize_chop(transform_file, chop, chop_background)
 
+def _angle(info, transform):
     if info["num"] % 2 == 0:
-        angle = even
+        angle = transform["rotate-even"]
+    else:
+        angle = transform["rotate-odd"]
+    if angle % 90 != 0 and is_large_page(info):
+        # Only these are done by tiles without the whole page in memory
+        raise ProgramError(_(
+            "Page {num} is too large to be rotated by {angle} degrees: "
+            "large pages (see 'large-page-pixels') may be rotated only "
+            "by multiples of 90 degrees.")
+            .format(num=info["num"], angle=angle))
+    return angle
+
+
+def handler(info):
+    _prepare_page(info)
+    # For the index of the pages (see Plugin.after_tasks())
+    info["page-digests"] = page_digests(info["output"])
+
+
+def batch_handler(tasks):
+    """Prepares pages of 'tasks' sharing the transform file
+    with two runs of the image backend.
+    """
+    backend = get_backend(tasks[0]["image-backend"])
+    transform = _read_transform(tasks[0]["transform-file"])
+    if transform["justconvert"]:
+        areas = [None] * len(tasks)
+        angles = [0] * len(tasks)
     else:
-        angle = odd
+        areas = [_crop_area(crop, info, transform) for info, crop in
+                 zip(tasks, backend.crop_detect_pages(tasks, transform))]
+        angles = [_angle(info, transform) for info in tasks]
+    backend.prepare_pages(tasks, areas, angles)
+    for info in tasks:
+        info["page-digests"] = page_digests(info["output"])
+
+
+def _batch_key(info):
+    """Returns what the pages prepared by one command should share."""
+    if (info["cache"] is not None or is_large_page(info) or
+            not get_backend(info["image-backend"]).supports_batches):
+        # Every page is looked up in the cache, large ones are
+        # processed alone
+        return None
+    return (info["transform-file"], info.get("density"),
+            info.get("scale"), info.get("page-format"))
+
+
+def _prepare_page(info):
+    backend = get_backend(info["image-backend"])
+    transform = _read_transform(info["transform-file"])
+
+    params = {"plugin": "prepare",
+              "tool-version": info.get("tool-version"),
+              "scale": info.get("scale")}
+    page_format = info.get("page-format", "pnm")
+    params["page-format"] = page_format
+    inputs = [info["input"]]
+    if info.get("frame") is not None:
+        params["density"] = info.get("density")
+        if info.get("frame-digest"):
+            # The rest of the container does not matter
+            inputs = []
+            params["frame-digest"] = info["frame-digest"]
+        else:
+            params["frame"] = info["frame"]
+    if transform["justconvert"]:
+        params["justconvert"] = True
+        run_cached(info, inputs, params,
+                   lambda: backend.prepare_page(info, None, 0))
+        return
+
+    def transform_page():
+        area = _crop_area(backend.crop_detect(info, transform), info,
+                          transform)
+        backend.prepare_page(info, area, _angle(info, transform))
 
-    cmd = ["convert",
-           info["input"],
-           "-crop", _get_crop_area(info, chop, chop_size,
-                                   chop_background, blur, fuzz),
-           "+repage",
-           "-rotate", str(angle),
-           info["output"]]
-    cmd_run(cmd)
+    # Only the options that affect the result make the cache key
+    if is_large_page(info):
+        params["sample-factor"] = sample_factor(info)
+    params.update({
+        "chop-edge": sorted(transform["chop-edge"]),
+        "chop-size": transform["chop-size"],
+        "chop-background": transform["chop-background"],
+        "angle": _angle(info, transform),
+        "blur": transform["blur"],
+        "fuzz": transform["fuzz"]})
+    run_cached(info, inputs, params, transform_page)
+
+
+def _stamp(filename):
+    """Returns (mtime, size) of 'filename' telling if it is changed."""
+    st = os.stat(filename)
+    return (st.st_mtime, st.st_size)
 
 
 class Plugin(BasePlugin):
     def test(self):
         self._check_target_options(["pages-dir",
                                     "input-dir",
-                                    "transform-file"])
-        # Check for presence of ImageMagick
-        cmd_run(["convert", "-version"], fail_msg=_COMMAND_NOT_FOUND_MSG.format(
-            command="convert",
-            package="ImageMagick"))
+                                    "transform-file"],
+                                   ["pages-dir",
+                                    "input-dir",
+                                    "transform-file",
+                                    "page-format",
+                                    "pdf-density",
+                                    "similar-page-distance",
+                                    "batch-size",
+                                    "large-page-pixels",
+                                    "image-backend"])
+        # Check the options before any page is processed
+        self._get_page_store()
+        get_int(self.conf, self.target, "pdf-density", 300)
+        get_int(self.conf, self.target, "similar-page-distance", 4)
+        get_int(self.conf, self.target, "batch-size", 1)
+        get_int(self.conf, self.target, "large-page-pixels", 0)
+        # Check for presence of the image processing tools
+        self.tool_version = self._get_image_backend().tool_version()
+
+    def _get_page_store(self):
+        return PageStore(self._get_option("pages-dir"),
+                         self._get_option("page-format", "pnm"))
 
     def before_tasks(self):
         pages_dir = self._get_option("pages-dir")
 
         mkdir_p(pages_dir)
-
-        # Temporarily disable multithreading because
-        # ImageMagick handles this by itself
-        jobs = self.conf.get("global", "jobs")
-        self.conf.set("global", "__saved-jobs", jobs)
-        self.conf.set("global", "jobs", "1")
+        # (frame digest, container stamp) of the pages extracted from
+        # containers or found unchanged
+        self.new_frame_digests = {}
+        self.tasks = []
+
+    def _find_sources(self, input_dir, transform_file):
+        """Returns dict mapping numbers of the pages of the page range
+        to (file name, frame) where 'frame' is the index of the page
+        in the multi-page container or None for single images.
+        """
+        img_re = r"^[0-9]+[.]" + _IMG_EXT + "$"
+        sources = {}
+        for subdir in sorted(filter_regexp(input_dir, r"^[0-9]+-[0-9]+$")):
+            path = os.path.join(input_dir, subdir)
+            names = filter_regexp(path,
+                                  "(%s)|(%s)" % (img_re, CONTAINER_RE),
+                                  "(%s)|(%s)|(%s)" % (img_re, CONTAINER_RE,
+                                                      transform_file))
+            containers = filter(is_container, names)
+            if containers:
+                if len(names) != 1:
+                    raise ProgramError(_(
+                        "The '{dir}' directory should contain either "
+                        "single images or one multi-page file.")
+                        .format(dir=path))
+                # Pages of the container are numbered by the directory
+                first, last = [int(x) for x in subdir.split("-")]
+                for frame, num in enumerate(xrange(first, last + 1)):
+                    if self._in_page_range(num):
+                        sources[num] = (os.path.join(path, containers[0]),
+                                        frame)
+                continue
+            for image_file in names:
+                num = int(image_file[:image_file.index(".")])
+                if self._in_page_range(num):
+                    sources[num] = (os.path.join(path, image_file), None)
+        return sources
+
+    def _read_frame_index(self):
+        """Returns dict mapping page numbers to (frame digest,
+        container stamp) pairs (see _stamp()).
+        """
+        filename = os.path.join(self._get_option("pages-dir"), _FRAME_INDEX)
+        try:
+            with open(filename, "rt") as f:
+                return dict((int(num), (entry["digest"],
+                                        tuple(entry["source"])))
+                            for num, entry in json.load(f).items())
+        except (IOError, ValueError, KeyError, TypeError):
+            return {}
 
     def get_tasks(self):
         input_dir = self._get_option("input-dir")
         pages_dir = self._get_option("pages-dir")
         transform_file = self._get_option("transform-file")
 
-        dirs = filter_regexp(input_dir, r"^[0-9]+-[0-9]+$")
-
-        # Handle multiple files in different input subdirectories
-        input_files = {}
-        for subdir in sorted(dirs):
-            img_re = r"^[0-9]+[.]" + _IMG_EXT + "$"
-            images = filter_regexp(os.path.join(input_dir, subdir),
-                                   img_re,
-                                   "(%s)|(%s)" % (img_re, transform_file))
-            for image_file in images:
-                num = int(image_file[:image_file.index(".")])
-                input_files[num] = os.path.join(input_dir, subdir, image_file)
-
+        sources = self._find_sources(input_dir, transform_file)
+        # Pages of the removed images and the ones in other formats
+        self._remove_stale_pages(pages_dir, sources)
+        store = self._get_page_store()
+        store.remove_other_formats(sources)
+
+        frame_index = self._read_frame_index()
+        container_digests = {}
+        container_stamps = {}
+
+        def get_stamp(container):
+            if container not in container_stamps:
+                container_stamps[container] = _stamp(container)
+            return container_stamps[container]
+
+        def get_frame_digest(container, frame, num):
+            if container not in container_digests:
+                container_digests[container] = frame_digests(container)
+            digests = container_digests[container]
+            if digests is None:
+                # PDF: the whole container is the source
+                return None
+            if frame >= len(digests):
+                raise ProgramError(_(
+                    "'{file}' has only {count} page(s), page {num} "
+                    "is missing.").format(file=container,
+                                          count=len(digests), num=num))
+            return digests[frame]
+
+        cache = open_cache(self.conf)
+        scale = self._get_draft_option("draft-scale")
+        density = get_int(self.conf, self.target, "pdf-density", 300)
+        backend = self._get_image_backend().name
+        large_page_pixels = get_int(self.conf, self.target,
+                                    "large-page-pixels", 0) * 1000000
         res = []
-        for num in input_files.keys():
-            input_file_dir = os.path.dirname(input_files[num])
+        for num, (input_file, frame) in sources.items():
             x = {
                     "__handler__": handler,
-                    "input": input_files[num],
-                    "output": os.path.join(pages_dir, "%04d.pnm" % num),
+                    "input": input_file,
+                    "output": store.page_file(num),
                     "num": num,
-                    "transform-file": os.path.join(input_file_dir,
-                                                   transform_file)
+                    "transform-file": os.path.join(
+                        os.path.dirname(input_file), transform_file),
+                    "cache": cache,
+                    "tool-version": self.tool_version,
+                    "scale": scale,
+                    "page-format": store.page_format,
+                    "image-backend": backend,
+                    "__inputs__": ["input", "transform-file"]
                 }
-            if (needs_update(x["input"], x["output"]) or
-                    needs_update(x["transform-file"], x["output"])):
-                res.append(x)
-        return res
+            update = needs_update(x["transform-file"], x["output"])
+            if needs_update(x["input"], x["output"]):
+                if frame is None or not os.path.exists(x["output"]):
+                    update = True
+                else:
+                    known_digest, known_stamp = frame_index.get(num,
+                                                                (None, None))
+                    stamp = get_stamp(input_file)
+                    if known_stamp != stamp:
+                        # Only the changed frames of the container
+                        # are extracted again
+                        digest = get_frame_digest(input_file, frame, num)
+                        update = (update or digest is None or
+                                  known_digest != digest)
+                        # The container is not read again until it
+                        # is changed once more
+                        self.new_frame_digests[num] = (digest, stamp)
+            if not update:
+                continue
+            if frame is not None:
+                x.update({"frame": frame,
+                          "frame-digest": get_frame_digest(input_file,
+                                                           frame, num),
+                          "density": density,
+                          # Do not send the whole container for a page
+                          "__local__": True})
+                self.new_frame_digests[num] = (x["frame-digest"],
+                                               get_stamp(input_file))
+            image = read_image_info(input_file)
+            if image is not None:
+                # Frames of a container are supposed to be of one size
+                x["pixels"] = image.width * image.height
+                x["large-page-pixels"] = large_page_pixels
+            if is_large_page(x):
+                x["__memory__"] = LARGE_PAGE_MEMORY
+            else:
+                # Source, its blurred copy and the result
+                x["__memory__"] = estimate_memory(x["input"], 3)
+            res.append(x)
+        self.tasks = list(res)
+        return self._batch_tasks(sorted(res, key=lambda x: x["num"]),
+                                 _batch_key, batch_handler)
 
     def after_tasks(self):
-        saved_jobs = self.conf.get("global", "__saved-jobs")
-        self.conf.set("global", "jobs", saved_jobs)
-        self.conf.remove_option("global", "__saved-jobs")
+        self._update_frame_index()
+        if self._build_mode() != MERGE_MODE:
+            self._check_duplicates()
+
+    def _check_duplicates(self):
+        """Updates the index of the pages used by djvu and pdf to encode
+        identical pages once and reports the new pages that look like
+        duplicates of other ones.
+        """
+        known = dict((task["num"], task["page-digests"])
+                     for task in self.tasks if "page-digests" in task)
+        index, updated = update_page_index(self._get_page_store(), known)
+        max_distance = get_int(self.conf, self.target,
+                               "similar-page-distance", 4)
+        if max_distance < 0:
+            return
+        groups = find_similar(index, updated, max_distance)
+        if groups:
+            self.warnings.append(_(
+                "Some pages look the same (maybe they are duplicates "
+                "or blank pages): {groups}.")
+                .format(groups="; ".join(", ".join(map(unicode, group))
+                                         for group in groups)))
+
+    def _update_frame_index(self):
+        if not self.new_frame_digests:
+            return
+        # Pages of failed tasks are removed, so they are not recorded
+        frame_index = self._read_frame_index()
+        store = self._get_page_store()
+        for num, (digest, stamp) in self.new_frame_digests.items():
+            if digest is not None and os.path.exists(store.page_file(num)):
+                frame_index[num] = (digest, stamp)
+        filename = os.path.join(self._get_option("pages-dir"), _FRAME_INDEX)
+        with open(filename, "wt") as f:
+            json.dump(dict((num, {"digest": digest, "source": stamp})
+                           for num, (digest, stamp) in frame_index.items()),
+                      f)
+
+    def watch_paths(self):
+        # Images and transform files
+        return [self._get_option("input-dir")]
@@ -45,3 +45,39 @@ class ConsoleUi:
                 print("\r%s\r" % (" " * (self.bar_length + 15)), end="")
             sys.stdout.flush()
             self.is_progress_active = False
+
+
+class ProjectUi:
+    """Line-oriented console UI for one of several projects built
+    at the same time (progress bars of different projects would be
+    mixed up, so only the names of the steps are shown).
+    """
+    def __init__(self, name, lock):
+        """'lock' should be shared by all the ProjectUi objects"""
+        self.name = name
+        self.lock = lock
+
+    def _print(self, msg, file):
+        with self.lock:
+            print("[%s] %s" % (self.name, msg), file=file)
+            file.flush()
+
+    def error(self, msg, code=1, title=_("Error")):
+        self._print("[%s]\n%s" % (title, msg), sys.stderr)
+        if code is not None:
+            exit(code)
+
+    def warning(self, msg, title=_("Warning")):
+        self._print("[%s]\n%s" % (title, msg), sys.stderr)
+
+    def progress_before(self, current, total, msg):
+        self._print("[%d / %d] %s" % (current, total, msg), sys.stdout)
+
+    def progress_current(self, amount):
+        pass
+
+    def progress_after(self):
+        pass
+
+    def progress_finalize(self, error=False):
+        pass
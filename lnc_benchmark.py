@@ -0,0 +1,80 @@
+#!/usr/bin/python2
+from __future__ import print_function, unicode_literals
+
+import os.path
+import gettext
+import argparse
+
+program_path = os.path.dirname(__file__)
+
+gettext.install("lnc",
+                os.path.join(program_path, "lang"),
+                unicode=True)
+
+from lnc.benchmark import BackendBenchmark, compare_pages
+from lnc.lib.imaging import BACKENDS
+from lnc.lib.exceptions import ProgramError
+from lnc.ui.cli import ConsoleUi
+
+parser = argparse.ArgumentParser(
+    description=_("Builds the prepare and pdf targets of a project with "
+                  "every image backend (see image-backend option) and "
+                  "compares their speed and the prepared pages."))
+parser.add_argument("project_dir",
+                    help=_("base directory of the project"))
+parser.add_argument("--work-dir",
+                    help=_("directory to build the project in "
+                           "(default: cache/benchmark of the project)"))
+parser.add_argument("--backends", nargs="+", metavar="BACKEND",
+                    choices=sorted(BACKENDS), default=sorted(BACKENDS),
+                    help=_("backends to compare (default: all of them; "
+                           "the pages are compared with the first one)"))
+parser.add_argument("--threshold", type=float, default=1.0,
+                    metavar="PERCENT",
+                    help=_("list the pages differing by more than PERCENT "
+                           "on average (default: %(default)s)"))
+args = parser.parse_args()
+
+ui = ConsoleUi()
+work_dir = args.work_dir or os.path.join(args.project_dir, "cache",
+                                         "benchmark")
+benchmark = BackendBenchmark(ui, program_path, args.project_dir, work_dir)
+
+results = []
+for backend in args.backends:
+    timings, pages_dir = benchmark.run_backend(backend)
+    results.append((backend, timings, pages_dir))
+
+print()
+for backend, timings, pages_dir in results:
+    print(_("{backend}: {seconds:.1f} s").format(
+        backend=backend, seconds=sum(seconds for target, seconds in timings)))
+    for target, seconds in timings:
+        print("    %s: %.1f s" % (target, seconds))
+
+reference, reference_timings, reference_dir = results[0]
+for backend, timings, pages_dir in results[1:]:
+    if reference_dir is None or pages_dir is None:
+        break
+    try:
+        pages = compare_pages(reference_dir, pages_dir)
+    except ProgramError as err:
+        ui.error(err)
+    print()
+    print(_("Pages of {backend} compared with {reference}:").format(
+        backend=backend, reference=reference))
+    differences = [difference for num, first, second, difference in pages
+                   if difference is not None]
+    if differences:
+        print(_("    mean difference {mean:.2f}%, maximum {maximum:.2f}%")
+              .format(mean=sum(differences) / len(differences),
+                      maximum=max(differences)))
+    for num, first, second, difference in pages:
+        if difference is None:
+            print(_("    page {num}: {first} and {second}").format(
+                num=num,
+                first="%dx%d" % first if first else _("missing"),
+                second="%dx%d" % second if second else _("missing")))
+        elif difference > args.threshold:
+            print(_("    page {num}: {difference:.2f}%").format(
+                num=num, difference=difference))
@@ -0,0 +1,38 @@
+#!/usr/bin/python2
+from __future__ import print_function, unicode_literals
+
+import os.path
+import gettext
+import argparse
+
+program_path = os.path.dirname(__file__)
+
+gettext.install("lnc",
+                os.path.join(program_path, "lang"),
+                unicode=True)
+
+from lnc.cache_server import CacheServer
+
+parser = argparse.ArgumentParser(
+    description=_("Serves the remote cache of lecture-notes-compiler "
+                  "(see remote-cache-url option) over HTTP."))
+parser.add_argument("cache_dir",
+                    help=_("directory to keep the cached results in"))
+parser.add_argument("--host", default="127.0.0.1",
+                    help=_("address to listen on (default: %(default)s)"))
+parser.add_argument("--port", type=int, default=8765,
+                    help=_("port to listen on (default: %(default)s)"))
+parser.add_argument("--max-size", type=int, default=0, metavar="MB",
+                    help=_("maximum size of the cache in megabytes "
+                           "(default: no limit)"))
+parser.add_argument("-v", "--verbose", action="store_true",
+                    help=_("log every request"))
+args = parser.parse_args()
+
+server = CacheServer(args.cache_dir, (args.host, args.port),
+                     args.max_size, args.verbose)
+print(_("Serving cache at {url}").format(url=server.url()))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
@@ -0,0 +1,43 @@
+#!/usr/bin/python2
+from __future__ import print_function, unicode_literals
+
+import os
+import os.path
+import gettext
+import argparse
+import ConfigParser
+
+program_path = os.path.dirname(__file__)
+
+gettext.install("lnc",
+                os.path.join(program_path, "lang"),
+                unicode=True)
+
+from lnc.lib.distributed import WorkerServer
+from lnc.lib.jobs import cpu_count
+
+parser = argparse.ArgumentParser(
+    description=_("Runs page processing tasks sent by lecture-notes-compiler "
+                  "(see remote-workers option)."))
+parser.add_argument("--host", default="127.0.0.1",
+                    help=_("address to listen on (default: %(default)s)"))
+parser.add_argument("--port", type=int, default=8766,
+                    help=_("port to listen on (default: %(default)s)"))
+parser.add_argument("-j", "--jobs", type=int, default=cpu_count(),
+                    help=_("number of tasks to run at once "
+                           "(default: number of CPUs)"))
+args = parser.parse_args()
+
+# External commands are searched in the same PATH as by lnc.py
+conf = ConfigParser.SafeConfigParser()
+conf.read(os.path.join(program_path, "config.ini"))
+if conf.has_option("global", "PATH"):
+    os.environ["PATH"] = conf.get("global", "PATH")
+
+server = WorkerServer((args.host, args.port), max(args.jobs, 1))
+print(_("Waiting for tasks at {host}:{port}").format(
+    host=server.server_address[0], port=server.server_address[1]))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
@@ -0,0 +1,97 @@
+from __future__ import unicode_literals
+
+import os
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.process import CommandContext, get_context
+from lnc.lib.assembly import StreamingAssembler
+
+
+def make_assembler(tmpdir, count, pending, links=None, fail=False,
+                   context=None):
+    pages = []
+    for num in range(1, count + 1):
+        page = tmpdir.join("%04d.djvu" % num)
+        if num not in pending and num not in (links or {}):
+            page.write("%d;" % num)
+        pages.append(str(page))
+    bundles = []
+    contexts = []
+
+    def bundle(part, inputs):
+        if fail:
+            raise ProgramError("djvm failed")
+        with open(part, "wt") as f:
+            for page in inputs:
+                with open(page, "rt") as page_file:
+                    f.write(page_file.read())
+        bundles.append(inputs)
+        contexts.append(get_context())
+
+    assembler = StreamingAssembler(
+        pages, [pages[num - 1] for num in pending],
+        dict((pages[num - 1], pages[first - 1])
+             for num, first in (links or {}).items()),
+        bundle, lambda index: str(tmpdir.join(".part%d.djvu" % index)), 3,
+        context)
+    assembler.contexts = contexts
+    return assembler, pages, bundles
+
+
+def finish_page(tmpdir, assembler, num):
+    page = tmpdir.join("%04d.djvu" % num)
+    page.write("%d;" % num)
+    assembler.page_done(str(page))
+
+
+def test_streaming_assembly(tmpdir):
+    assembler, pages, bundles = make_assembler(tmpdir, 8, [2, 5, 7])
+    finish_page(tmpdir, assembler, 5)
+    finish_page(tmpdir, assembler, 7)
+    assert assembler.finish(pages) == pages
+    # The first run is ready, so the second one is bundled too
+    finish_page(tmpdir, assembler, 2)
+    parts = assembler.finish(pages)
+    assert bundles == [pages[0:3], pages[3:6]]
+    assert parts == [str(tmpdir.join(".part0.djvu")),
+                     str(tmpdir.join(".part1.djvu"))] + pages[6:]
+    assert tmpdir.join(".part1.djvu").read() == "4;5;6;"
+    # Pages of the parts should be the same as the ones of the document
+    assert assembler.finish(pages[1:]) == pages[1:3] + parts[1:]
+    assembler.remove_parts()
+    assert not tmpdir.join(".part0.djvu").check()
+
+
+def test_streaming_assembly_links(tmpdir):
+    assembler, pages, bundles = make_assembler(tmpdir, 7, [1], {3: 1, 5: 2})
+    # Page 5 is linked to the ready page at once
+    assert tmpdir.join("0005.djvu").read() == "2;"
+    finish_page(tmpdir, assembler, 1)
+    assert tmpdir.join("0003.djvu").read() == "1;"
+    assembler.finish(pages)
+    assert tmpdir.join(".part0.djvu").read() == "1;2;1;"
+    assert tmpdir.join(".part1.djvu").read() == "4;2;6;"
+
+
+def test_streaming_assembly_failure(tmpdir):
+    assembler, pages, bundles = make_assembler(tmpdir, 8, [1], fail=True)
+    finish_page(tmpdir, assembler, 1)
+    assert assembler.finish(pages) == pages
+    assert bundles == []
+    assert not [name for name in os.listdir(str(tmpdir))
+                if name.startswith(".part")]
+
+
+def test_streaming_assembly_context(tmpdir):
+    context = CommandContext(timeout=10)
+    assembler, pages, bundles = make_assembler(tmpdir, 8, [2, 5],
+                                               context=context)
+    finish_page(tmpdir, assembler, 2)
+    assembler.finish(pages)
+    # The part is bundled with the limits of the target
+    assert assembler.contexts == [context]
+    context.cancel()
+    finish_page(tmpdir, assembler, 5)
+    assert assembler.finish(pages) == [str(tmpdir.join(".part0.djvu"))] + \
+        pages[3:]
+    assert bundles == [pages[0:3]]
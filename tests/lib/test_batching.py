@@ -0,0 +1,116 @@
+from __future__ import unicode_literals
+
+import sys
+from pytest import raises
+
+from lnc.lib.exceptions import ProgramError, CommandCancelledError
+from lnc.lib.process import CommandContext, cmd_run, set_context
+from lnc.lib.batching import (make_batches, convert_script, make_batch_task,
+                              handler)
+
+
+def nums(batches):
+    return [[task["num"] for task in batch] for batch in batches]
+
+
+def test_make_batches():
+    tasks = [{"num": i, "key": i // 4} for i in range(10)]
+    key = lambda task: task["key"]
+    assert nums(make_batches(tasks, key, 3)) == \
+        [[0, 1, 2], [3], [4, 5, 6], [7], [8, 9]]
+    assert nums(make_batches(tasks, lambda task: None, 3)) == \
+        [[i] for i in range(10)]
+
+
+def test_make_batches_cost():
+    tasks = [{"num": i, "__memory__": memory}
+             for i, memory in enumerate([10, 10, 600, 10, 200, 200])]
+    assert nums(make_batches(tasks, lambda task: 1, 8, 256)) == \
+        [[0, 1], [2], [3, 4], [5]]
+
+
+def test_convert_script():
+    assert convert_script([(["1.pnm"], "1.pdf"),
+                           (["2.pnm", "-quality", "40"], "2.pdf")]) == \
+        ["convert", "1.pnm", "-write", "1.pdf", "+delete",
+         "2.pnm", "-quality", "40", "2.pdf"]
+
+
+def write_output(info):
+    with open(info["output"], "wt") as f:
+        f.write("page")
+
+
+def fail_on_page_2(info):
+    if info["num"] == 2:
+        raise ProgramError("broken image")
+    write_output(info)
+
+
+def make_tasks(tmpdir, page_handler):
+    return [{"__handler__": page_handler, "num": num,
+             "output": str(tmpdir.join("%04d.pdf" % num))}
+            for num in range(1, 4)]
+
+
+def test_batch_handler(tmpdir):
+    tasks = make_tasks(tmpdir, None)
+    batches = []
+
+    def run_batch(batch):
+        batches.append(batch)
+        for info in batch:
+            write_output(info)
+
+    handler(make_batch_task(tasks, run_batch))
+    assert batches == [tasks]
+    assert all(tmpdir.join("%04d.pdf" % num).check() for num in range(1, 4))
+
+
+def test_batch_handler_failure(tmpdir):
+    tasks = make_tasks(tmpdir, fail_on_page_2)
+
+    def run_batch(batch):
+        write_output(batch[0])
+        raise ProgramError("batch failed")
+
+    with raises(ProgramError) as err:
+        handler(make_batch_task(tasks, run_batch))
+    # The error is reported for the broken page only
+    assert "broken image" in str(err.value)
+    assert "batch failed" not in str(err.value)
+    assert tmpdir.join("0001.pdf").check()
+    assert not tmpdir.join("0002.pdf").check()
+    assert tmpdir.join("0003.pdf").check()
+
+
+def test_batch_handler_cancelled(tmpdir):
+    tasks = make_tasks(tmpdir, write_output)
+
+    def run_batch(batch):
+        write_output(batch[0])
+        raise CommandCancelledError("cancelled")
+
+    raises(CommandCancelledError, handler, make_batch_task(tasks, run_batch))
+    # Pages written before are not left
+    assert not tmpdir.join("0001.pdf").check()
+
+
+def test_batch_timeout(tmpdir):
+    tasks = make_tasks(tmpdir, None)
+
+    def run_batch(batch):
+        # Longer than the timeout of a page, shorter than of 3 pages
+        cmd_run([sys.executable, "-c", "import time; time.sleep(0.5)"])
+        for info in batch:
+            write_output(info)
+
+    set_context(CommandContext(timeout=0.3))
+    try:
+        handler(make_batch_task(tasks, run_batch))
+        # Single pages get the timeout of the context again
+        raises(ProgramError, cmd_run,
+               [sys.executable, "-c", "import time; time.sleep(0.5)"])
+    finally:
+        set_context(None)
+    assert all(tmpdir.join("%04d.pdf" % num).check() for num in range(1, 4))
@@ -0,0 +1,129 @@
+from __future__ import unicode_literals
+
+import os
+import time
+import ConfigParser
+
+from lnc.lib.cache import (SharedCache, make_key, open_cache, run_cached,
+                           link_or_copy)
+
+
+def test_make_key(tmpdir):
+    a = tmpdir.join("a.pnm")
+    b = tmpdir.join("b.pnm")
+    a.write("same")
+    b.write("same")
+    key = make_key([str(a)], {"angle": 90, "tool-version": "1"})
+    assert key == make_key([str(b)], {"tool-version": "1", "angle": 90})
+    assert key != make_key([str(a)], {"angle": 0, "tool-version": "1"})
+    assert key != make_key([str(a)], {"angle": 90, "tool-version": "2"})
+    b.write("other")
+    assert key != make_key([str(b)], {"angle": 90, "tool-version": "1"})
+
+
+def test_fetch_and_store(tmpdir):
+    cache = SharedCache(str(tmpdir.join("cache")))
+    output = tmpdir.join("out.djvu")
+    copy = tmpdir.join("copy.djvu")
+    assert not cache.fetch("ab" * 32, str(copy))
+    output.write("result")
+    cache.store("ab" * 32, str(output))
+    assert cache.fetch("ab" * 32, str(copy))
+    assert copy.read() == "result"
+    # Replaces the old output
+    assert cache.fetch("ab" * 32, str(output))
+    assert output.read() == "result"
+
+
+def test_evict_least_recently_used(tmpdir):
+    cache = SharedCache(str(tmpdir.join("cache")))
+    now = time.time()
+    for key, age in [("aa" * 32, 10), ("bb" * 32, 30), ("cc" * 32, 20)]:
+        source = tmpdir.join(key[:2])
+        source.write(b"x" * 1000, mode="wb")
+        cache.store(key, str(source))
+        os.utime(cache._path(key) + ".access", (now - age, now - age))
+
+    cache.evict(2500)
+    assert os.path.exists(cache._path("aa" * 32))
+    assert not os.path.exists(cache._path("bb" * 32))
+    assert not os.path.exists(cache._path("bb" * 32) + ".access")
+    assert os.path.exists(cache._path("cc" * 32))
+    assert cache.size == 2000
+
+
+def test_fetch_keeps_linked_outputs(tmpdir):
+    cache = SharedCache(str(tmpdir.join("cache")))
+    now = int(time.time())
+    first = tmpdir.join("first.djvu")
+    first.write("result")
+    cache.store("aa" * 32, str(first))
+    cache.store("bb" * 32, str(first))
+    os.utime(str(first), (now - 100, now - 100))
+    for key in ["aa" * 32, "bb" * 32]:
+        os.utime(cache._path(key) + ".access", (now - 50, now - 50))
+
+    second = tmpdir.join("second.djvu")
+    assert cache.fetch("aa" * 32, str(second))
+    # Outputs of the other projects sharing the entry stay as they were
+    assert first.mtime() == now - 100
+    # but the entry is used more recently than the other one
+    cache.evict(len("result"))
+    assert os.path.exists(cache._path("aa" * 32))
+    assert not os.path.exists(cache._path("bb" * 32))
+
+
+def test_store_evicts_over_limit(tmpdir):
+    cache = SharedCache(str(tmpdir.join("cache")), max_size=1)
+    source = tmpdir.join("source")
+    for i in range(3):
+        source.write(b"x" * 400 * 1024, mode="wb")
+        cache.store("%02x" % i * 32, str(source))
+        os.remove(str(source))
+    assert cache.size <= 1024 * 1024
+    assert os.path.exists(cache._path("02" * 32))
+
+
+def test_run_cached(tmpdir):
+    inp = tmpdir.join("in.pnm")
+    inp.write("page")
+    calls = []
+
+    def produce(info):
+        calls.append(info["output"])
+        with open(info["output"], "wt") as f:
+            f.write("encoded")
+
+    info = {"output": str(tmpdir.join("1.djvu"))}
+    run_cached(info, [str(inp)], {}, lambda: produce(info))
+    assert len(calls) == 1
+
+    cache = SharedCache(str(tmpdir.join("cache")))
+    for name in ["2.djvu", "3.djvu"]:
+        info = {"output": str(tmpdir.join(name)), "cache": cache}
+        run_cached(info, [str(inp)], {"plugin": "djvu"},
+                   lambda: produce(info))
+    assert len(calls) == 2
+    assert tmpdir.join("3.djvu").read() == "encoded"
+
+
+def test_open_cache(tmpdir):
+    conf = ConfigParser.SafeConfigParser()
+    conf.add_section("global")
+    assert open_cache(conf) is None
+    conf.set("global", "shared-cache-dir", "")
+    assert open_cache(conf) is None
+    conf.set("global", "shared-cache-dir", str(tmpdir))
+    conf.set("global", "shared-cache-size", "10")
+    cache = open_cache(conf)
+    assert cache.directory == str(tmpdir)
+    assert cache.max_size == 10 * 1024 * 1024
+
+
+def test_link_again(tmpdir):
+    source = tmpdir.join("0001.djvu")
+    source.write("page")
+    dest = str(tmpdir.join("0002.djvu"))
+    link_or_copy(str(source), dest)
+    link_or_copy(str(source), dest)
+    assert sorted(os.listdir(str(tmpdir))) == ["0001.djvu", "0002.djvu"]
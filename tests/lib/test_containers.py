@@ -0,0 +1,67 @@
+from __future__ import unicode_literals
+
+import struct
+from pytest import raises
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.containers import (is_container, frame_source, frame_digests)
+
+
+def make_tiff(frames):
+    """Returns little-endian TIFF with a single strip for every frame
+    of 'frames' (list of (width, height, data)).
+    """
+    data = b"II*\0" + struct.pack(b"<I", 8)
+    for index, (width, height, pixels) in enumerate(frames):
+        ifd_size = 2 + 4 * 12 + 4
+        strip = len(data) + ifd_size
+        next_ifd = strip + len(pixels) if index + 1 < len(frames) else 0
+        data += (struct.pack(b"<H", 4) +
+                 struct.pack(b"<HHIH2x", 256, 3, 1, width) +
+                 struct.pack(b"<HHIH2x", 257, 3, 1, height) +
+                 struct.pack(b"<HHII", 273, 4, 1, strip) +
+                 struct.pack(b"<HHII", 279, 4, 1, len(pixels)) +
+                 struct.pack(b"<I", next_ifd) + pixels)
+    return data
+
+
+def test_is_container():
+    assert is_container("scan.tiff")
+    assert is_container("2016-09-01 lecture.pdf")
+    assert is_container("1.tif")
+    assert not is_container("1.jpg")
+    assert not is_container(".scan.tiff")
+
+
+def test_frame_source():
+    assert frame_source("scan.tiff", 3) == ["scan.tiff[3]"]
+    assert frame_source("scan.pdf", 0, 600) == ["-density", "600",
+                                                "scan.pdf[0]"]
+
+
+def test_frame_digests(tmpdir):
+    f = tmpdir.join("scan.tiff")
+    f.write(make_tiff([(2, 2, b"aaaa"), (2, 2, b"bbbb"), (2, 2, b"aaaa")]),
+            "wb")
+    digests = frame_digests(str(f))
+    assert len(digests) == 3
+    assert digests[0] == digests[2] != digests[1]
+
+    # Appending and changing pages does not change the other frames
+    f.write(make_tiff([(2, 2, b"aaaa"), (2, 2, b"cccc"), (2, 2, b"aaaa"),
+                       (1, 4, b"aaaa")]), "wb")
+    new_digests = frame_digests(str(f))
+    assert new_digests[0] == digests[0]
+    assert new_digests[1] != digests[1]
+    # Size is taken into account
+    assert new_digests[3] != digests[0]
+
+
+def test_pdf_and_broken_files(tmpdir):
+    assert frame_digests(str(tmpdir.join("scan.pdf"))) is None
+    f = tmpdir.join("scan.tiff")
+    f.write(b"not a tiff")
+    raises(ProgramError, frame_digests, str(f))
+    f.write(make_tiff([(2, 2, b"aaaa")])[:-2], "wb")
+    raises(ProgramError, frame_digests, str(f))
+    raises(ProgramError, frame_digests, str(tmpdir.join("missing.tiff")))
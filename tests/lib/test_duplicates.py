@@ -0,0 +1,89 @@
+from __future__ import unicode_literals
+
+import os
+
+from lnc.lib.raster import RasterView
+from lnc.lib.pagestore import PageStore
+from lnc.lib.duplicates import (perceptual_hash, hash_distance, page_digests,
+                                read_page_index, update_page_index,
+                                find_duplicates, find_similar)
+
+
+def write_page(path, dark_rows, noise=0):
+    """Writes 64x64 grayscale page with the first 'dark_rows' rows black
+    and 'noise' gray pixels in the white part.
+    """
+    pixels = bytearray(b"\0" * 64 * dark_rows + b"\xff" * 64 * (64 - dark_rows))
+    for i in range(noise):
+        pixels[-1 - i * 67] = 0x80
+    path.write(b"P5\n64 64\n255\n" + bytes(pixels), "wb")
+
+
+def test_perceptual_hash(tmpdir):
+    write_page(tmpdir.join("1.pnm"), 32)
+    write_page(tmpdir.join("2.pnm"), 32, noise=20)
+    write_page(tmpdir.join("3.pnm"), 8)
+    hashes = []
+    for num in range(1, 4):
+        with RasterView(str(tmpdir.join("%d.pnm" % num))) as view:
+            hashes.append(perceptual_hash(view))
+    # Upper half is dark
+    assert hashes[0] == 0xffffffff
+    assert hash_distance(hashes[0], hashes[1]) <= 2
+    assert hash_distance(hashes[0], hashes[2]) >= 24
+
+
+def test_perceptual_hash_bilevel(tmpdir):
+    page = tmpdir.join("1.pnm")
+    # Upper half is black
+    page.write(b"P4\n64 64\n" + b"\xff" * 8 * 32 + b"\0" * 8 * 32, "wb")
+    with RasterView(str(page)) as view:
+        assert perceptual_hash(view) == 0xffffffff
+    assert page_digests(str(page))["phash"] == 0xffffffff
+
+
+def test_page_digests(tmpdir):
+    write_page(tmpdir.join("0001.pnm"), 10)
+    tmpdir.join("0002.png").write("not a raster")
+    digests = page_digests(str(tmpdir.join("0001.pnm")))
+    assert digests["size"] == os.path.getsize(str(tmpdir.join("0001.pnm")))
+    assert digests["phash"] is not None
+    assert page_digests(str(tmpdir.join("0002.png")))["phash"] is None
+
+
+def test_page_index(tmpdir):
+    for num, dark_rows in [(1, 10), (2, 40), (3, 10), (4, 11)]:
+        write_page(tmpdir.join("%04d.pnm" % num), dark_rows)
+    store = PageStore(str(tmpdir))
+    assert read_page_index(store) == {}
+
+    known = {2: dict(page_digests(str(tmpdir.join("0002.pnm"))),
+                     sha256="known")}
+    index, updated = update_page_index(store, known)
+    assert updated == set([1, 2, 3, 4])
+    assert index[2]["sha256"] == "known"
+    assert read_page_index(store) == index
+
+    write_page(tmpdir.join("0002.pnm"), 39)
+    os.utime(str(tmpdir.join("0002.pnm")), (1, 1))
+    tmpdir.join("0004.pnm").remove()
+    assert sorted(read_page_index(store)) == [1, 3]
+    index, updated = update_page_index(store)
+    assert updated == set([2])
+    assert index[2]["sha256"] != "known"
+
+    assert find_duplicates(index) == {3: 1}
+    # Pages 1 and 3 are identical, page 2 is similar to none of them
+    assert find_similar(index, [2], 4) == []
+    assert find_similar(index, [3], 4) == [[1, 3]]
+
+
+def test_find_similar():
+    index = {1: {"sha256": "a", "phash": 0b1111},
+             2: {"sha256": "b", "phash": 0b1110},
+             3: {"sha256": "c", "phash": 0b0000},
+             4: {"sha256": "c", "phash": None},
+             5: {"sha256": "d", "phash": 0b0110}}
+    assert find_similar(index, [2], 1) == [[1, 2, 5]]
+    assert find_similar(index, [1, 3], 0) == [[3, 4]]
+    assert find_similar(index, [5], 0) == []
@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+
+import socket
+import threading
+from pytest import fixture
+
+from lnc.cache_server import CacheServer
+from lnc.lib.cache import SharedCache, LayeredCache
+from lnc.lib.http_cache import HttpCache
+
+
+@fixture
+def server(tmpdir):
+    server = CacheServer(str(tmpdir.join("server")))
+    thread = threading.Thread(target=server.serve_forever,
+                              args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_and_store(server, tmpdir):
+    cache = HttpCache(server.url() + "/")
+    result = tmpdir.join("result.djvu")
+    assert not cache.fetch("ab" * 32, str(result))
+    result.write(b"\x00encoded\xff", mode="wb")
+    cache.store("ab" * 32, str(result))
+    cache.flush()
+
+    copy = tmpdir.join("copy.djvu")
+    assert cache.fetch("ab" * 32, str(copy))
+    assert copy.read(mode="rb") == b"\x00encoded\xff"
+    assert cache.available
+
+
+def test_bad_key(server):
+    cache = HttpCache(server.url())
+    assert cache._request("GET", "../config.ini")[0] == 400
+    assert cache._request("PUT", "nonhex", b"data")[0] == 400
+
+
+def test_no_upload(server, tmpdir):
+    cache = HttpCache(server.url(), upload=False)
+    result = tmpdir.join("result.pdf")
+    result.write("encoded")
+    cache.store("cd" * 32, str(result))
+    cache.flush()
+    assert not cache.fetch("cd" * 32, str(tmpdir.join("copy.pdf")))
+
+
+def test_unavailable_server(tmpdir):
+    # Take a free port and close it, so nobody listens there
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    cache = HttpCache("http://127.0.0.1:%d" % port, timeout=1)
+    assert not cache.fetch("ab" * 32, str(tmpdir.join("result")))
+    assert not cache.available
+
+
+def test_layered_cache(server, tmpdir):
+    remote = HttpCache(server.url())
+    result = tmpdir.join("result.pnm")
+    result.write("page")
+    remote.store("ef" * 32, str(result))
+    remote.flush()
+
+    local = SharedCache(str(tmpdir.join("local")))
+    cache = LayeredCache(local, remote)
+    assert cache.fetch("ef" * 32, str(tmpdir.join("copy.pnm")))
+    # Now it is in the local cache too
+    assert local.fetch("ef" * 32, str(tmpdir.join("local.pnm")))
+    assert not cache.fetch("00" * 32, str(tmpdir.join("none.pnm")))
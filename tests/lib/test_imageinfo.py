@@ -0,0 +1,75 @@
+from __future__ import unicode_literals
+
+import struct
+
+from lnc.lib.imageinfo import read_image_info, estimate_memory
+
+
+def check_info(info, width, height, channels, depth):
+    assert info is not None
+    assert (info.width, info.height, info.channels, info.depth) == \
+        (width, height, channels, depth)
+
+
+def test_pnm(tmpdir):
+    f = tmpdir.join("1.pnm")
+    f.write(b"P6\n# comment\n640 480\n255\n" + b"\0" * 10, "wb")
+    check_info(read_image_info(str(f)), 640, 480, 3, 8)
+    f.write(b"P5 10 20 65535\n", "wb")
+    check_info(read_image_info(str(f)), 10, 20, 1, 16)
+    f.write(b"P4\n7 9\n", "wb")
+    check_info(read_image_info(str(f)), 7, 9, 1, 1)
+    f.write(b"P7\nWIDTH 4\nHEIGHT 5\nDEPTH 4\nMAXVAL 255\n"
+            b"TUPLTYPE RGB_ALPHA\nENDHDR\n", "wb")
+    check_info(read_image_info(str(f)), 4, 5, 4, 8)
+
+
+def test_bmp(tmpdir):
+    f = tmpdir.join("1.bmp")
+    f.write(b"BM" + b"\0" * 12 +
+            struct.pack(b"<IiiHH", 40, 300, -200, 1, 24), "wb")
+    check_info(read_image_info(str(f)), 300, 200, 3, 8)
+
+
+def test_png(tmpdir):
+    f = tmpdir.join("1.png")
+    f.write(b"\x89PNG\r\n\x1a\n" + b"\0\0\0\x0dIHDR" +
+            struct.pack(b">IIBB", 123, 45, 8, 2), "wb")
+    check_info(read_image_info(str(f)), 123, 45, 3, 8)
+
+
+def test_jpeg(tmpdir):
+    f = tmpdir.join("1.jpg")
+    f.write(b"\xff\xd8" +
+            b"\xff\xe0" + struct.pack(b">H", 6) + b"JFIF" +
+            b"\xff\xc2" + struct.pack(b">HBHHB", 17, 8, 600, 800, 3), "wb")
+    check_info(read_image_info(str(f)), 800, 600, 3, 8)
+
+
+def test_tiff(tmpdir):
+    f = tmpdir.join("1.tiff")
+    # ImageWidth (LONG), ImageLength (SHORT), SamplesPerPixel
+    f.write(b"II*\0" + struct.pack(b"<IH", 8, 3) +
+            struct.pack(b"<HHII", 256, 4, 1, 2480) +
+            struct.pack(b"<HHIH2x", 257, 3, 1, 3508) +
+            struct.pack(b"<HHIH2x", 277, 3, 1, 3), "wb")
+    check_info(read_image_info(str(f)), 2480, 3508, 3, 8)
+    f.write(b"MM\0*" + struct.pack(b">IH", 8, 2) +
+            struct.pack(b">HHIH2x", 256, 3, 1, 100) +
+            struct.pack(b">HHIH2x", 257, 3, 1, 200), "wb")
+    check_info(read_image_info(str(f)), 100, 200, 1, 1)
+
+
+def test_unknown(tmpdir):
+    f = tmpdir.join("1.txt")
+    f.write("not an image")
+    assert read_image_info(str(f)) is None
+    assert read_image_info(str(tmpdir.join("nonexistent"))) is None
+    assert estimate_memory(str(f)) == 0
+
+
+def test_estimate_memory(tmpdir):
+    f = tmpdir.join("1.pnm")
+    f.write(b"P6\n1024 1024\n255\n", "wb")
+    assert estimate_memory(str(f)) == 8
+    assert estimate_memory(str(f), 3) == 24
@@ -0,0 +1,140 @@
+from __future__ import unicode_literals
+
+from pytest import raises, importorskip
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib import imaging
+from lnc.lib.imaging import (ImageMagickBackend, PillowBackend, get_backend,
+                             sample_factor, write_pdf)
+
+
+TRANSFORM = {
+    "chop-edge": set(),
+    "chop-size": 0,
+    "chop-background": "black",
+    "blur": 2,
+    "fuzz": 30}
+
+
+def test_get_backend():
+    assert isinstance(get_backend("imagemagick"), ImageMagickBackend)
+    assert isinstance(get_backend("pillow"), PillowBackend)
+    raises(ProgramError, get_backend, "gimp")
+
+
+def test_sample_factor():
+    assert sample_factor({"pixels": 400}) == 1
+    assert sample_factor({"pixels": 400, "large-page-pixels": 100}) == 2
+    assert sample_factor({"pixels": 401, "large-page-pixels": 100}) == 3
+
+
+def test_imagemagick_batches(monkeypatch):
+    commands = []
+
+    def cmd_run(cmd):
+        commands.append(cmd)
+        return b"15 20 30 40\n10 10 5 5\n"
+
+    monkeypatch.setattr(imaging, "cmd_run", cmd_run)
+    backend = ImageMagickBackend()
+    tasks = [{"input": "1.jpg", "output": "1.pnm"},
+             {"input": "2.jpg", "output": "2.pnm", "scale": 50}]
+    assert backend.crop_detect_pages(tasks, TRANSFORM) == \
+        [(5, 10, 30, 40), (0, 0, 5, 5)]
+    assert len(commands) == 1
+    backend.prepare_pages(tasks, [(5, 10, 30, 40), None], [90, 0])
+    assert commands[1] == ["convert",
+                           "1.jpg", "-crop", "30x40+5+10", "+repage",
+                           "-rotate", "90", "-write", "1.pnm", "+delete",
+                           "2.jpg", "-resize", "50%", "2.pnm"]
+
+
+def test_imagemagick_unexpected_output(monkeypatch):
+    monkeypatch.setattr(imaging, "cmd_run", lambda cmd: b"")
+    raises(ProgramError, ImageMagickBackend().crop_detect,
+           {"input": "1.jpg"}, TRANSFORM)
+
+
+def make_scan(tmpdir):
+    """Returns white 40x60 page at (10, 5) on black 60x80 scan."""
+    Image = importorskip("PIL.Image")
+    image = Image.new("L", (60, 80), 0)
+    image.paste(255, (10, 5, 50, 65))
+    filename = str(tmpdir.join("1.png"))
+    image.save(filename)
+    return filename
+
+
+def test_pillow_crop_detect(tmpdir):
+    info = {"input": make_scan(tmpdir)}
+    x, y, width, height = PillowBackend().crop_detect(info, TRANSFORM)
+    # The blur widens the page by a few pixels
+    assert 6 <= x <= 10 and 1 <= y <= 5
+    assert 40 <= width <= 48 and 60 <= height <= 68
+
+
+def test_pillow_chop(tmpdir):
+    transform = dict(TRANSFORM, **{"chop-edge": set(["west"]),
+                                   "chop-size": 30})
+    info = {"input": make_scan(tmpdir)}
+    x, y, width, height = PillowBackend().crop_detect(info, transform)
+    # The left part of the page is painted over
+    assert 26 <= x <= 30 and 16 <= width <= 24
+
+
+def test_pillow_prepare_page(tmpdir):
+    Image = importorskip("PIL.Image")
+    output = str(tmpdir.join("0001.png"))
+    info = {"input": make_scan(tmpdir), "output": output,
+            "page-format": "png", "scale": 50}
+    PillowBackend().prepare_page(info, (10, 5, 40, 60), 90)
+    image = Image.open(output)
+    assert image.format == "PNG"
+    assert image.size == (30, 20)
+    assert image.getextrema() == (255, 255)
+
+
+def test_pillow_pdf(tmpdir):
+    Image = importorskip("PIL.Image")
+    image = Image.new("RGB", (3, 2), (255, 0, 0))
+    lossless = tmpdir.join("1.pdf")
+    write_pdf(image, str(lossless))
+    data = lossless.read("rb")
+    assert data.startswith(b"%PDF-1.4\n")
+    assert b"/Width 3 /Height 2 /ColorSpace /DeviceRGB" in data
+    assert b"/FlateDecode" in data
+    assert data.endswith(b"%%EOF\n")
+    jpeg = tmpdir.join("2.pdf")
+    write_pdf(image.convert("L"), str(jpeg), 40)
+    assert b"/DCTDecode" in jpeg.read("rb")
+    assert b"/DeviceGray" in jpeg.read("rb")
+
+
+def test_pillow_to_pnm(tmpdir):
+    Image = importorskip("PIL.Image")
+    output = str(tmpdir.join("1.pnm"))
+    PillowBackend().to_pnm(make_scan(tmpdir), output)
+    assert Image.open(output).size == (60, 80)
+
+
+def test_pillow_16bit(tmpdir):
+    Image = importorskip("PIL.Image")
+    image = Image.new("I;16", (3, 1))
+    for x, value in enumerate([0, 30000, 65535]):
+        image.putpixel((x, 0), value)
+    source = str(tmpdir.join("1.tif"))
+    image.save(source)
+    output = str(tmpdir.join("1.pnm"))
+    PillowBackend().to_pnm(source, output)
+    result = Image.open(output)
+    assert result.mode == "L"
+    # Scaled, not clipped to 255
+    assert [result.getpixel((x, 0)) for x in range(3)] == [0, 117, 255]
+
+
+def test_pillow_broken_image(tmpdir):
+    importorskip("PIL.Image")
+    broken = tmpdir.join("1.jpg")
+    broken.write("not an image")
+    raises(ProgramError, PillowBackend().to_pnm, str(broken),
+           str(tmpdir.join("1.pnm")))
@@ -4,7 +4,8 @@ import time
 from pytest import raises
 
 from lnc.lib.exceptions import ProgramError
-from lnc.lib.io import filter_regexp, needs_update, mkdir_p
+from lnc.lib.io import (filter_regexp, needs_update, mkdir_p,
+                        split_common_dir)
 
 def test_filter_regex(tmpdir):
     p = str(tmpdir)
@@ -54,3 +55,11 @@ def test_mkdir_p(tmpdir):
     mkdir_p(str(dir2))
     assert dir1.check()
     assert f.check()
+
+
+def test_split_common_dir(tmpdir):
+    pages = [str(tmpdir.join("%04d.djvu" % num)) for num in range(1, 4)]
+    assert split_common_dir(pages) == \
+        (str(tmpdir), ["0001.djvu", "0002.djvu", "0003.djvu"])
+    other = str(tmpdir.join("shards", "0004.djvu"))
+    assert split_common_dir(pages + [other]) == (None, pages + [other])
@@ -0,0 +1,127 @@
+from __future__ import unicode_literals
+
+import time
+from pytest import raises
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.jobs import (cpu_count, cgroup_cpu_limit, available_memory,
+                          parse_jobs, JobController)
+
+
+def test_cpu_count():
+    assert cpu_count() >= 1
+
+
+def test_cgroup_v2_cpu_limit(tmpdir):
+    root = str(tmpdir)
+    assert cgroup_cpu_limit(root) is None
+    tmpdir.join("cpu.max").write("max 100000\n")
+    assert cgroup_cpu_limit(root) is None
+    tmpdir.join("cpu.max").write("250000 100000\n")
+    assert cgroup_cpu_limit(root) == 2.5
+
+
+def test_cgroup_v1_cpu_limit(tmpdir):
+    root = str(tmpdir)
+    cpu = tmpdir.mkdir("cpu")
+    cpu.join("cpu.cfs_quota_us").write("-1\n")
+    cpu.join("cpu.cfs_period_us").write("100000\n")
+    assert cgroup_cpu_limit(root) is None
+    cpu.join("cpu.cfs_quota_us").write("400000\n")
+    assert cgroup_cpu_limit(root) == 4.0
+
+
+def test_available_memory(tmpdir):
+    root = str(tmpdir)
+    meminfo = tmpdir.join("meminfo")
+    meminfo.write("MemTotal:       16000000 kB\n"
+                  "MemAvailable:    8192000 kB\n")
+    assert available_memory(root, str(meminfo)) == 8000
+    tmpdir.join("memory.max").write("2147483648\n")
+    tmpdir.join("memory.current").write("1073741824\n")
+    assert available_memory(root, str(meminfo)) == 1024
+    tmpdir.join("memory.max").write("max\n")
+    assert available_memory(root, str(meminfo)) == 8000
+    assert available_memory(root, str(tmpdir.join("none"))) is None
+
+
+def test_cgroup_of_process(tmpdir):
+    root = str(tmpdir)
+    proc_cgroup = tmpdir.join("cgroup")
+    proc_cgroup.write("0::/docker/abc\n")
+    abc = tmpdir.mkdir("docker").mkdir("abc")
+    assert cgroup_cpu_limit(root, str(proc_cgroup)) is None
+    abc.join("cpu.max").write("150000 100000\n")
+    assert cgroup_cpu_limit(root, str(proc_cgroup)) == 1.5
+    # The limit of the parent applies too
+    tmpdir.join("docker", "cpu.max").write("100000 100000\n")
+    assert cgroup_cpu_limit(root, str(proc_cgroup)) == 1.0
+
+    meminfo = tmpdir.join("meminfo")
+    meminfo.write("MemAvailable:    8192000 kB\n")
+    abc.join("memory.max").write("1073741824\n")
+    abc.join("memory.current").write("536870912\n")
+    assert available_memory(root, str(meminfo), str(proc_cgroup)) == 512
+
+
+def test_cgroup_v1_of_process(tmpdir):
+    root = str(tmpdir)
+    proc_cgroup = tmpdir.join("cgroup")
+    proc_cgroup.write("4:memory:/lxc/box\n1:cpu,cpuacct:/lxc/box\n")
+    cpu = tmpdir.mkdir("cpu").mkdir("lxc").mkdir("box")
+    cpu.join("cpu.cfs_quota_us").write("200000\n")
+    cpu.join("cpu.cfs_period_us").write("100000\n")
+    assert cgroup_cpu_limit(root, str(proc_cgroup)) == 2.0
+    memory = tmpdir.mkdir("memory").mkdir("lxc").mkdir("box")
+    memory.join("memory.limit_in_bytes").write("2147483648\n")
+    memory.join("memory.usage_in_bytes").write("0\n")
+    assert available_memory(root, str(tmpdir.join("none")),
+                            str(proc_cgroup)) == 2048
+
+
+class FakeController(JobController):
+    """Controller with the given load average and the children CPU time
+    that grows by 'own_load' CPUs.
+    """
+    def __init__(self, max_jobs, cpus, own_load, load_average):
+        self.own_load = own_load
+        self.load_average = load_average
+        self.cpu_time = 0.0
+        JobController.__init__(self, max_jobs, cpus, interval=2.0)
+
+    def _children_cpu_time(self):
+        return self.cpu_time
+
+    def _load_average(self):
+        return self.load_average
+
+    def measure(self, workers):
+        # As if 'interval' seconds have passed
+        self.last_time = time.time() - self.interval
+        self.cpu_time += self.own_load * self.interval
+        return self.update(workers)
+
+
+def test_job_controller():
+    # Each of 2 workers takes a CPU, the rest are idle
+    controller = FakeController(6, 8, own_load=2.0, load_average=2.0)
+    assert controller.update(2) is None
+    assert controller.measure(2) == 6
+    # Other processes load 4.5 CPUs
+    controller.load_average = 6.5
+    assert controller.measure(2) == 3
+    # Busy system: at least one worker is left
+    controller.load_average = 20.0
+    assert controller.measure(2) == 1
+    # No work was done by the commands
+    controller.own_load = 0
+    assert controller.measure(2) is None
+    assert controller.measure(0) is None
+
+
+def test_parse_jobs():
+    assert parse_jobs("3", 512) == 3
+    assert parse_jobs("auto", 512) >= 1
+    assert parse_jobs("AUTO", 0) >= 1
+    raises(ProgramError, parse_jobs, "0", 512)
+    raises(ProgramError, parse_jobs, "many", 512)
@@ -0,0 +1,37 @@
+from __future__ import unicode_literals
+
+import os
+
+from lnc.lib.jobserver import (JobServerClient, IMPLICIT_SLOT,
+                               _parse_makeflags)
+
+
+def test_parse_makeflags():
+    assert _parse_makeflags("") is None
+    assert _parse_makeflags("-j4") is None
+    assert _parse_makeflags(" -j8 --jobserver-fds=3,4") == ("fds", 3, 4)
+    assert _parse_makeflags("-j --jobserver-auth=5,6") == ("fds", 5, 6)
+    assert (_parse_makeflags("-j8 --jobserver-auth=fifo:/tmp/GMfifo1") ==
+            ("fifo", "/tmp/GMfifo1"))
+    assert (_parse_makeflags("--jobserver-fds=3,4 --jobserver-auth=7,8") ==
+            ("fds", 7, 8))
+
+
+def test_from_environment():
+    assert JobServerClient.from_environment({}) is None
+    assert JobServerClient.from_environment(
+        {"MAKEFLAGS": "-j4 --jobserver-auth=1000,1001"}) is None
+
+    read_fd, write_fd = os.pipe()
+    client = JobServerClient.from_environment(
+        {"MAKEFLAGS": "-j4 --jobserver-auth=%d,%d" % (read_fd, write_fd)})
+    assert client is not None
+    os.write(write_fd, b"+")
+    assert client.acquire(lambda: False) is IMPLICIT_SLOT
+    token = client.acquire(lambda: False)
+    assert token == b"+"
+    assert client.acquire(lambda: True) is None
+    client.release(token)
+    client.release(IMPLICIT_SLOT)
+    assert os.read(read_fd, 10) == b"+"
+    assert client.acquire(lambda: False) is IMPLICIT_SLOT
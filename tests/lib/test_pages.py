@@ -0,0 +1,129 @@
+from __future__ import unicode_literals
+
+import os
+from ConfigParser import SafeConfigParser
+from pytest import raises
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.pages import (FULL_MODE, SHARD_MODE, MERGE_MODE, PREVIEW_MODE,
+                           parse_page_range, set_build_mode, get_build_mode,
+                           get_page_range, list_shards)
+from lnc.plugins.base_plugin import BasePlugin
+
+
+def test_parse_page_range():
+    assert parse_page_range("120-135") == (120, 135)
+    assert parse_page_range(" 7 - 9 ") == (7, 9)
+    assert parse_page_range("12") == (12, 12)
+    for value in ["", "0-5", "10-5", "a-b", "1-2-3", "-5"]:
+        raises(ProgramError, parse_page_range, value)
+
+
+def test_build_mode():
+    conf = SafeConfigParser()
+    conf.add_section("global")
+    assert get_build_mode(conf) == FULL_MODE
+    assert get_page_range(conf) is None
+    set_build_mode(conf, SHARD_MODE, (10, 20))
+    assert get_build_mode(conf) == SHARD_MODE
+    assert get_page_range(conf) == (10, 20)
+    set_build_mode(conf, MERGE_MODE)
+    assert get_page_range(conf) is None
+
+
+def test_list_shards(tmpdir):
+    for name in ["0101-0200.djvu", "0001-0100.djvu", "0001-0100.pdf",
+                 "notes.djvu"]:
+        tmpdir.join(name).write("")
+    assert list_shards(str(tmpdir), ".djvu") == [
+        str(tmpdir.join("0001-0100.djvu")),
+        str(tmpdir.join("0101-0200.djvu"))]
+    assert list_shards(str(tmpdir), ".pdf") == [
+        str(tmpdir.join("0001-0100.pdf"))]
+
+    tmpdir.join("0150-0300.djvu").write("")
+    raises(ProgramError, list_shards, str(tmpdir), ".djvu")
+    raises(ProgramError, list_shards, str(tmpdir.join("missing")), ".djvu")
+    raises(ProgramError, list_shards, str(tmpdir), ".tiff")
+
+
+def test_list_shards_missing_ends(tmpdir):
+    for name in ["0011-0020.djvu", "0021-0030.djvu"]:
+        tmpdir.join(name).write("")
+    # Pages 1-10 are missing
+    raises(ProgramError, list_shards, str(tmpdir), ".djvu")
+    assert len(list_shards(str(tmpdir), ".djvu", set(range(11, 31)))) == 2
+    # Pages 31-35 are missing
+    raises(ProgramError, list_shards, str(tmpdir), ".djvu",
+           set(range(11, 36)))
+
+
+def _make_plugin(tmpdir, mode, page_range=None):
+    conf = SafeConfigParser()
+    conf.add_section("global")
+    conf.add_section("__djvu__")
+    conf.set("__djvu__", "shard-dir", str(tmpdir.join("shards")))
+    set_build_mode(conf, mode, page_range)
+    return BasePlugin(conf, "djvu")
+
+
+def test_assembly_files(tmpdir):
+    cache = tmpdir.mkdir("djvu")
+    for num in range(1, 6):
+        cache.join("%04d.djvu" % num).write("")
+    pages = [str(cache.join("%04d.djvu" % num)) for num in range(1, 6)]
+
+    plugin = _make_plugin(tmpdir, FULL_MODE)
+    assert plugin._get_assembly_files(str(cache), ".djvu", "out.djvu") == (
+        pages, "out.djvu")
+
+    plugin = _make_plugin(tmpdir, SHARD_MODE, (2, 4))
+    inputs, output = plugin._get_assembly_files(str(cache), ".djvu",
+                                                "out.djvu")
+    assert inputs == pages[1:4]
+    assert output == str(tmpdir.join("shards", "0002-0004.djvu"))
+    assert os.path.isdir(str(tmpdir.join("shards")))
+
+    tmpdir.join("shards", "0002-0004.djvu").write("")
+    plugin = _make_plugin(tmpdir, MERGE_MODE)
+    # Page 1 is missing
+    raises(ProgramError, plugin._get_assembly_files, str(cache), ".djvu",
+           "out.djvu")
+    tmpdir.join("shards", "0001-0001.djvu").write("")
+    assert plugin._get_assembly_files(str(cache), ".djvu", "out.djvu") == (
+        [str(tmpdir.join("shards", "0001-0001.djvu")),
+         str(tmpdir.join("shards", "0002-0004.djvu"))], "out.djvu")
+
+    # Page 5 of the prepared pages is missing
+    pages = tmpdir.mkdir("pages")
+    for num in range(1, 6):
+        pages.join("%04d.pnm" % num).write("")
+    plugin.conf.set("__djvu__", "in-cache-dir", str(pages))
+    raises(ProgramError, plugin._get_assembly_files, str(cache), ".djvu",
+           "out.djvu")
+
+
+def test_page_map(tmpdir):
+    pages = tmpdir.mkdir("pages")
+    for num in [3, 4, 7, 8, 10]:
+        pages.join("%04d.pnm" % num).write("")
+    conf = SafeConfigParser()
+    conf.add_section("global")
+    conf.add_section("__djvu_toc__")
+    conf.set("__djvu_toc__", "pages-dir", str(pages))
+    plugin = BasePlugin(conf, "djvu_toc")
+    assert plugin._get_page_map() is None
+
+    set_build_mode(conf, PREVIEW_MODE, (4, 8))
+    # Pages 4, 7 and 8 are the 2nd, 3rd and 4th ones in the document
+    assert plugin._get_page_map() == {2: 1, 3: 2, 4: 3}
+
+
+def test_remove_stale_pages(tmpdir):
+    for name in ["0001.djvu", "0002.djvu", "0005.djvu", "0007.djvu"]:
+        tmpdir.join(name).write("")
+    plugin = _make_plugin(tmpdir, PREVIEW_MODE, (2, 6))
+    plugin._remove_stale_pages(str(tmpdir), set([1, 2]))
+    # Page 7 is out of the range
+    assert sorted(os.listdir(str(tmpdir))) == ["0001.djvu", "0002.djvu",
+                                               "0007.djvu"]
@@ -0,0 +1,36 @@
+from __future__ import unicode_literals
+
+import os
+from pytest import raises
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.pagestore import PageStore, check_page_format
+
+
+def test_check_page_format():
+    assert check_page_format("tiff") == "tiff"
+    raises(ProgramError, check_page_format, "gif")
+    raises(ProgramError, PageStore, "pages", "jpeg")
+
+
+def test_pages(tmpdir):
+    for name in ["0001.pnm", "0002.png", "0010.tiff",
+                 "0003.png.1234.tmp", "notes.txt"]:
+        tmpdir.join(name).write("")
+    store = PageStore(str(tmpdir), "png")
+    assert store.pages() == {1: str(tmpdir.join("0001.pnm")),
+                             2: str(tmpdir.join("0002.png")),
+                             10: str(tmpdir.join("0010.tiff"))}
+    assert store.page_file(7) == str(tmpdir.join("0007.png"))
+
+    tmpdir.join("0001.png").write("")
+    raises(ProgramError, store.pages)
+    raises(ProgramError, PageStore(str(tmpdir.join("missing"))).pages)
+
+
+def test_remove_other_formats(tmpdir):
+    for name in ["0001.pnm", "0001.tiff", "0002.pnm", "0003.tiff"]:
+        tmpdir.join(name).write("")
+    PageStore(str(tmpdir), "tiff").remove_other_formats(set([1, 3]))
+    assert sorted(os.listdir(str(tmpdir))) == ["0001.tiff", "0002.pnm",
+                                               "0003.tiff"]
@@ -0,0 +1,133 @@
+from __future__ import unicode_literals
+
+import os
+import sys
+import errno
+import time
+from pytest import raises, fixture
+
+from lnc.lib.exceptions import ExtCommandError, CommandCancelledError
+from lnc.lib.process import (cmd_run, CommandContext, CommandPoller,
+                              set_context)
+
+
+@fixture()
+def context():
+    context = CommandContext()
+    set_context(context)
+    yield context
+    set_context(None)
+
+
+def python_cmd(code):
+    return [sys.executable, "-c", code]
+
+
+def assert_no_zombies():
+    try:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+    except OSError as err:
+        assert err.errno == errno.ECHILD
+    else:
+        assert pid == 0
+
+
+def test_cmd_run_output(context):
+    assert cmd_run(python_cmd("print('abc')")).strip() == b"abc"
+
+
+def test_cmd_run_failure(context):
+    raises(ExtCommandError, cmd_run, python_cmd("import sys; sys.exit(3)"))
+    raises(ExtCommandError, cmd_run, ["nonexistent-command-for-lnc-test"])
+
+
+def test_cmd_run_timeout(context):
+    context.timeout = 1
+    start_time = time.time()
+    with raises(ExtCommandError) as err:
+        cmd_run(python_cmd("import time; time.sleep(30)"))
+    assert time.time() - start_time < 5
+    assert "timeout" in str(err.value)
+    assert_no_zombies()
+
+
+def test_cmd_run_timeout_kills_children(context):
+    context.timeout = 1
+    code = ("import subprocess, sys; "
+            "subprocess.call([sys.executable, '-c', "
+            "'import time; time.sleep(30)'])")
+    start_time = time.time()
+    raises(ExtCommandError, cmd_run, python_cmd(code))
+    assert time.time() - start_time < 5
+
+
+def test_cmd_run_max_memory(context):
+    context.max_memory = 256
+    code = "x = bytearray(1024 * 1024 * 1024)"
+    raises(ExtCommandError, cmd_run, python_cmd(code))
+    context.max_memory = 0
+    cmd_run(python_cmd("x = bytearray(1024 * 1024)"))
+
+
+def test_cmd_run_cancelled(context):
+    context.cancel()
+    raises(CommandCancelledError, cmd_run, python_cmd("pass"))
+
+
+def run_polled(commands, context):
+    poller = CommandPoller()
+    results = []
+    for command in commands:
+        poller.start(command, context,
+                     lambda *result: results.append(result))
+    while len(poller):
+        poller.poll(0.1)
+    return results
+
+
+def test_poller_runs_commands_at_once():
+    start_time = time.time()
+    results = run_polled(
+        [python_cmd("import time; time.sleep(1); print(%d)" % i)
+         for i in range(20)], CommandContext())
+    assert time.time() - start_time < 5
+    assert sorted(int(output) for output, err, record in results) == \
+        list(range(20))
+    assert all(err is None for output, err, record in results)
+    assert all(record["argv"][0] == sys.executable
+               for output, err, record in results)
+    assert_no_zombies()
+
+
+def test_poller_failure():
+    results = run_polled([python_cmd("import sys; sys.exit(3)"),
+                          ["nonexistent-command-for-lnc-test"]],
+                         CommandContext())
+    assert len(results) == 2
+    assert all(isinstance(err, ExtCommandError)
+               for output, err, record in results)
+
+
+def test_poller_timeout():
+    start_time = time.time()
+    results = run_polled([python_cmd("import time; time.sleep(30)")],
+                         CommandContext(timeout=1))
+    assert time.time() - start_time < 5
+    assert "timeout" in str(results[0][1])
+    assert_no_zombies()
+
+
+def test_poller_cancelled():
+    context = CommandContext()
+    poller = CommandPoller()
+    results = []
+    poller.start(python_cmd("import time; time.sleep(30)"), context,
+                 lambda *result: results.append(result))
+    context.cancel()
+    poller.start(python_cmd("pass"), context,
+                 lambda *result: results.append(result))
+    while len(poller):
+        poller.poll(0.1)
+    assert len(results) == 2
+    assert all(isinstance(err, CommandCancelledError)
+               for output, err, record in results)
@@ -0,0 +1,70 @@
+from __future__ import unicode_literals
+
+import struct
+from pytest import raises, importorskip
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.raster import RasterView
+from lnc.lib.pagestore import PageStore
+
+
+def test_rgb(tmpdir):
+    f = tmpdir.join("0001.pnm")
+    pixels = b"".join(struct.pack(b"BBB", x, y, 7)
+                      for y in range(2) for x in range(3))
+    f.write(b"P6\n# comment\n3 2\n255\n" + pixels, "wb")
+    with PageStore(str(tmpdir)).raster(1) as view:
+        assert (view.width, view.height, view.channels) == (3, 2, 3)
+        assert view.pixels()[:] == pixels
+        assert view.row(1)[:] == pixels[9:]
+        raises(IndexError, view.row, 2)
+
+
+def test_pam_16bit(tmpdir):
+    f = tmpdir.join("1.pam")
+    f.write(b"P7\nWIDTH 2\nHEIGHT 1\nDEPTH 1\nMAXVAL 65535\n"
+            b"TUPLTYPE GRAYSCALE\nENDHDR\n" + b"\x01\x02\xff\xfe", "wb")
+    with RasterView(str(f)) as view:
+        assert view.sample_size == 2
+        assert view.row(0)[:] == b"\x01\x02\xff\xfe"
+
+
+def test_array(tmpdir):
+    numpy = importorskip("numpy")
+    f = tmpdir.join("1.pgm")
+    f.write(b"P5 2 2 255\n" + b"\x00\x01\x02\x03", "wb")
+    with RasterView(str(f)) as view:
+        array = view.array()
+        assert array.shape == (2, 2, 1)
+        assert numpy.array_equal(array[:, :, 0], [[0, 1], [2, 3]])
+
+
+def test_bilevel(tmpdir):
+    f = tmpdir.join("1.pnm")
+    # 10 pixels wide: two bytes per row, 1 is black
+    f.write(b"P4\n10 2\n" + b"\x80\x40" + b"\x7f\xc0", "wb")
+    with RasterView(str(f)) as view:
+        assert view.bilevel
+        assert (view.width, view.height, view.row_size) == (10, 2, 2)
+        assert view.row(1)[:] == b"\x7f\xc0"
+        assert view.samples(0) == bytearray(b"\0" + b"\xff" * 8 + b"\0")
+        assert view.samples(1) == bytearray(b"\xff" + b"\0" * 9)
+
+
+def test_bilevel_array(tmpdir):
+    numpy = importorskip("numpy")
+    f = tmpdir.join("1.pbm")
+    f.write(b"P4 3 1\n" + b"\xa0", "wb")
+    with RasterView(str(f)) as view:
+        assert view.array()[0, :, 0].tolist() == [0, 255, 0]
+
+
+def test_bad_images(tmpdir):
+    f = tmpdir.join("1.pnm")
+    f.write(b"P3\n1 1\n255\n0 0 0\n", "wb")
+    raises(ProgramError, RasterView, str(f))
+    # Truncated pixel data
+    f.write(b"P6\n10 10\n255\n\0\0\0", "wb")
+    raises(ProgramError, RasterView, str(f))
+    f.write(b"\x89PNG\r\n\x1a\n", "wb")
+    raises(ProgramError, RasterView, str(f))
@@ -4,7 +4,7 @@ from __future__ import unicode_literals, print_function
 from pytest import raises
 
 from lnc.lib.exceptions import ProgramError
-from lnc.lib.toc import read_toc, generate_toc, escape
+from lnc.lib.toc import read_toc, generate_toc, escape, remap_toc
 
 CORRECT_TOC_TEXT = """utf8
 
@@ -95,6 +95,21 @@ def test_print_toc(tmpdir):
     assert test_output.check()
     assert test_output.read() == res
 
+def test_remap_toc():
+    toc = [[1, "Chapter 1",
+            [2, "Page 2"],
+            [5, "Subchapter",
+             [6, "Caption"]]],
+           [10, "Chapter 2",
+            [12, "Another page"]]]
+    assert remap_toc(toc, {5: 1, 6: 2, 10: 3}) == [
+        [1, "Subchapter",
+         [2, "Caption"]],
+        [3, "Chapter 2"]]
+    assert remap_toc(toc, {12: 1}) == [[1, "Another page"]]
+    assert remap_toc(toc, {}) == []
+
+
 def test_escape():
     assert escape("123", "\"'") == "123"
     assert escape("1\"2'3" , "\"'") == "1\\\"2\\'3"
@@ -0,0 +1,43 @@
+from __future__ import unicode_literals
+
+import sys
+import json
+from pytest import raises
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.process import cmd_run
+from lnc.lib.trace import Tracer
+
+
+def test_trace_spans(tmpdir):
+    tracer = Tracer()
+    with tracer.span("target1", "before_tasks", 0):
+        pass
+    with tracer.span("target1", "task", 2, page=17):
+        cmd_run([sys.executable, "-c", "pass"])
+
+    filename = str(tmpdir.join("trace.json"))
+    tracer.write(filename)
+    with open(filename, "rt") as f:
+        events = json.load(f)["traceEvents"]
+
+    spans = [e for e in events if e["ph"] == "X"]
+    assert len(spans) == 3
+    assert spans[0]["name"] == "before_tasks"
+    assert spans[0]["tid"] == 0
+    task, command = spans[1:]
+    assert task["name"] == "task #17"
+    assert task["args"]["page"] == 17
+    assert task["tid"] == 2
+    assert command["args"]["argv"] == [sys.executable, "-c", "pass"]
+    assert command["args"]["cpu-time"] >= 0
+    assert command["ts"] >= task["ts"]
+    assert command["ts"] + command["dur"] <= task["ts"] + task["dur"]
+
+    names = [e for e in events if e["ph"] == "M"]
+    assert set(e["tid"] for e in names) == set([0, 2])
+
+
+def test_trace_write_error(tmpdir):
+    tracer = Tracer()
+    raises(ProgramError, tracer.write, str(tmpdir.join("no", "trace.json")))
@@ -0,0 +1,56 @@
+from __future__ import unicode_literals
+
+import os
+import threading
+import time
+
+from lnc.lib.watch import snapshot, changed_files, is_under, Watcher
+
+
+def test_snapshot(tmpdir):
+    sub = tmpdir.mkdir("input").mkdir("01-10")
+    sub.join("1.jpg").write("image")
+    tmpdir.join("toc.txt").write("toc")
+    state = snapshot([str(tmpdir.join("input")), str(tmpdir.join("toc.txt")),
+                      str(tmpdir.join("missing"))])
+    assert sorted(state) == [str(sub.join("1.jpg")),
+                             str(tmpdir.join("toc.txt"))]
+    assert state[str(sub.join("1.jpg"))][1] == 5
+
+
+def test_changed_files(tmpdir):
+    tmpdir.join("a").write("a")
+    tmpdir.join("b").write("b")
+    old = snapshot([str(tmpdir)])
+    tmpdir.join("a").remove()
+    tmpdir.join("b").write("bb")
+    tmpdir.join("c").write("c")
+    assert changed_files(old, snapshot([str(tmpdir)])) == set(
+        str(tmpdir.join(name)) for name in "abc")
+
+
+def test_is_under():
+    assert is_under("/p/input/01-10/1.jpg", "/p/input")
+    assert is_under("/p/input/01-10/1.jpg", "/p/input/")
+    assert is_under("/p/toc.txt", "/p/toc.txt")
+    assert not is_under("/p/input2/1.jpg", "/p/input")
+    assert not is_under("/p/toc.txt.bak", "/p/toc.txt")
+
+
+def test_watcher(tmpdir):
+    watcher = Watcher([str(tmpdir)], 0.05)
+    assert watcher.poll() == set()
+
+    def copy():
+        # File is written in several steps
+        for i in range(3):
+            with open(str(tmpdir.join("1.jpg")), "at") as f:
+                f.write("x" * 1000)
+            time.sleep(0.02)
+
+    thread = threading.Thread(target=copy)
+    thread.start()
+    assert watcher.wait() == set([str(tmpdir.join("1.jpg"))])
+    thread.join()
+    assert os.path.getsize(str(tmpdir.join("1.jpg"))) == 3000
+    assert watcher.poll() == set()
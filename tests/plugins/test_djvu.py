@@ -0,0 +1,74 @@
+from __future__ import unicode_literals
+
+import os
+import time
+from ConfigParser import SafeConfigParser
+from pytest import raises
+
+from lnc.lib.exceptions import ProgramError
+from lnc.plugins import djvu
+
+
+def test_check_unpacking(tmpdir, monkeypatch):
+    pages = tmpdir.mkdir("pages")
+    conf = SafeConfigParser()
+    conf.add_section("global")
+    conf.add_section("__djvu__")
+    conf.set("__djvu__", "in-cache-dir", str(pages))
+    plugin = djvu.Plugin(conf, "djvu")
+    # No convert to unpack the pages
+    monkeypatch.setenv(str("PATH"), str(tmpdir.mkdir("bin")))
+
+    plugin._check_unpacking()
+    pages.join("0001.pnm").write("")
+    plugin._check_unpacking()
+    pages.join("0002.png").write("")
+    raises(ProgramError, plugin._check_unpacking)
+
+
+def make_project(tmpdir, name, cache_dir):
+    project = tmpdir.mkdir(name)
+    conf = SafeConfigParser()
+    conf.add_section("global")
+    conf.set("global", "shared-cache-dir", str(cache_dir))
+    conf.add_section("__djvu__")
+    conf.set("__djvu__", "in-cache-dir", str(project.mkdir("pages")))
+    conf.set("__djvu__", "out-cache-dir", str(project.mkdir("djvu")))
+    conf.set("__djvu__", "djvu-file", str(project.join("notes.djvu")))
+    return project, djvu.Plugin(conf, "djvu")
+
+
+def get_tasks(plugin):
+    plugin.before_tasks()
+    return plugin.get_tasks()
+
+
+def test_cached_page_of_other_project(tmpdir, monkeypatch):
+    def encode(info):
+        encoded.append(info["num"])
+        with open(info["output"], "wb") as f:
+            f.write(b"encoded")
+
+    encoded = []
+    monkeypatch.setattr(djvu, "_encode", encode)
+    cache_dir = tmpdir.mkdir("cache")
+    now = int(time.time())
+    first, first_plugin = make_project(tmpdir, "first", cache_dir)
+    first.join("pages", "0001.pnm").write("page")
+    os.utime(str(first.join("pages", "0001.pnm")), (now - 1000, now - 1000))
+    for task in get_tasks(first_plugin):
+        djvu.handler(task)
+    os.utime(str(first.join("djvu", "0001.djvu")), (now - 900, now - 900))
+
+    # The same page is scanned later by another project
+    second, second_plugin = make_project(tmpdir, "second", cache_dir)
+    second.join("pages", "0001.pnm").write("page")
+    os.utime(str(second.join("pages", "0001.pnm")), (now - 100, now - 100))
+    tasks = get_tasks(second_plugin)
+    assert len(tasks) == 1
+    djvu.handler(tasks[0])
+    assert encoded == [1]
+    assert second.join("djvu", "0001.djvu").read("rb") == b"encoded"
+    # Nothing to do on the next run and the first project is not touched
+    assert get_tasks(second_plugin) == []
+    assert first.join("djvu", "0001.djvu").mtime() == now - 900
@@ -0,0 +1,159 @@
+from __future__ import unicode_literals
+
+import os.path
+import time
+import struct
+from ConfigParser import SafeConfigParser
+from pytest import raises
+
+from lnc.lib.exceptions import ProgramError
+from lnc.lib.pages import FULL_MODE, set_build_mode
+from lnc.plugins import prepare
+
+
+TRANSFORM = {
+    "justconvert": False,
+    "chop-edge": set(),
+    "chop-size": 15,
+    "chop-background": "black",
+    "rotate-odd": 0,
+    "rotate-even": 0,
+    "blur": 10,
+    "fuzz": 30}
+
+# Sampled 2 times to find the borders
+LARGE = {"num": 1, "pixels": 400, "large-page-pixels": 100}
+
+
+def transform(**options):
+    result = dict(TRANSFORM)
+    result.update(options)
+    return result
+
+
+def test_crop_area():
+    crop = (10, 20, 30, 40)
+    assert prepare._crop_area(crop, {"num": 1}, TRANSFORM) == crop
+    assert prepare._crop_area(
+        crop, {"num": 1}, transform(**{"chop-edge": set(["north"])})) == \
+        (10, 5, 30, 55)
+
+
+def test_crop_area_large():
+    crop = (10, 20, 30, 40)
+    # The edge sampled pixels stand for 2 pixels each
+    assert prepare._crop_area(crop, LARGE, TRANSFORM) == (20, 40, 62, 82)
+    # The chopped strips are 14 pixels wide on the sampled page
+    for edge, area in [("north", (20, 26, 62, 96)),
+                       ("east", (20, 40, 76, 82)),
+                       ("south", (20, 40, 62, 96)),
+                       ("west", (6, 40, 76, 82))]:
+        assert prepare._crop_area(
+            crop, LARGE, transform(**{"chop-edge": set([edge])})) == area
+
+
+def test_angle_large():
+    assert prepare._angle(LARGE, transform(**{"rotate-odd": 270})) == 270
+    assert prepare._angle({"num": 1}, transform(**{"rotate-odd": 3})) == 3
+    raises(ProgramError, prepare._angle, LARGE,
+           transform(**{"rotate-odd": 3}))
+
+
+def _write_pnm(filename, width, height):
+    # Only the header is read when the tasks are made
+    with open(filename, "wb") as f:
+        f.write(b"P5\n%d %d\n255\n" % (width, height))
+
+
+def _make_plugin(tmpdir):
+    conf = SafeConfigParser({"_CACHE": str(tmpdir.join("cache")),
+                             "_PROJECT": str(tmpdir),
+                             "_OUTPUT": "notes",
+                             "_SEP": os.sep})
+    config = os.path.join(os.path.dirname(__file__), "..", "..",
+                          "config.ini")
+    with open(config, "rt") as f:
+        conf.readfp(f)
+    conf.set("global", "jobs", "1")
+    conf.set("__prepare__", "input-dir", str(tmpdir.join("input")))
+    set_build_mode(conf, FULL_MODE)
+    return prepare.Plugin(conf, "prepare")
+
+
+def test_large_page_tasks(tmpdir):
+    pages = tmpdir.mkdir("input").mkdir("01-04")
+    pages.join("transform.ini").write("[transform]\n")
+    for num in [1, 3, 4]:
+        _write_pnm(str(pages.join("%d.pnm" % num)), 100, 100)
+    _write_pnm(str(pages.join("2.pnm")), 2000, 1000)
+    plugin = _make_plugin(tmpdir)
+    plugin.conf.set("__prepare__", "large-page-pixels", "1")
+    plugin.before_tasks()
+    tasks = plugin.get_tasks()
+    # The large page is processed alone with bounded memory,
+    # the following small pages are batched
+    assert [task["num"] for task in tasks] == [1, 2, 3]
+    assert "batch" not in tasks[1]
+    assert tasks[1]["__memory__"] == prepare.LARGE_PAGE_MEMORY
+    assert [task["num"] for task in tasks[2]["batch"]] == [3, 4]
+    assert tasks[0]["__memory__"] < prepare.LARGE_PAGE_MEMORY
+
+
+def _write_tiff(filename, frames):
+    """Writes little-endian TIFF with a single 2x2 strip for every frame
+    of 'frames' (list of pixel data).
+    """
+    data = b"II*\0" + struct.pack(b"<I", 8)
+    for index, pixels in enumerate(frames):
+        strip = len(data) + 2 + 4 * 12 + 4
+        next_ifd = strip + len(pixels) if index + 1 < len(frames) else 0
+        data += (struct.pack(b"<H", 4) +
+                 struct.pack(b"<HHIH2x", 256, 3, 1, 2) +
+                 struct.pack(b"<HHIH2x", 257, 3, 1, 2) +
+                 struct.pack(b"<HHII", 273, 4, 1, strip) +
+                 struct.pack(b"<HHII", 279, 4, 1, len(pixels)) +
+                 struct.pack(b"<I", next_ifd) + pixels)
+    with open(filename, "wb") as f:
+        f.write(data)
+
+
+def test_unchanged_container(tmpdir, monkeypatch):
+    def frame_digests(filename):
+        reads.append(filename)
+        return prepare_frame_digests(filename)
+
+    reads = []
+    prepare_frame_digests = prepare.frame_digests
+    monkeypatch.setattr(prepare, "frame_digests", frame_digests)
+    now = int(time.time())
+    pages = tmpdir.mkdir("input").mkdir("01-02")
+    pages.join("transform.ini").write("[transform]\n")
+    os.utime(str(pages.join("transform.ini")), (now - 1000, now - 1000))
+    scan = str(pages.join("scan.tiff"))
+    _write_tiff(scan, [b"aaaa", b"bbbb"])
+    plugin = _make_plugin(tmpdir)
+
+    def build():
+        plugin.before_tasks()
+        tasks = plugin.get_tasks()
+        nums = []
+        for task in tasks:
+            for page in task.get("batch", [task]):
+                nums.append(page["num"])
+                with open(page["output"], "wb") as f:
+                    f.write(b"page")
+                os.utime(page["output"], (now - 500, now - 500))
+        plugin._update_frame_index()
+        return nums
+
+    assert build() == [1, 2]
+    # The container is saved again with the same pages
+    _write_tiff(scan, [b"aaaa", b"bbbb"])
+    assert build() == []
+    assert len(reads) == 2
+    # and it is not read until it is changed
+    assert build() == []
+    assert len(reads) == 2
+    _write_tiff(scan, [b"aaaa", b"cccc"])
+    assert build() == [2]
+    assert len(reads) == 3
@@ -0,0 +1,21 @@
+# -*- coding: utf8 -*-
+from __future__ import unicode_literals, print_function
+
+from StringIO import StringIO
+from pytest import raises
+
+from lnc.lib.exceptions import ProgramError
+from lnc.batch import read_project_list
+
+
+def test_read_project_list():
+    f = StringIO("# Semester\n"
+                 "courses/algebra algebra\n"
+                 "\n"
+                 "  courses/my course   course  \n")
+    assert read_project_list(f) == [("courses/algebra", "algebra"),
+                                    ("courses/my course", "course")]
+
+
+def test_read_project_list_error():
+    raises(ProgramError, read_project_list, StringIO("lonely\n"))
@@ -0,0 +1,20 @@
+from __future__ import unicode_literals
+
+from pytest import importorskip
+
+from lnc.benchmark import compare_pages
+
+
+def test_compare_pages(tmpdir):
+    Image = importorskip("PIL.Image")
+    first = tmpdir.mkdir("first")
+    second = tmpdir.mkdir("second")
+    Image.new("L", (10, 10), 0).save(str(first.join("0001.pnm")))
+    Image.new("L", (10, 10), 51).save(str(second.join("0001.pnm")))
+    Image.new("L", (10, 10), 0).save(str(first.join("0002.pnm")))
+    Image.new("L", (10, 12), 0).save(str(second.join("0002.png")))
+    Image.new("L", (10, 10), 0).save(str(first.join("0003.pnm")))
+    assert compare_pages(str(first), str(second)) == [
+        (1, (10, 10), (10, 10), 20.0),
+        (2, (10, 10), (10, 12), None),
+        (3, (10, 10), None, None)]
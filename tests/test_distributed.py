@@ -0,0 +1,177 @@
+from __future__ import unicode_literals
+
+import time
+import threading
+from pytest import fixture, raises
+
+from mock.ui import MockUi
+from lnc.lib.exceptions import ProgramError, WorkerConnectionError
+from lnc.lib.process import CommandContext
+from lnc.lib.duplicates import page_digests
+from lnc.lib.distributed import (WorkerServer, RemoteWorker, is_shippable,
+                                 parse_worker_list, connect_workers)
+import lnc.main
+
+
+def upper_handler(info):
+    # Give remote workers a chance to take some tasks
+    time.sleep(0.01)
+    with open(info["input"], "rt") as f:
+        data = f.read()
+    with open(info["output"], "wt") as f:
+        f.write("%s %d" % (data.upper(), info["num"]))
+
+
+def digests_handler(info):
+    upper_handler(info)
+    info["page-digests"] = page_digests(info["output"])
+
+
+def failing_handler(info):
+    raise ProgramError("page %d is broken" % info["num"])
+
+
+def _start_server(jobs):
+    server = WorkerServer(("127.0.0.1", 0), jobs,
+                          modules=("test_distributed",))
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+@fixture
+def servers():
+    servers = [_start_server(2), _start_server(1)]
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _make_tasks(tmpdir, handler, count):
+    tasks = []
+    for num in range(count):
+        inp = tmpdir.join("%04d.txt" % num)
+        inp.write("page")
+        tasks.append({"__handler__": handler,
+                      "num": num,
+                      "input": str(inp),
+                      "output": str(tmpdir.join("%04d.out" % num))})
+    return tasks
+
+
+def _workers(servers):
+    return parse_worker_list(" ".join(
+        "127.0.0.1:%d" % server.server_address[1] for server in servers))
+
+
+def test_parse_worker_list():
+    workers = parse_worker_list("localhost:8766 10.0.0.2:1")
+    assert [(w.host, w.port) for w in workers] == [("localhost", 8766),
+                                                   ("10.0.0.2", 1)]
+    raises(ProgramError, parse_worker_list, "localhost")
+    raises(ProgramError, parse_worker_list, "localhost:port")
+
+
+def test_is_shippable(tmpdir):
+    task = _make_tasks(tmpdir, upper_handler, 1)[0]
+    assert is_shippable(task)
+    assert not is_shippable(dict(task, __handler__=lambda info: None))
+    assert not is_shippable(dict(task, __inputs__=["input", "missing"]))
+    assert not is_shippable(dict(task, __local__=True))
+    del task["output"]
+    assert not is_shippable(task)
+
+
+def test_connect_workers(servers):
+    connections, errors = connect_workers(_workers(servers))
+    assert len(connections) == 3
+    assert errors == []
+    for worker in connections:
+        worker.close()
+
+    worker = RemoteWorker("127.0.0.1", 1)
+    connections, errors = connect_workers([worker])
+    assert connections == []
+    assert len(errors) == 1
+    assert worker.broken
+
+
+def test_remote_tasks(servers, tmpdir):
+    tasks = _make_tasks(tmpdir, upper_handler, 30)
+    connections = connect_workers(_workers(servers))[0]
+    v = lnc.main.Variables(MockUi(), "target", list(tasks))
+    lnc.main.run_tasks_in_parallel(v, 1, remote_workers=connections)
+
+    assert v.errors == []
+    for task in tasks:
+        assert (open(task["output"]).read() == "PAGE %d" % task["num"])
+    assert sum(server.tasks_done for server in servers) > 0
+
+
+def test_remote_page_digests(servers, tmpdir):
+    task = _make_tasks(tmpdir, digests_handler, 1)[0]
+    worker = _workers(servers)[0]
+    worker.run_task(task, CommandContext())
+    worker.close()
+    # The page is not hashed again when the index is updated
+    assert task["page-digests"] == page_digests(task["output"])
+
+
+def test_remote_error(servers, tmpdir):
+    task = _make_tasks(tmpdir, failing_handler, 1)[0]
+    worker = _workers(servers)[0]
+    with raises(ProgramError) as err:
+        worker.run_task(task, CommandContext())
+    assert "page 0 is broken" in unicode(err.value)
+    worker.close()
+
+
+def test_handler_not_allowed(servers, tmpdir):
+    task = _make_tasks(tmpdir, upper_handler, 1)[0]
+    servers[0].modules = ("lnc.",)
+    worker = _workers(servers)[0]
+    with raises(ProgramError) as err:
+        worker.run_task(task, CommandContext())
+    assert "not allowed" in unicode(err.value)
+    worker.close()
+
+
+def test_lost_worker(servers, tmpdir):
+    tasks = _make_tasks(tmpdir, upper_handler, 10)
+    connections = connect_workers(_workers(servers[:1]))[0]
+    for worker in connections:
+        worker.close()
+    servers[0].shutdown()
+    servers[0].server_close()
+
+    # Tasks of the unreachable worker are run locally
+    v = lnc.main.Variables(MockUi(), "target", list(tasks))
+    lnc.main.run_tasks_in_parallel(v, 1, remote_workers=connections)
+    assert v.errors == []
+    for task in tasks:
+        assert (open(task["output"]).read() == "PAGE %d" % task["num"])
+    with raises(WorkerConnectionError):
+        connections[0].run_task(tasks[0], CommandContext())
+
+
+def test_remote_tasks_memory(tmpdir):
+    tasks = _make_tasks(tmpdir, upper_handler, 3)
+    for task in tasks:
+        task["__memory__"] = 80
+    tasks[2]["__local__"] = True
+    v = lnc.main.Variables(MockUi(), "target", list(tasks),
+                           memory_budget=100)
+    with v.lock:
+        # Remote tasks do not use the local memory budget
+        first = v.take_ready_task(remote=True)
+        second = v.take_ready_task(remote=True)
+        assert first is tasks[1] and second is tasks[0]
+        assert v.memory.used == 0
+        local = v.take_ready_task(remote=True)
+        assert local is tasks[2]
+        assert v.memory.used == 80
+        for task in [first, second, local]:
+            v.task_finished(task)
+    assert v.memory.used == 0
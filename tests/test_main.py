@@ -1,19 +1,28 @@
 # -*- coding: utf8 -*-
 from __future__ import unicode_literals, print_function
 
+import os
+import sys
+import thread
+import threading
 from time import sleep, time
 
+from pytest import raises
+
 from mock.ui import MockUi
+from lnc.lib.process import cmd_run
+from lnc.lib.jobserver import JobServerClient
 import lnc.main
 
 
-def create_variables(func, task_count):
+def create_variables(func, task_count, keep_going=False):
     """Use task list returned by this function because run_tasks_in_parallel()
     modifies task list that was passed to it."""
     tasks = []
     for i in range(task_count):
         tasks.append({"__handler__": func, "count": 0, "index": i})
-    variables = lnc.main.Variables(MockUi(), "target", tasks)
+    variables = lnc.main.Variables(MockUi(), "target", tasks,
+                                   keep_going=keep_going)
 
     return variables, [task for task in tasks]
 
@@ -97,6 +106,208 @@ def test_run_tasks_one_fail_many_threads():
     run_tasks_one_fail(10, 100)
 
 
+def run_tasks_keep_going(task_count, jobs):
+    def func(x):
+        x["count"] += 1
+        if x["index"] % 3 == 0:
+            raise Exception()
+
+    variables, tasks = create_variables(func, task_count, keep_going=True)
+    lnc.main.run_tasks_in_parallel(variables, jobs)
+
+    for task in tasks:
+        assert(task["count"] == 1)
+    assert(len(variables.errors) == (task_count + 2) // 3)
+    assert(variables.ui.progress == 1.0)
+
+
+def test_run_tasks_keep_going_single_threaded():
+    run_tasks_keep_going(1000, 1)
+
+
+def test_run_tasks_keep_going_multi_threaded():
+    run_tasks_keep_going(1000, 10)
+
+
+def test_run_tasks_keep_going_interrupted():
+    def func(x):
+        x["count"] += 1
+        if x["index"] == 96:
+            # Ctrl-C pressed while the task is running
+            thread.interrupt_main()
+            while not variables.context.cancelled:
+                sleep(0.01)
+
+    variables, tasks = create_variables(func, 100, keep_going=True)
+    raises(KeyboardInterrupt, lnc.main.run_tasks_in_parallel, variables, 1)
+    # The tasks are taken from the end
+    assert [task["index"] for task in tasks if task["count"]] == \
+        [96, 97, 98, 99]
+
+
+def test_failed_task_output_is_discarded(tmpdir):
+    output = tmpdir.join("0001.pnm")
+
+    def func(x):
+        output.write("incomplete")
+        raise Exception()
+
+    tasks = [{"__handler__": func, "output": str(output)}]
+    variables = lnc.main.Variables(MockUi(), "target", tasks,
+                                   keep_going=True)
+    lnc.main.run_tasks_in_parallel(variables, 1)
+
+    assert(len(variables.errors) == 1)
+    assert(not output.check())
+
+
+class StubController:
+    def __init__(self, suggestions):
+        self.suggestions = suggestions
+        self.workers = []
+
+    def update(self, workers):
+        self.workers.append(workers)
+        if self.suggestions:
+            return self.suggestions.pop(0)
+        return None
+
+
+def test_run_tasks_adaptive():
+    def func(x):
+        x["count"] += 1
+        sleep(0.01)
+
+    variables, tasks = create_variables(func, 300)
+    controller = StubController([1, None, None, 8, None, None, 2])
+    lnc.main.run_tasks_in_parallel(variables, 4, controller)
+
+    assert(len(variables.errors) == 0)
+    for task in tasks:
+        assert(task["count"] == 1)
+    assert(max(controller.workers) > 4)
+    assert(1 in controller.workers)
+
+
+def test_run_tasks_memory_budget():
+    state = {"used": 0, "peak": 0, "count": 0}
+    lock = threading.Lock()
+
+    def func(x):
+        with lock:
+            state["used"] += x["__memory__"]
+            state["peak"] = max(state["peak"], state["used"])
+            state["count"] += 1
+        sleep(0.01)
+        with lock:
+            state["used"] -= x["__memory__"]
+
+    tasks = [{"__handler__": func, "__memory__": 10 if i % 5 else 60}
+             for i in range(100)]
+    # Oversized task should still be run
+    tasks.append({"__handler__": func, "__memory__": 500})
+    variables = lnc.main.Variables(MockUi(), "target", tasks,
+                                   memory_budget=100)
+    lnc.main.run_tasks_in_parallel(variables, 10)
+
+    assert(len(variables.errors) == 0)
+    assert(state["count"] == 101)
+    assert(state["peak"] == 500 or state["peak"] <= 100)
+    assert(variables.memory.used == 0)
+
+
+def test_run_tasks_jobserver():
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b"++")
+    state = {"running": 0, "peak": 0}
+    lock = threading.Lock()
+
+    def func(x):
+        x["count"] += 1
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        sleep(0.01)
+        with lock:
+            state["running"] -= 1
+
+    variables, tasks = create_variables(func, 50)
+    variables.jobserver = JobServerClient(read_fd, write_fd)
+    lnc.main.run_tasks_in_parallel(variables, 10)
+
+    for task in tasks:
+        assert(task["count"] == 1)
+    # Two tokens and the implicit slot
+    assert(state["peak"] <= 3)
+    assert(os.read(read_fd, 10) == b"++")
+
+
+def test_worker_pool():
+    state = {"running": {}, "peak": {}}
+    lock = threading.Lock()
+
+    def func(x):
+        x["count"] += 1
+        target = x["target"]
+        with lock:
+            state["running"][target] = state["running"].get(target, 0) + 1
+            state["peak"][target] = max(state["peak"].get(target, 0),
+                                        state["running"][target])
+        sleep(0.01)
+        with lock:
+            state["running"][target] -= 1
+
+    pool = lnc.main.WorkerPool(6)
+    all_tasks = []
+    threads = []
+    for target, max_running in [("a", 1), ("b", 0), ("c", 2)]:
+        tasks = [{"__handler__": func, "count": 0, "target": target}
+                 for i in range(50)]
+        all_tasks += tasks
+        variables = lnc.main.Variables(MockUi(), target, list(tasks))
+        threads.append(threading.Thread(target=pool.run,
+                                        args=(variables, max_running)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.close()
+
+    for task in all_tasks:
+        assert(task["count"] == 1)
+    assert(state["peak"]["a"] == 1)
+    assert(state["peak"]["c"] <= 2)
+
+
+def test_worker_pool_jobserver():
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b"+")
+    pool = lnc.main.WorkerPool(2, 0, JobServerClient(read_fd, write_fd))
+    # No target is running yet: the workers wait for one
+    sleep(0.3)
+    assert(all(thread.is_alive() for thread in pool.threads))
+    for i in range(2):
+        variables, tasks = create_variables(lambda x: x.update(count=1), 10)
+        pool.run(variables)
+        assert(all(task["count"] == 1 for task in tasks))
+    pool.close()
+    assert(os.read(read_fd, 10) == b"+")
+
+
+def test_worker_pool_failure():
+    def func(x):
+        x["count"] += 1
+        raise Exception()
+
+    pool = lnc.main.WorkerPool(4)
+    variables, tasks = create_variables(func, 100)
+    pool.run(variables)
+    pool.close()
+
+    assert(len(variables.errors) >= 1)
+    assert(sum(task["count"] for task in tasks) <= 4)
+
+
 def test_execution_time():
     def func(x):
         x["count"] += 1
@@ -109,3 +320,110 @@ def test_execution_time():
 
     assert(total_time > 2.99)
     assert(total_time < 3.1)
+
+
+def test_failure_cancels_running_commands():
+    def func(x):
+        x["count"] += 1
+        if x["index"] == 0:
+            sleep(0.5)
+            raise Exception()
+        cmd_run([sys.executable, "-c", "import time; time.sleep(30)"])
+
+    variables, tasks = create_variables(func, 4)
+    start_time = time()
+    lnc.main.run_tasks_in_parallel(variables, 4)
+    total_time = time() - start_time
+
+    assert(len(variables.errors) == 1)
+    assert(total_time < 5)
+
+
+def create_command_variables(tmpdir, codes, keep_going=False):
+    tasks = []
+    for i, code in enumerate(codes):
+        output = str(tmpdir.join("%04d.txt" % i))
+        tasks.append({"__handler__": None, "output": output, "num": i,
+                      "__command__": [sys.executable, "-c",
+                                      code.format(output=output)]})
+    variables = lnc.main.Variables(MockUi(), "target", list(tasks),
+                                   keep_going=keep_going)
+    return variables, tasks
+
+
+def test_run_command_tasks(tmpdir):
+    code = "import time; time.sleep(0.5); open({output!r}, 'w')"
+    variables, tasks = create_command_variables(tmpdir, [code] * 40)
+    start_time = time()
+    lnc.main.run_tasks_in_parallel(variables, 20)
+
+    assert(time() - start_time < 5)
+    assert(len(variables.errors) == 0)
+    assert(variables.done == 40)
+    assert(variables.ui.progress == 1.0)
+    assert(all(os.path.exists(task["output"]) for task in tasks))
+
+
+def test_run_command_tasks_failure(tmpdir):
+    codes = (["open({output!r}, 'w'); raise SystemExit(1)"] +
+             ["import time; open({output!r}, 'w'); time.sleep(30)"] * 3)
+    variables, tasks = create_command_variables(tmpdir, codes)
+    start_time = time()
+    lnc.main.run_tasks_in_parallel(variables, 4)
+
+    assert(time() - start_time < 5)
+    assert(len(variables.errors) == 1)
+    assert(not any(os.path.exists(task["output"]) for task in tasks))
+
+
+def test_run_command_tasks_keep_going(tmpdir):
+    codes = ["open({output!r}, 'w')", "raise SystemExit(1)"] * 5
+    variables, tasks = create_command_variables(tmpdir, codes, True)
+    lnc.main.run_tasks_in_parallel(variables, 3)
+
+    assert(len(variables.errors) == 5)
+    assert(variables.done == 10)
+    assert(sum(os.path.exists(task["output"]) for task in tasks) == 5)
+
+
+def test_task_done_hook(tmpdir):
+    def func(x):
+        if x["index"] == 3:
+            raise Exception()
+
+    done = []
+    variables, tasks = create_variables(func, 10, keep_going=True)
+    variables.on_task_done = lambda task: done.append(task["index"])
+    lnc.main.run_tasks_in_parallel(variables, 4)
+    assert sorted(done) == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+
+    codes = ["open({output!r}, 'w')", "raise SystemExit(1)"]
+    variables, tasks = create_command_variables(tmpdir, codes, True)
+    done = []
+    variables.on_task_done = lambda task: done.append(task["num"])
+    lnc.main.run_tasks_in_parallel(variables, 2)
+    assert done == [0]
+
+
+def test_output_and_cache_names():
+    def names(**kwargs):
+        compiler = lnc.main.NotesCompiler(MockUi(), "program", "project",
+                                          "notes", **kwargs)
+        defaults = compiler.conf.defaults()
+        return defaults["_output"], defaults["_cache"]
+
+    cache = os.path.join("project", "cache")
+    assert names() == ("notes", cache)
+    assert names(draft=True) == ("notes-draft",
+                                 os.path.join(cache, "draft"))
+    assert names(mode=lnc.main.PREVIEW_MODE, page_range=(3, 5)) == (
+        "notes-pages-3-5", cache)
+
+
+def test_first_affected_target():
+    watched = [["/p/input"], [], ["/p/toc.txt"], [], ["/p/toc.txt"]]
+    assert lnc.main._first_affected(watched, set()) is None
+    assert lnc.main._first_affected(watched, set(["/p/other"])) is None
+    assert lnc.main._first_affected(watched, set(["/p/toc.txt"])) == 2
+    assert lnc.main._first_affected(
+        watched, set(["/p/toc.txt", "/p/input/01-10/1.jpg"])) == 0